@@ -1,66 +1,129 @@
 import argparse
-from iptables_tools.controls.exceptions import CommandNotFound, CommandPermissionError, RunCommandError
-from iptables_tools.controls.iptables import Management 
-
-
-class Main(Management):
-
-    def __call__(self, method_name, command, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        
-        try:
-            method = getattr(self, method_name)
-            return method(command)
-        except PermissionError as err:
-            self.roolback()
-            raise CommandPermissionError(method_name, command, err) from None
-        except RunCommandError:
-            self.roolback()
-            raise RunCommandError(method_name, command) from None
-        except CommandNotFound:
-            self.roolback()
-            raise CommandNotFound(method_name, command) from None
-        except Exception:
-            self.roolback()
-            raise
-    
-    def install(self, command):
-        self.install_setup()
-
-    def start(self, command):
-        self.start_setup()
-    
-    def stop(self, command):
-        self.stop_setup()
-
-    def restart(self):
-        self.restart_setup()
-
-    def run(self, command):
-        if not command:
-            raise RunCommandError
-
-        self.run_command(command) 
-
-    def roolback(self, command=None):
-        self.run_command('import-backup-rules')
+import os
+from iptables_tools.controls.aliases import alias_commands
+
 
 def cli():
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--apply-mode',
+        choices=['batch', 'rule'],
+        default='batch',
+        help="Aplica as regras em lote com iptables-restore (batch) ou uma por vez (rule)."
+    )
+    parser.add_argument(
+        '--backend',
+        choices=['iptables', 'nftables'],
+        default='iptables',
+        help="Aplica as regras com iptables/ip6tables ou em uma tabela inet do nftables."
+    )
+    parser.add_argument(
+        '--restart-mode',
+        choices=['reconcile', 'rebuild'],
+        default='reconcile',
+        help="No restart aplica apenas as regras alteradas (reconcile) ou recria todas (rebuild)."
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='use_cache',
+        action='store_false',
+        help="Não utiliza o cache das regras compiladas."
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help="Número de workers para compilar os arquivos e aplicar IPv4 e IPv6 em paralelo."
+    )
+    parser.add_argument(
+        '--layout',
+        choices=['flat', 'chains'],
+        help="Insere as regras direto na chain da configuração (flat) ou em uma chain própria para cada seção (chains). Por padrão o layout do último start, ou flat."
+    )
+    parser.add_argument(
+        '--aggregate',
+        action=argparse.BooleanOptionalAction,
+        help="Agrupa redes adjacentes ou contidas e remove as regras que nunca são avaliadas. Por padrão como no último start."
+    )
+    parser.add_argument(
+        '--multiport',
+        action=argparse.BooleanOptionalAction,
+        help="Agrupa em regras multiport as regras que diferem apenas na porta. Por padrão como no último start."
+    )
+    parser.add_argument(
+        '--ipset-threshold',
+        type=int,
+        help="Agrupa em um ipset hash:net as regras consecutivas que diferem apenas na origem ou no destino a partir deste número de regras (0 desativa). Por padrão o do último start."
+    )
+    parser.add_argument(
+        '--toml-parser',
+        choices=['tomllib', 'tomli', 'rtoml', 'toml'],
+        help="Biblioteca usada para ler os arquivos TOML, por padrão a primeira instalada (tomllib no Python 3.11+)."
+    )
     subparsers = parser.add_subparsers(dest="method")
 
     # Subparser para o método 'install'
     subparsers.add_parser('install', help="Instala o projeto")
-    subparsers.add_parser('roolback', help="Restaura as regras de firewall para o estado anterior a instalação")    
+    roolback_parser = subparsers.add_parser('roolback', help="Restaura as regras de firewall para o estado anterior a instalação")    
+    roolback_parser.add_argument(
+        '--snapshot',
+        dest='command',
+        help="Restaura um snapshot específico, veja a lista com iptables-tools snapshots."
+    )
+    subparsers.add_parser('snapshots', help="Lista os snapshots das regras, do mais recente para o mais antigo.")
     subparsers.add_parser('start', help="Utilize o systemd para iniciar o serviço.")
     subparsers.add_parser('stop', help="Utilize o systemd para iniciar o serviço.")
     subparsers.add_parser('restart', help="Utilize o systemd para iniciar o serviço.")
+    daemon_parser = subparsers.add_parser('daemon', help="Mantém as regras em memória e aplica as alterações de config-available.d automaticamente.")
+    daemon_parser.add_argument('--debounce', type=float, default=1.0, help="Segundos sem alterações antes de aplicar as regras.")
+
+    optimize_parser = subparsers.add_parser('optimize-order', help="Reordena as regras ativas para que as mais utilizadas sejam avaliadas primeiro.")
+    optimize_parser.add_argument('--reset', dest='command', action='store_true', help="Volta para a ordem dos arquivos de configuração.")
+
+    subparsers.add_parser('refresh-feeds', help="Atualiza os ipsets das listas de bloqueio (feed) com o conteúdo atual dos arquivos, sem alterar as regras.")
+
+    # Subparser para o método 'validate'
+    validate_parser = subparsers.add_parser('validate', help="Valida os arquivos de configuração sem alterar as regras, útil em CI.")
+    validate_parser.add_argument('files', nargs='*', help="Arquivos ou diretórios a validar, por padrão config-available.d.")
+
+    # Subparser para o método 'plan'
+    plan_parser = subparsers.add_parser('plan', help="Mostra os comandos que seriam executados, sem alterar as regras.")
+    plan_parser.add_argument('--operation', choices=['start', 'restart'], default='restart', help="Operação a simular.")
+    plan_parser.add_argument('--live', action='store_true', help="Compara com as regras carregadas no kernel em vez de config-active.d (requer root).")
+    plan_parser.add_argument('--json', dest='output_json', action='store_true', help="Exibe o resultado em JSON.")
+
+    # Subparser para o método 'stats'
+    stats_parser = subparsers.add_parser('stats', help="Exibe os contadores de pacotes e bytes das regras por serviço.")
+    stats_parser.add_argument('--format', dest='output_format', choices=['table', 'json', 'prometheus'], default='table', help="Formato da saída.")
+    stats_parser.add_argument('--output', help="Grava a saída no arquivo, por exemplo no diretório do textfile collector do node_exporter.")
+
+    # Subparser para o método 'push'
+    push_parser = subparsers.add_parser('push', help="Compila as regras uma vez e aplica em vários hosts, em ondas com canário.")
+    push_parser.add_argument('targets', nargs='*', help="Hosts de destino.")
+    push_parser.add_argument('--targets-file', help="Arquivo com um host por linha.")
+    push_parser.add_argument('--operation', choices=['start', 'restart'], default='restart', help="Operação aplicada nos hosts, a partir das regras carregadas em cada um.")
+    push_parser.add_argument('--transport', help="Transporte dos comandos: ssh (padrão), dry-run (apenas registra os comandos, para testes) ou pacote.modulo:Classe.")
+    push_parser.add_argument('--concurrency', type=int, default=10, help="Número máximo de hosts aplicando ao mesmo tempo.")
+    push_parser.add_argument('--canary', type=int, default=1, help="Hosts da primeira onda, qualquer falha interrompe o push.")
+    push_parser.add_argument('--batch', type=int, default=0, help="Hosts por onda após o canário (0 aplica todos em uma onda).")
+    push_parser.add_argument('--max-failures', type=int, default=0, help="Falhas toleradas antes de interromper o push.")
+    push_parser.add_argument('--timeout', type=float, help="Segundos máximos por host.")
+    push_parser.add_argument('--json', dest='output_json', action='store_true', help="Exibe o resultado em JSON.")
+
+    # Subparser para o método 'benchmark'
+    benchmark_parser = subparsers.add_parser('benchmark', help="Mede o tempo de compilação e aplicação com configurações sintéticas")
+    benchmark_parser.add_argument('--files', type=int, default=1, help="Número de arquivos TOML.")
+    benchmark_parser.add_argument('--sections', type=int, default=10, help="Número de seções por arquivo.")
+    benchmark_parser.add_argument('--mappings', type=int, default=100, help="Número de mappings por seção e família.")
+    benchmark_parser.add_argument('--families', type=int, choices=[1, 2], default=2, help="Apenas IPv4 (1) ou IPv4 e IPv6 (2).")
+    benchmark_parser.add_argument('--repeat', type=int, default=3, help="Número de repetições.")
+    benchmark_parser.add_argument('--startup', action='store_true', help="Mede apenas o tempo de inicialização dos comandos curtos.")
 
     # Subparser para o método 'run'
     execute_parser = subparsers.add_parser('run', help="Executa um comando específico")
     # Adiciona as opções para o subparser 'run'
-    for option, value in Management().alias_command_list().items():
+    for option, value in alias_commands().items():
         execute_parser.add_argument(
             f"--{option}",
             dest="command",
@@ -71,10 +134,108 @@ def cli():
 
     args = parser.parse_args()
 
-    method = args.method
+    # The compile processes inherit the parser through the environment
+    if args.toml_parser:
+        os.environ['IPTABLES_TOOLS_TOML_PARSER'] = args.toml_parser
+
+    method = args.method.replace('-', '_') if args.method else None
     command = args.command if hasattr(args, 'command') else None
 
-    Main(args)(method, command)
+    if method == 'validate':
+        from iptables_tools.controls.iptables import Management
+
+        Management(**management_options(args)).validate_setup(validate_files(args.files))
+        return
+
+    if method == 'plan':
+        from iptables_tools.controls.plan import print_plan
+
+        print_plan(
+            operation=args.operation,
+            live=args.live,
+            output_json=args.output_json,
+            **management_options(args)
+        )
+        return
+
+    if method == 'stats':
+        from iptables_tools.controls.iptables import Management
+        from iptables_tools.controls.stats import print_stats
+
+        management = Management(**management_options(args))
+        print_stats(
+            management,
+            management._config_files('config-active'),
+            output_format=args.output_format,
+            output=args.output
+        )
+        return
+
+    if method == 'push':
+        from iptables_tools.controls.push import push, read_targets
+
+        push(
+            read_targets(args.targets, args.targets_file),
+            operation=args.operation,
+            transport=args.transport,
+            concurrency=args.concurrency,
+            canary=args.canary,
+            batch=args.batch,
+            max_failures=args.max_failures,
+            timeout=args.timeout,
+            output_json=args.output_json,
+            **management_options(args)
+        )
+        return
+
+    if method == 'benchmark':
+        from iptables_tools.controls.benchmark import print_benchmark
+
+        print_benchmark(
+            files=args.files,
+            sections=args.sections,
+            mappings=args.mappings,
+            families=args.families,
+            repeat=args.repeat,
+            startup=args.startup,
+            **management_options(args)
+        )
+        return
+
+    from iptables_tools.main import Main
+
+    Main(**management_options(args))(method, command)
+
+def validate_files(paths):
+    """
+    Expand the directories passed to validate into their files
+    """
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, file) for file in os.listdir(path))
+        else:
+            files.append(path)
+
+    return files
+
+def management_options(args):
+    """
+    Return the global options passed to Management
+    """
+    return {
+        'backend': args.backend,
+        'apply_mode': args.apply_mode,
+        'restart_mode': args.restart_mode,
+        'use_cache': args.use_cache,
+        'workers': args.workers,
+        'ipset_threshold': args.ipset_threshold,
+        'aggregate': args.aggregate,
+        'multiport': args.multiport,
+        'layout': args.layout,
+        'debounce': getattr(args, 'debounce', None)
+    }
 
 if __name__ == "__main__":
     cli()
\ No newline at end of file
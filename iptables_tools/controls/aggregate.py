@@ -0,0 +1,172 @@
+import ipaddress
+
+
+DIRECTIONS = ['-s', '-d']
+
+# Only rules that end the evaluation can hide the rules after them
+TERMINAL_TARGETS = {'-j ACCEPT', '-j DROP'}
+
+ANY_NETWORK = {
+    'iptables': ipaddress.ip_network('0.0.0.0/0'),
+    'ip6tables': ipaddress.ip_network('::/0'),
+}
+
+def aggregate_rules(list_rules):
+    """
+    Collapse adjacent and contained networks of consecutive rules that
+    share everything else and drop the rules shadowed by a rule evaluated
+    before them. Returns the new rules and how many rules were removed
+    """
+    parsed = [(rule, _parse_rule(rule)) for rule in list_rules]
+    aggregated = _drop_shadowed(_collapse(parsed))
+
+    return aggregated, len(list_rules) - len(aggregated)
+
+def _parse_rule(rule):
+    """
+    Return the fields of a rule formatted by Management._format_rules, or
+    None for rules with options this pass does not understand
+    """
+    fields = dict.fromkeys([*DIRECTIONS, '-p', '--dport', '-m comment', '-j'])
+
+    for fragment in rule[3:]:
+        option, _, value = fragment.partition(' ')
+
+        if option in DIRECTIONS:
+            fields[option] = ipaddress.ip_network(value, strict=False)
+        elif fragment.startswith('-m comment '):
+            fields['-m comment'] = fragment
+        elif option in fields:
+            fields[option] = fragment
+        else:
+            return
+
+    if not fields['-j']:
+        return
+
+    return fields
+
+def _format_rule(rule, fields):
+    return (
+        *rule[:3],
+        *[f'{option} {fields[option]}' for option in DIRECTIONS if fields[option]],
+        *[fields[option] for option in ['-p', '--dport', '-m comment', '-j'] if fields[option]]
+    )
+
+def _run_key(rule, fields, option):
+    if not fields or not fields[option]:
+        return
+
+    return (
+        option,
+        rule[0],
+        rule[2],
+        *[value for key, value in fields.items() if key not in (option, '-m comment')]
+    )
+
+def _collapse(parsed):
+    """
+    Merge the networks of runs of consecutive rules that differ only in
+    the address of one direction
+    """
+    collapsed = []
+    index = 0
+
+    while index < len(parsed):
+        rule, fields = parsed[index]
+        option = next((option for option in DIRECTIONS if _run_key(rule, fields, option)), None)
+
+        if not option:
+            collapsed.append((rule, fields))
+            index += 1
+            continue
+
+        key = _run_key(rule, fields, option)
+        run = []
+        while index < len(parsed) and _run_key(*parsed[index], option) == key:
+            run.append(parsed[index])
+            index += 1
+
+        for network in ipaddress.collapse_addresses(fields[option] for _, fields in run):
+            # Keep the comment of the first rule covered by the new network
+            comment = next(
+                fields['-m comment'] for _, fields in run
+                if fields[option].subnet_of(network)
+            )
+            merged = {**fields, option: network, '-m comment': comment}
+            collapsed.append((_format_rule(rule, merged), merged))
+
+    return collapsed
+
+class _Coverage:
+    """
+    Destination and source networks matched by the terminal rules already
+    walked. The pairs are indexed by prefix length, so a pair covering a
+    rule is found by masking its addresses once for each indexed length
+    instead of building every supernet
+    """
+
+    def __init__(self):
+        self.pairs = {}
+        self.prefixes = set()
+
+    def add(self, destination, source):
+        key = (destination.prefixlen, int(destination.network_address))
+        sources = self.pairs.setdefault(key, {})
+        sources.setdefault(source.prefixlen, set()).add(int(source.network_address))
+        self.prefixes.add(destination.prefixlen)
+
+    def covers(self, destination, source):
+        bits = destination.max_prefixlen
+        destination_address = int(destination.network_address)
+        source_address = int(source.network_address)
+
+        for prefix in self.prefixes:
+            if prefix > destination.prefixlen:
+                continue
+
+            sources = self.pairs.get((prefix, _masked(destination_address, bits, prefix)))
+
+            if sources and any(
+                _masked(source_address, bits, length) in addresses
+                for length, addresses in sources.items()
+                if length <= source.prefixlen
+            ):
+                return True
+
+        return False
+
+def _masked(address, bits, prefix):
+    """
+    Return the address of the supernet with the prefix length
+    """
+    return address >> (bits - prefix) << (bits - prefix)
+
+def _drop_shadowed(parsed):
+    """
+    Drop the rules that never match because a rule evaluated before them
+    matches all their packets. Rules inserted later with -I are evaluated
+    first, so the list is walked backwards
+    """
+    kept = []
+    matched = {}
+
+    for rule, fields in reversed(parsed):
+        if not fields:
+            kept.append(rule)
+            continue
+
+        any_network = ANY_NETWORK[rule[0]]
+        source = fields['-s'] or any_network
+        destination = fields['-d'] or any_network
+        seen = matched.setdefault((rule[0], rule[2], fields['-p'], fields['--dport']), _Coverage())
+
+        if seen.covers(destination, source):
+            continue
+
+        if fields['-j'] in TERMINAL_TARGETS:
+            seen.add(destination, source)
+
+        kept.append(rule)
+
+    return kept[::-1]
@@ -0,0 +1,80 @@
+from functools import cache
+from .utils import all_project_files
+
+
+def _step(*argv, stdin=None, stdout=None):
+    return {'argv': argv, 'stdin': stdin, 'stdout': stdout}
+
+@cache
+def alias_commands():
+    """
+    Return the commands available to run, built once per process. Each
+    command is a list of steps run in order until one fails, with the
+    redirects done by Python instead of a shell
+    """
+    files = all_project_files()
+
+    return {
+        'export-backup-rules': {
+            'cmd': [
+                _step('iptables-save', stdout=files['bkp_rules_v4']),
+                _step('ip6tables-save', stdout=files['bkp_rules_v6'])
+            ],
+            'description': 'Export backup IPv4 and IPv6 rules in iptables format.',
+            'success_message': f"Successful IPv4 and IPv6 backup rules in {files['bkp_rules_v4']} and {files['bkp_rules_v6']}."
+        },
+        'import-backup-rules': {
+            'cmd': [
+                _step('iptables-restore', stdin=files['bkp_rules_v4']),
+                _step('ip6tables-restore', stdin=files['bkp_rules_v6'])
+            ],
+            'description': 'Import backup IPv4 and IPv6 rules in iptables format.',
+            'success_message': f"Restored successful IPv4 and IPv6 backup rules in {files['bkp_rules_v4']} and {files['bkp_rules_v6']}."
+        },
+        'export-rules': {
+            'cmd': [
+                _step('iptables-save', stdout=files['exp_rules_v4']),
+                _step('ip6tables-save', stdout=files['exp_rules_v6'])
+            ],
+            'description': 'Export IPv4 and IPv6 rules in iptables format.',
+            'success_message': f"Rules IPv4 and IPv6 exported successfully in {files['exp_rules_v4']} and {files['exp_rules_v6']}."
+        },
+        'import-rules': {
+            'cmd': [
+                _step('iptables-restore', stdin=files['exp_rules_v4']),
+                _step('ip6tables-restore', stdin=files['exp_rules_v6'])
+            ],
+            'description': 'Import IPv4 and IPv6 rules in iptables format.',
+            'success_message': 'Rules IPv4 and IPv6 imported successfully.'
+        },
+        'export-rules-v4': {
+            'cmd': [_step('iptables-save', stdout=files['exp_rules_v4'])],
+            'description': 'Export IPv4 rules in iptables format.',
+            'success_message': f"Rules IPv4 exported successfully in {files['exp_rules_v4']}."
+        },
+        'import-rules-v4': {
+            'cmd': [_step('iptables-restore', stdin=files['exp_rules_v4'])],
+            'description': 'Import IPv4 rules in iptables format.',
+            'success_message': 'Rules IPv4 imported successfully.'
+        },
+        'export-rules-v6': {
+            'cmd': [_step('ip6tables-save', stdout=files['exp_rules_v6'])],
+            'description': 'Export IPv6 rules in iptables format.',
+            'success_message': f"Rules v6 exported successfully in {files['exp_rules_v6']}."
+        },
+        'import-rules-v6': {
+            'cmd': [_step('ip6tables-restore', stdin=files['exp_rules_v6'])],
+            'description': 'Import IPv6 rules in iptables format.',
+            'success_message': 'Rules IPv6 imported successfully.'
+        },
+        'systemctl-reload': {
+            'cmd': [_step('systemctl', 'daemon-reload')],
+            'description': 'Reload the systemd manager configuration.',
+            'success_message': 'Systemd manager configuration reloaded successfully.'
+        },
+        'systemctl-enable': {
+            'cmd': [_step('systemctl', 'enable', 'iptables-tools')],
+            'description': 'Enabled the iptables-tools service.',
+            'success_message': 'Service iptables-tools enabled successfully.'
+        },
+    }
@@ -0,0 +1,207 @@
+import logging
+from .chains import set_operation
+from .exceptions import CommandCalledError
+from .feeds import rule_feeds
+from .ipset import compact_rules
+from .kernel import FAMILIES, save_binary
+from .nftables import TABLE, render_delete_script, render_nft_script
+from .ordering import load_order, order_rules
+from .reconcile import diff_rules
+from .restore import render_restore_payload, restore_binary
+
+
+class IptablesBackend:
+    """
+    Apply the rules with iptables and ip6tables, in the tables shared with
+    other tools. The rules are changed one by one, through the commands of
+    the management
+    """
+    name = 'iptables'
+    snapshot_keys = set(FAMILIES)
+
+    # optimize-order reads and keeps the counters of each rule
+    orders_rules = True
+
+    # Only the rules that change are applied
+    replaces_table = False
+
+    def __init__(self, management):
+        self.management = management
+
+    def optimize(self, list_rules):
+        """
+        Return the rules with the runs of addresses moved to ipsets and in
+        the order saved by optimize-order, along with their ipsets
+        """
+        management = self.management
+        list_rules, ipsets = compact_rules(list_rules, management.ipset_threshold)
+        ipsets.update(rule_feeds(list_rules))
+
+        # The order saved by optimize-order keeps the kernel and the
+        # compiled rules in the same order
+        if management.order is None:
+            management.order = load_order()
+
+        if management.order:
+            list_rules = order_rules(list_rules, management.order)
+
+        return list_rules, ipsets
+
+    def render(self, list_rules):
+        """
+        Return the iptables-restore payload that inserts the rules
+        """
+        return render_restore_payload(list_rules)
+
+    def apply(self, list_rules, ipsets):
+        self.management._create_ipsets(ipsets)
+
+        if list_rules:
+            self.management._apply_rules(list_rules, 'insert')
+
+    def delete(self, list_rules, ipsets):
+        """
+        Delete the rules still loaded, then the ipsets they used
+        """
+        if list_rules := set_operation(list_rules, 'delete'):
+            list_rules = self.management._loaded_rules(list_rules)
+
+        if list_rules:
+            self.management._apply_rules(list_rules, 'delete')
+
+        self.management._destroy_ipsets(ipsets)
+
+    def replace(self, list_rules):
+        self.management._delete_rules()
+        self.management._set_compiled_rules('insert', list_rules)
+
+    def reconcile(self, active, available):
+        """
+        Apply the delete and insert operations that turn the active compiled
+        rules into the available ones
+        """
+        management = self.management
+        compiled = available
+        active, active_ipsets = management._applied_management()._optimize_rules(active)
+        available, available_ipsets = management._optimize_rules(available)
+
+        # The positions come from the loaded chains, which may hold rules
+        # of other tools above or between the managed ones
+        try:
+            state = management.kernel_state()
+            deletes, inserts, unchanged = diff_rules(active, available, state)
+        except (CommandCalledError, LookupError) as err:
+            logging.warning(f'Unable to reconcile with the loaded rules, rebuilding all rules.\n{err}')
+            self.replace(compiled)
+            return
+
+        deletes = management._loaded_rules(deletes, state)
+        logging.info(
+            f'Rules to delete: {len(deletes)}, to insert: {len(inserts)}, unchanged: {unchanged}.'
+        )
+
+        management._create_ipsets(available_ipsets)
+
+        if not deletes and not inserts:
+            return
+
+        try:
+            if management.apply_mode == 'rule':
+                management._run_rules(deletes, 'delete')
+                management._run_rules(inserts, 'insert')
+            else:
+                management._restore_rules(deletes + inserts, 'insert')
+        except CommandCalledError as err:
+            logging.warning(f'Reconcile failed, rebuilding all rules.\n{err}')
+            self.replace(compiled)
+            return
+
+        management._destroy_ipsets(active_ipsets.keys() - available_ipsets.keys())
+        logging.info('Rules reconciled successfully.')
+
+    def snapshot(self):
+        """
+        Return the loaded rules of each family, or None when they can't be
+        read
+        """
+        outputs = {}
+
+        for binary in FAMILIES:
+            result = self.management._run_subprocess(save_binary(binary))
+
+            if result.returncode != 0:
+                logging.warning(f'Unable to take a snapshot of the rules.\n{result.stderr}')
+                return
+
+            outputs[binary] = result.stdout
+
+        return outputs
+
+    def restore(self, outputs):
+        for binary, output in outputs.items():
+            self._run(restore_binary(binary).replace(' --noflush', ''), output)
+
+    def _run(self, input, payload):
+        result = self.management._run_subprocess(input, payload)
+
+        if result.returncode != 0:
+            raise CommandCalledError('run', input, result.stderr)
+
+class NftablesBackend(IptablesBackend):
+    """
+    Apply the rules in an inet table of nftables, replaced as a whole in a
+    single atomic transaction
+    """
+    name = 'nftables'
+    snapshot_keys = {'nft'}
+    orders_rules = False
+    replaces_table = True
+
+    def optimize(self, list_rules):
+        # nftables matches the addresses with native sets
+        return list_rules, {}
+
+    def render(self, list_rules):
+        return render_nft_script(list_rules)
+
+    def apply(self, list_rules, ipsets):
+        with self.management.metrics.phase('nft_rules'):
+            self._run('nft -f -', self.render(list_rules))
+
+    def delete(self, list_rules, ipsets):
+        with self.management.metrics.phase('nft_rules'):
+            self._run('nft -f -', render_delete_script())
+
+    def replace(self, list_rules):
+        self.management._set_compiled_rules('insert', list_rules)
+
+    def reconcile(self, active, available):
+        self.replace(available)
+
+    def snapshot(self):
+        result = self.management._run_subprocess(f'nft list table inet {TABLE}')
+
+        # The table does not exist before the first start
+        return {'nft': result.stdout if result.returncode == 0 else ''}
+
+    def restore(self, outputs):
+        self._run('nft -f -', render_delete_script() + outputs['nft'])
+
+BACKENDS = {
+    'iptables': IptablesBackend,
+    'nftables': NftablesBackend,
+}
+
+def load_backend(name, management):
+    return BACKENDS[name](management)
+
+def snapshot_backend(outputs, management):
+    """
+    Return the backend that took the snapshot, which may not be the one
+    selected for this run
+    """
+    return next(
+        backend(management)
+        for backend in BACKENDS.values()
+        if set(outputs) <= backend.snapshot_keys
+    )
@@ -0,0 +1,165 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from .iptables import Management
+from .utils import read_toml_file, tool_version
+
+
+class RecordingManagement(Management):
+    """
+    Management that records the commands instead of running them, so the
+    pipeline can be measured without root or netfilter
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = []
+
+    def _run_subprocess(self, command, input=None, stdin=None, stdout=None):
+        # Streamed payloads are consumed so rendering is part of the apply
+        if input is not None and not isinstance(input, str):
+            for _ in input:
+                pass
+
+        self.commands.append(command)
+        return subprocess.CompletedProcess(command, 0, stdout='', stderr='')
+
+def generate_config(service, sections, mappings, families, port=1024):
+    """
+    Return a synthetic TOML configuration with the given number of sections
+    and mappings for each family
+    """
+    lines = [f'[{service}]']
+
+    for section in range(sections):
+        name = f'{service}.section{section}'
+        lines.extend([
+            f'[{name}]',
+            'protocol = "tcp"',
+            'chain = "INPUT"',
+            f'port = {port + section}',
+        ])
+
+        for version in ['ipv4', 'ipv6'][:families]:
+            lines.extend([f'[{name}.{version}.accept]', 'mapping = ['])
+            lines.extend(
+                f"    {{src='{_address(version, section, mapping)}', comment='{service} {section} {mapping}'}},"
+                for mapping in range(mappings)
+            )
+            lines.extend([']', f'[{name}.{version}.drop]', 'mapping = [', f"    {{comment='drop {section}'}},", ']'])
+
+    return '\n'.join([*lines, ''])
+
+def _address(version, section, mapping):
+    if version == 'ipv4':
+        return f'10.{section % 256}.{mapping // 256 % 256}.{mapping % 256}'
+
+    return f'2001:db8:{section:x}::{mapping:x}'
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def run_benchmark(files=1, sections=10, mappings=100, families=2, repeat=3, **options):
+    """
+    Time the parse, compile, render and apply stages of the pipeline for a
+    synthetic configuration and return the results as a dict
+    """
+    management = RecordingManagement(**{**options, 'use_cache': False})
+    stages = {stage: [] for stage in ['parse', 'compile', 'render', 'apply']}
+
+    with tempfile.TemporaryDirectory() as path:
+        config_files = []
+
+        for index in range(files):
+            config_files.append(f'{path}/service{index}.toml')
+            with open(config_files[-1], 'w') as f:
+                f.write(generate_config(f'service{index}', sections, mappings, families))
+
+        for _ in range(repeat):
+            management.commands.clear()
+
+            configs, elapsed = _timed(lambda: [read_toml_file(file) for file in config_files])
+            stages['parse'].append(elapsed)
+
+            def compile_rules():
+                list_rules = []
+                for config in configs:
+                    list_rules.extend(management._format_toml(data=config, type_run='insert'))
+                return management._optimize_rules(list_rules)
+
+            (list_rules, _), elapsed = _timed(compile_rules)
+            stages['compile'].append(elapsed)
+
+            _, elapsed = _timed(management.backend.render, list_rules)
+            stages['render'].append(elapsed)
+
+            _, elapsed = _timed(management.backend.apply, list_rules, {})
+            stages['apply'].append(elapsed)
+
+        config_size = sum(os.path.getsize(file) for file in config_files)
+
+    return {
+        'version': tool_version(),
+        'python': platform.python_version(),
+        'options': options,
+        'config': {
+            'files': files,
+            'sections': sections,
+            'mappings': mappings,
+            'families': families,
+            'bytes': config_size,
+        },
+        'rules': len(list_rules),
+        'subprocess_calls': len(management.commands),
+        'stages': {
+            stage: {
+                'min': min(values),
+                'mean': statistics.mean(values),
+            }
+            for stage, values in stages.items()
+        },
+    }
+
+STARTUP_COMMANDS = {
+    'import': ['-c', 'import iptables_tools.cli'],
+    'help': ['-m', 'iptables_tools.cli', '--help'],
+    'run-help': ['-m', 'iptables_tools.cli', 'run', '--help'],
+}
+
+def run_startup_benchmark(repeat=10):
+    """
+    Time the start of a new interpreter for the short commands, which run
+    on every boot and health check
+    """
+    commands = {'python': ['-c', 'pass'], **STARTUP_COMMANDS}
+    results = {}
+
+    for name, args in commands.items():
+        values = []
+
+        for _ in range(repeat):
+            _, elapsed = _timed(subprocess.run, [sys.executable, *args], capture_output=True)
+            values.append(elapsed)
+
+        results[name] = {'min': min(values), 'mean': statistics.mean(values)}
+
+    return {
+        'version': tool_version(),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'startup': results,
+    }
+
+def print_benchmark(startup=False, **kwargs):
+    if startup:
+        print(json.dumps(run_startup_benchmark(kwargs.get('repeat')), indent=2))
+        return
+
+    print(json.dumps(run_benchmark(**kwargs), indent=2))
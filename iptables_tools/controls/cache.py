@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+from .utils import all_project_path, tool_version
+
+
+MAX_ENTRIES = 256
+
+def cache_key(file, *options):
+    """
+    Return the hash of the file content, the tool version and the options
+    that change the compiled rules
+    """
+    digest = hashlib.sha256(' '.join([tool_version(), *options]).encode())
+
+    with open(file, 'rb') as f:
+        digest.update(f.read())
+
+    return digest.hexdigest()
+
+def load_cache(key):
+    """
+    Return the compiled rules stored for the key or None
+    """
+    file = f"{all_project_path('cache')}/{key}.json"
+
+    try:
+        with open(file) as f:
+            rules = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    # Marks the entry as recently used, read only users still get the rules
+    try:
+        os.utime(file)
+    except OSError:
+        pass
+
+    return rules
+
+def save_cache(key, rules):
+    """
+    Store the compiled rules for the key, keeping only the most recently
+    used entries
+    """
+    path = all_project_path('cache')
+    os.makedirs(path, exist_ok=True)
+
+    tmp = f'{path}/{key}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(rules, f)
+    os.replace(tmp, f'{path}/{key}.json')
+
+    entries = sorted(
+        (entry for entry in os.scandir(path) if entry.name.endswith('.json')),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in entries[MAX_ENTRIES:]:
+        os.remove(entry.path)
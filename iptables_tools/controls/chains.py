@@ -0,0 +1,80 @@
+import hashlib
+import re
+
+
+CHAIN_PREFIX = 'IPT_TOOLS_'
+
+# iptables accepts chain names up to 28 characters
+CHAIN_MAX_LENGTH = 28
+
+def service_chain_name(service, section):
+    """
+    Return the user defined chain of a configuration section
+    """
+    name = re.sub(r'[^A-Za-z0-9_]', '_', f'{service}_{section}')
+
+    if len(CHAIN_PREFIX) + len(name) > CHAIN_MAX_LENGTH:
+        digest = hashlib.sha1(name.encode()).hexdigest()[:6]
+        name = f'{name[:CHAIN_MAX_LENGTH - len(CHAIN_PREFIX) - 7]}_{digest}'
+
+    return f'{CHAIN_PREFIX}{name}'
+
+def is_service_chain(chain):
+    return chain.startswith(CHAIN_PREFIX)
+
+def service_chain_rules(list_rules, name, chain, matches):
+    """
+    Move the rules of a section to its own chain and return the commands
+    that create the chain, fill it and jump to it from the base chain for
+    each of the matches
+    """
+    families = dict.fromkeys(rule[0] for rule in list_rules)
+    operation = list_rules[0][1]
+
+    return [
+        *[(binary, '-N', name) for binary in families],
+        *[(binary, operation, name, *rule) for binary, operation, _, *rule in list_rules],
+        *[
+            (binary, operation, chain, *match, f'-j {name}')
+            for binary in families
+            for match in matches
+        ]
+    ]
+
+def split_service_chains(list_rules):
+    """
+    Separate the rules of the base chains from the rules of each service
+    chain, indexed by family and chain name
+    """
+    base = []
+    chains = {}
+
+    for rule in list_rules:
+        if rule[1] == '-N':
+            chains.setdefault((rule[0], rule[2]), [])
+        elif is_service_chain(rule[2]):
+            chains.setdefault((rule[0], rule[2]), []).append(rule)
+        else:
+            base.append(rule)
+
+    return base, chains
+
+def set_operation(list_rules, type_run):
+    """
+    Return the commands of the compiled rules for the operation. Deleting a
+    service chain removes its jump rules and then flushes and deletes the
+    chain, instead of deleting its rules one by one
+    """
+    if type_run == 'insert':
+        return list_rules
+
+    base, chains = split_service_chains(list_rules)
+
+    return [
+        *[(rule[0], '-D', *rule[2:]) for rule in base],
+        *[
+            command
+            for binary, name in chains
+            for command in ((binary, '-F', name), (binary, '-X', name))
+        ]
+    ]
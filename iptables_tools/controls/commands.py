@@ -0,0 +1,32 @@
+import shlex
+from functools import cache
+
+
+def split_command(command):
+    """
+    Return the argv of a command, strings are split the way the shell
+    would without starting one
+    """
+    return shlex.split(command) if isinstance(command, str) else list(command)
+
+def join_command(command):
+    """
+    Return the command as a single line, for logs and error messages
+    """
+    return command if isinstance(command, str) else shlex.join(command)
+
+@cache
+def fragment_argv(fragment):
+    return tuple(shlex.split(fragment))
+
+def rule_argv(rule):
+    """
+    Return the argv of a compiled rule, the fragments shared by many
+    rules are split only once
+    """
+    argv = list(rule[:3])
+
+    for fragment in rule[3:]:
+        argv.extend(fragment_argv(fragment))
+
+    return argv
@@ -0,0 +1,96 @@
+import json
+import marshal
+import os
+import sys
+from .utils import all_project_path, tool_version
+
+
+COMPILED_FILE = 'active.marshal'
+OPTIONS_FILE = 'options.json'
+
+# Options that change the compiled rules, the active rules can only be
+# deleted with the options they were applied with
+APPLIED_OPTIONS = ['layout', 'aggregate', 'multiport', 'ipset_threshold']
+
+def compiled_path():
+    return f"{all_project_path('cache')}/{COMPILED_FILE}"
+
+def options_path():
+    return f"{all_project_path('base')}/{OPTIONS_FILE}"
+
+def file_stamp(file):
+    """
+    Return the size and modification time of a file, a change in either
+    one means the file must be compiled again
+    """
+    stat = os.stat(file)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def load_compiled(layout):
+    """
+    Return the stamp and the compiled rules of each active file, empty when
+    the snapshot is missing or was written by another layout, Python or
+    installation of the tool
+    """
+    return _load(layout).get('files') or {}
+
+def load_compiled_sets(layout):
+    """
+    Return a compiled rule of each ipset the active rules were compacted
+    into, indexed by the set name
+    """
+    return _load(layout).get('sets') or {}
+
+def save_compiled(layout, files, sets=None):
+    """
+    Store the stamp and the compiled rules of each active file, and a rule
+    of each ipset. marshal is the fastest format to load the rules back,
+    without parsing any TOML
+    """
+    path = compiled_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(marshal.dumps({'key': _key(layout), 'files': files, 'sets': sets or {}}))
+    os.replace(tmp, path)
+
+def load_options():
+    """
+    Return the options the active rules were applied with, empty before
+    the first start
+    """
+    try:
+        with open(options_path()) as f:
+            options = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return {name: options[name] for name in APPLIED_OPTIONS if name in options}
+
+def save_options(options):
+    path = options_path()
+    tmp = f'{path}.tmp'
+
+    with open(tmp, 'w') as f:
+        json.dump(options, f)
+
+    os.replace(tmp, path)
+
+def _load(layout):
+    try:
+        # marshal.load reads the file in small chunks, loads is much faster
+        with open(compiled_path(), 'rb') as f:
+            data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+
+    if not isinstance(data, dict) or data.get('key') != _key(layout):
+        return {}
+
+    return data
+
+def _key(layout):
+    # The marshal format changes between Python versions and the compiled
+    # rules between versions of the tool, like the cache of each file
+    return (layout, sys.version_info[:2], tool_version())
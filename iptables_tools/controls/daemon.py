@@ -0,0 +1,220 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import signal
+import struct
+import time
+from .exceptions import ValidationError
+from .merge import compile_order
+from .metrics import Metrics
+from .utils import all_project_path
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    """
+    Minimal inotify watcher over a single directory
+    """
+
+    def __init__(self, path, mask=WATCH_MASK):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self.fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {path}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        os.close(self.fd)
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds and return the names of the changed files
+        """
+        names = set()
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return names
+
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+
+        while offset < len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+
+            if name and not name.startswith('.'):
+                names.add(name)
+
+        return names
+
+    def wait(self, debounce, timeout=1.0):
+        """
+        Return the files changed in a burst of events, once no event arrived
+        for debounce seconds, or an empty set after timeout without events
+        """
+        names = self.read(timeout)
+
+        while names and (more := self.read(debounce)):
+            names |= more
+
+        return names
+
+class Daemon:
+    """
+    Keep the compiled rules in memory and apply only the files changed in
+    config-available.d
+    """
+
+    def __init__(self, management, debounce=1.0):
+        self.management = management
+        self.debounce = debounce
+        self.path = all_project_path('config-available')
+        self.rules = {}
+        self.order = []
+        self.sections = {}
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        with Inotify(self.path) as watcher:
+            self.start()
+            self.running = True
+
+            while self.running:
+                if names := watcher.wait(self.debounce):
+                    self.reload(names)
+
+        logging.info('Daemon stopped.')
+
+    def stop(self, *args):
+        self.running = False
+
+    def start(self):
+        """
+        Compile every file and replace the active rules, the rules loaded
+        before are restored when they can't be applied
+        """
+        files = self.management._config_files('config-available')
+        sections = {}
+        self.management._validate_files(files, sections)
+        rules = dict(zip(files, self.management._compile_files(files)))
+        self.management._report_conflicts(list(rules.items()))
+        self.management._take_snapshot()
+
+        try:
+            self.management._replace_rules(self.ruleset(rules, files))
+            self.management._replace_file_config_enable()
+        except Exception:
+            self._restore_snapshot()
+            raise
+
+        self.rules = rules
+        self.order = files
+        self.sections = sections
+        logging.info(f'Daemon started, watching {self.path}.')
+
+    def ruleset(self, rules=None, order=None):
+        """
+        Return the compiled rules of the files in their compile order, by
+        default the rules last applied. The directory is not listed again,
+        so the rules of a deleted file are still part of the last ruleset
+        """
+        rules = self.rules if rules is None else rules
+        order = self.order if order is None else order
+
+        return [rule for file in order for rule in rules[file]]
+
+    def reload(self, names):
+        """
+        Recompile only the changed files and apply the difference, logging
+        the metrics of each reload
+        """
+        self.management.metrics = Metrics()
+        status = 'ok' if self._reload(names) else 'failed'
+        logging.info(self.management.metrics.dumps(method='reload', status=status))
+
+    def _reload(self, names):
+        start = time.perf_counter()
+        previous = self.ruleset()
+        changed = {f'{self.path}/{name}' for name in names}
+        files = sorted(file for file in changed if os.path.isfile(file))
+        rules = {file: compiled for file, compiled in self.rules.items() if file not in changed}
+
+        # Only the changed files are read, the sections of the others are
+        # kept from the last reload
+        sections = {
+            section: file
+            for section, file in self.sections.items()
+            if file not in changed
+        }
+
+        try:
+            self.management._validate_files(files, sections)
+        except ValidationError as err:
+            logging.error(f'Keeping the current rules.\n{err}')
+            return
+
+        for file in files:
+            try:
+                rules[file] = self.management._compile_file(file)
+            except Exception as err:
+                logging.error(f'Unable to compile {file}, keeping the current rules.\n{err}')
+                return
+
+            self.management.metrics.count('files_read')
+            self.management.metrics.count('rules_compiled', len(rules[file]))
+
+        order = compile_order(rules)
+        self.management._report_conflicts([(file, rules[file]) for file in order])
+        # Every reload would push the snapshots taken before a manual change
+        # out of the stored ones, a failed reload only needs it in memory
+        self.management._take_snapshot(store=False)
+
+        try:
+            self.management._apply_diff(previous, self.ruleset(rules, order))
+            self.management._replace_file_config_enable(names)
+        except Exception as err:
+            logging.error(f'Unable to apply the changes of {sorted(names)}, keeping the current rules.\n{err}')
+            self._restore_snapshot()
+            return
+
+        # The rules in memory change only once the kernel has them
+        self.rules = rules
+        self.order = order
+        self.sections = sections
+
+        logging.info(
+            f'Reloaded {len(names)} files in {time.perf_counter() - start:.3f}s.'
+        )
+        return True
+
+    def _restore_snapshot(self):
+        if not self.management.snapshot:
+            logging.error('No snapshot of the rules was taken, unable to restore them.')
+            return
+
+        try:
+            self.management.restore_snapshot()
+        except Exception as err:
+            logging.error(f'Unable to restore the snapshot of the rules.\n{err}')
@@ -31,7 +31,9 @@ class ExceptionsUtils(Exception):
             'CommandNotFound': f"Command '{input}' not found\n{banner}",
             'RunCommandError': f"Command '{input}' unselected option\n{banner}",
             'CopyFileError': f"Error copying file '{input}'\n{banner}",
-            'ValueMandatoryError': f"Value '{self.return_message}' is mandatory.\n{banner}"
+            'ValueMandatoryError': f"Value '{self.return_message}' is mandatory.\n{banner}",
+            'ValidationError': f"Invalid configuration:\n{self.return_message}\n{banner}",
+            'PushError': f"Push stopped, {self.return_message}\n{banner}"
         }   
 
         self.message = message.get(self.exception_name)
@@ -44,6 +46,8 @@ class ExceptionsUtils(Exception):
             'super_user': "Try running the command as super user.",
             'run_unselected_option': 'To view the available options run\niptables-tools run -h',
             'ValueMandatoryError': f'Review the configuration file default.toml:\n{self.banner_message_plus}',
+            'ValidationError': 'No rule was applied, fix the configuration files and try again.',
+            'PushError': 'The remaining targets were not changed, the failed targets were restored.',
         }
 
         if not banners.get(self.banner_name):
@@ -129,7 +133,7 @@ class CopyFileError(ExceptionsUtils):
             command,
             return_message,
             banner_name,
-            'CopyFileError'
+            exception_name='CopyFileError'
         )
 
 class ValueMandatoryError(ExceptionsUtils):
@@ -145,4 +149,30 @@ class ValueMandatoryError(ExceptionsUtils):
             banner_name = banner_name,
             banner_message_plus = banner_message_plus,
             exception_name = exception_name
-        )
\ No newline at end of file
+        )
+
+class ValidationError(ExceptionsUtils):
+    def __init__(
+        self,
+        return_message = None,
+        banner_name = 'ValidationError',
+        exception_name = 'ValidationError',
+    ):
+        super().__init__(
+            return_message = return_message,
+            banner_name = banner_name,
+            exception_name = exception_name
+        )
+
+class PushError(ExceptionsUtils):
+    def __init__(
+        self,
+        return_message = None,
+        banner_name = 'PushError',
+        exception_name = 'PushError',
+    ):
+        super().__init__(
+            return_message = return_message,
+            banner_name = banner_name,
+            exception_name = exception_name
+        )
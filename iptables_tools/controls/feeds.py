@@ -0,0 +1,195 @@
+import os
+import re
+import socket
+from .ipset import SET_FAMILIES, set_name
+from .utils import all_project_path
+
+
+FEED_COMMENT = 'feed '
+DIRECTIONS = {'src', 'dst'}
+VERSIONS = {'iptables': 4, 'ip6tables': 6}
+ADDRESS_BITS = {4: 32, 6: 128}
+
+# Default maxelem of hash:net, larger feeds get a larger set
+MIN_MAXELEM = 65536
+
+SEPARATORS = re.compile(r'[\s,;]+')
+MATCH_SET = re.compile(r'-m set --match-set (\S+) ')
+SAVE_CREATE = re.compile(r'^create (\S+) .*?\bmaxelem (\d+)')
+
+def feed_path(path):
+    """
+    Return the path of a feed file, relative paths start at the project
+    directory
+    """
+    return os.path.join(all_project_path('base'), path)
+
+def feed_mapping(feed, binary):
+    """
+    Return the mapping entry of the rule that matches the feed ipset, the
+    comment keeps the feed file so the ipset can be loaded from the rules
+    """
+    if isinstance(feed, str):
+        feed = {'file': feed}
+
+    path = feed_path(feed['file'])
+
+    return {
+        'set': set_name(('feed', binary, path)),
+        'direction': feed.get('direction') or 'src',
+        'comment': f'{FEED_COMMENT}{path}',
+    }
+
+def rule_feeds(list_rules):
+    """
+    Return the feed ipsets used by the compiled rules, indexed by name
+    """
+    feeds = {}
+
+    for rule in list_rules:
+        name = None
+
+        for fragment in rule[3:]:
+            if match := MATCH_SET.match(fragment):
+                name = match.group(1)
+            elif name and fragment.startswith(f'-m comment --comment "{FEED_COMMENT}'):
+                feeds[name] = {
+                    'name': name,
+                    'family': SET_FAMILIES[rule[0]],
+                    'version': VERSIONS[rule[0]],
+                    'path': fragment.split(FEED_COMMENT, 1)[1].strip('"'),
+                }
+
+    return feeds
+
+def read_feed(path):
+    """
+    Stream a plain text or CSV feed and return the networks of each IP
+    version deduplicated and collapsed. The first column of each line is
+    used, comments and lines that are not networks (like CSV headers) are
+    skipped. Returns the networks and the number of skipped lines
+    """
+    ranges = {4: set(), 6: set()}
+    skipped = 0
+
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+
+            if not line:
+                continue
+
+            try:
+                version, first, last = _parse_network(SEPARATORS.split(line, 1)[0].strip('"\''))
+            except ValueError:
+                skipped += 1
+                continue
+
+            ranges[version].add((first, last))
+
+    return {version: list(_collapse(items, version)) for version, items in ranges.items()}, skipped
+
+def _parse_network(value):
+    """
+    Return the version and the first and last addresses of a network as
+    integers, faster than ipaddress for feeds with many networks
+    """
+    address, _, prefix = value.partition('/')
+    version, family = (6, socket.AF_INET6) if ':' in address else (4, socket.AF_INET)
+    bits = ADDRESS_BITS[version]
+
+    try:
+        number = int.from_bytes(socket.inet_pton(family, address), 'big')
+    except OSError:
+        raise ValueError(value) from None
+
+    # hash:net does not store zero length prefixes
+    if prefix and not (prefix.isdigit() and 0 < int(prefix) <= bits):
+        raise ValueError(value)
+
+    size = 1 << (bits - int(prefix or bits))
+    first = number & ~(size - 1)
+
+    return version, first, first + size - 1
+
+def _collapse(ranges, version):
+    """
+    Merge the overlapping and adjacent ranges and yield the smallest list
+    of networks that cover them
+    """
+    bits = ADDRESS_BITS[version]
+    family = socket.AF_INET6 if version == 6 else socket.AF_INET
+    merged = []
+
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    for first, last in merged:
+        while first <= last:
+            # The largest block aligned at first that fits in the range
+            size = first & -first or 1 << (bits - 1)
+            while size > last - first + 1:
+                size >>= 1
+
+            address = socket.inet_ntop(family, first.to_bytes(bits // 8, 'big'))
+            yield f'{address}/{bits - size.bit_length() + 1}'
+            first += size
+
+def parse_ipset_save(output):
+    """
+    Parse the output of ipset save into the maxelem and the members of
+    each set
+    """
+    sets = {}
+
+    for line in output.splitlines():
+        if match := SAVE_CREATE.match(line):
+            sets[match.group(1)] = {'maxelem': int(match.group(2)), 'members': set()}
+        elif line.startswith('add '):
+            _, name, member, *_ = line.split()
+
+            # Single addresses are saved without their prefix length
+            if name in sets:
+                sets[name]['members'].add(
+                    member if '/' in member else f"{member}/{128 if ':' in member else 32}"
+                )
+
+    return sets
+
+def maxelem(size):
+    """
+    Return a maxelem that fits the members with room to grow
+    """
+    return max(MIN_MAXELEM, 1 << (2 * size).bit_length())
+
+def render_feed_payload(feeds, loaded):
+    """
+    Render an ipset restore payload that brings each feed ipset to its
+    members. Loaded sets only receive the differences, sets too small for
+    the feed are filled again and swapped
+    """
+    lines = []
+
+    for feed in feeds.values():
+        name = feed['name']
+        members = feed['members']
+        current = loaded.get(name)
+        options = f"hash:net family {feed['family']} maxelem {maxelem(len(members))}"
+
+        if current is None:
+            lines.append(f'create {name} {options}')
+            lines.extend(f'add {name} {member}' for member in members)
+        elif current['maxelem'] >= len(members):
+            wanted = set(members)
+            lines.extend(f'del {name} {member}' for member in current['members'] - wanted)
+            lines.extend(f'add {name} {member}' for member in members if member not in current['members'])
+        else:
+            tmp = f'{name}_t'
+            lines.extend([f'create {tmp} {options}', f'flush {tmp}'])
+            lines.extend(f'add {tmp} {member}' for member in members)
+            lines.extend([f'swap {tmp} {name}', f'destroy {tmp}'])
+
+    return '\n'.join([*lines, ''])
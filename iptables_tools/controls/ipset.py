@@ -0,0 +1,161 @@
+import hashlib
+import ipaddress
+
+
+SET_FAMILIES = {
+    'iptables': 'inet',
+    'ip6tables': 'inet6',
+}
+
+DIRECTIONS = {
+    '-s': 'src',
+    '-d': 'dst',
+}
+
+def compact_rules(list_rules, threshold):
+    """
+    Replace runs of consecutive rules that differ only in the source (or
+    only in the destination) by a single rule matching a hash:net ipset.
+    Returns the new rules and the ipsets they use
+    """
+    ipsets = {}
+
+    if not threshold:
+        return list_rules, ipsets
+
+    compacted = []
+    runs = {}
+    index = 0
+
+    while index < len(list_rules):
+        option, group = _group(list_rules, index)
+
+        if len(group) < threshold:
+            compacted.append(list_rules[index])
+            index += 1
+            continue
+
+        # Runs with the same key in other sections or files get their own
+        # set, numbered in the order they are compiled
+        key = _rule_key(group[0], option)
+        runs[key] = runs.get(key, -1) + 1
+
+        rule, ipset = _set_rule(option, group, runs[key])
+        ipsets[ipset['name']] = ipset
+        compacted.append(rule)
+        index += len(group)
+
+    return compacted, ipsets
+
+def _group(list_rules, index):
+    """
+    Return the direction and the run of rules starting at index that share
+    everything but the address of that direction and the comment
+    """
+    for option in DIRECTIONS:
+        if (key := _rule_key(list_rules[index], option)) is None:
+            continue
+
+        group = []
+        for rule in list_rules[index:]:
+            if _rule_key(rule, option) != key:
+                break
+            group.append(rule)
+
+        return option, group
+
+    return None, []
+
+def _rule_key(rule, option):
+    """
+    Return the rule without the operation, the address of the option and
+    the comment, or None when the rule has no address for the option
+    """
+    fragments = [fragment for fragment in rule[3:] if not fragment.startswith('-m comment ')]
+    addresses = [fragment for fragment in fragments if fragment.startswith(f'{option} ')]
+
+    if len(addresses) != 1:
+        return
+
+    # hash:net does not store zero length prefixes
+    if ipaddress.ip_network(addresses[0].split(' ', 1)[1], strict=False).prefixlen == 0:
+        return
+
+    return (
+        option,
+        rule[0],
+        rule[2],
+        *[fragment for fragment in fragments if fragment != addresses[0]]
+    )
+
+def _set_rule(option, group, run=0):
+    key = _rule_key(group[0], option)
+    name = set_name((*key, str(run)))
+    members = []
+
+    for rule in group:
+        address = next(fragment for fragment in rule[3:] if fragment.startswith(f'{option} '))
+        comment = next((fragment for fragment in rule[3:] if fragment.startswith('-m comment ')), None)
+        members.append((
+            address.split(' ', 1)[1],
+            comment.split('--comment ', 1)[1] if comment else None
+        ))
+
+    # iptables-save prints the set match after the protocol match
+    fragments = list(key[3:])
+    position = next(
+        (index for index, fragment in enumerate(fragments) if fragment.startswith('-j ')),
+        len(fragments)
+    )
+    fragments[position:position] = [
+        f'-m set --match-set {name} {DIRECTIONS[option]}',
+        f'-m comment --comment "{name}"'
+    ]
+
+    ipset = {
+        'name': name,
+        'family': SET_FAMILIES.get(group[0][0]),
+        'members': members,
+        'rules': group
+    }
+
+    return (*group[0][:3], *fragments), ipset
+
+def set_name(key):
+    """
+    Return a stable ipset name for the rule key, within the ipset limit of
+    31 characters
+    """
+    digest = hashlib.sha1(' '.join(key).encode()).hexdigest()
+    return f'IPT_TOOLS_{digest[:16]}'
+
+def render_ipset_payload(ipsets):
+    """
+    Render an ipset restore payload that creates the sets and replaces
+    their members atomically with swap
+    """
+    lines = []
+
+    for ipset in ipsets.values():
+        name = ipset['name']
+        tmp = f"{name}_t"
+        options = f"hash:net family {ipset['family']} comment"
+
+        lines.extend([
+            f'create {name} {options}',
+            f'create {tmp} {options}',
+            f'flush {tmp}',
+        ])
+        lines.extend(
+            f'add {tmp} {address}' + (f' comment {comment}' if comment else '')
+            for address, comment in ipset['members']
+        )
+        lines.extend([
+            f'swap {tmp} {name}',
+            f'destroy {tmp}',
+        ])
+
+    return '\n'.join([*lines, ''])
+
+def render_destroy_payload(names):
+    return '\n'.join([*(f'destroy {name}' for name in names), ''])
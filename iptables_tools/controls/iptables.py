@@ -1,14 +1,76 @@
+import copy
 import subprocess
 import os
-from .exceptions import CommandNotFound, CommandCalledError, CopyFileError, ValueMandatoryError
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, partial
+from .exceptions import CommandNotFound, CommandCalledError, CopyFileError, ValueMandatoryError, ValidationError
 import logging
 from .utils import read_toml_file, config_path, input_confirm, all_project_files, all_project_path
+from .restore import failed_transaction, iter_restore_payload, iter_rule_transactions, restore_binary
+from .commands import rule_argv, split_command
+from .reconcile import diff_rules
+from .backends import load_backend, snapshot_backend
+from .cache import cache_key, load_cache, save_cache
+from .kernel import FAMILIES, KernelState, parse_counters, save_binary
+from .aggregate import aggregate_rules
+from .multiport import chunk_ports, format_ports, merge_ports, parse_ports
+from .chains import service_chain_name, service_chain_rules
+from .snapshots import list_snapshots, load_snapshot, save_snapshot
+from .ipset import render_ipset_payload, render_destroy_payload
+from .validator import validate_files
+from .aliases import alias_commands
+from .metrics import Metrics, timed, xtables_lock_busy
+from .ordering import order_key, remove_order, save_order
+from .merge import compile_order, find_conflicts
+from .compiled import APPLIED_OPTIONS, file_stamp, load_compiled, load_options, save_compiled, save_options
+from .feeds import feed_mapping, parse_ipset_save, read_feed, render_feed_payload, rule_feeds
 
 
+MAX_REPORTED_CONFLICTS = 20
+CONFLICT_KINDS = {'shadowed': 'is shadowed by', 'conflict': 'overlaps'}
+
+# Fragments of each rule option, built once instead of on every call
+RULE_OPTIONS = {
+    'ipv4': lambda value: 'iptables',
+    'ipv6': lambda value: 'ip6tables',
+    'src': '-s {}'.format,
+    'dst': '-d {}'.format,
+    'port': format_ports,
+    'protocol': lambda value: f'-p {value} -m {value}',
+    'comment': '-m comment --comment "{}"'.format,
+    'insert': lambda value: '-I',
+    'delete': lambda value: '-D',
+    'target': lambda value: '-j ACCEPT' if value == 'accept' else '-j DROP',
+}
+
 class Management:
 
     def __init__(self, *args, **kwargs):
         self.base_dir = config_path()
+        self.apply_mode = kwargs.get('apply_mode') or 'batch'
+        self.restart_mode = kwargs.get('restart_mode') or 'reconcile'
+        self.use_cache = kwargs.get('use_cache', True)
+        self.workers = kwargs.get('workers') or 1
+
+        # The options not passed default to the ones the active rules were
+        # applied with, so a plain stop or restart compiles the same rules
+        self.applied = load_options()
+        options = {
+            **self.applied,
+            **{name: kwargs[name] for name in APPLIED_OPTIONS if kwargs.get(name) is not None}
+        }
+        self.ipset_threshold = options.get('ipset_threshold') or 0
+        self.aggregate = options.get('aggregate') or False
+        self.multiport = options.get('multiport') or False
+        self.layout = options.get('layout') or 'flat'
+        self.debounce = kwargs.get('debounce') or 1.0
+        self.backend = load_backend(kwargs.get('backend') or 'iptables', self)
+        self.snapshot = None
+        self.order = None
+        self.metrics = Metrics()
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(levelname)s - %(message)s'
@@ -17,13 +79,15 @@ class Management:
     def install_setup(self):
         self._create_directories()
         self._move_files()
+        self._save_active_rules()
         self._backup_old_rules()
         self._set_systemctl()
         logging.info('Installation completed successfully.')
     
     def start_setup(self):
-        self._delete_rules()
-        self._add_rules()
+        file_rules = self.validate_setup()
+        self._take_snapshot()
+        self._replace_rules(merged_rules(file_rules))
         self._replace_file_config_enable()
         logging.info('Started successfully.')
     
@@ -32,11 +96,150 @@ class Management:
         logging.info('Stopped successfully.')
 
     def restart_setup(self):
-        self._delete_rules()
-        self._add_rules()
+        available = merged_rules(self.validate_setup())
+        self._take_snapshot()
+
+        if self.restart_mode == 'reconcile':
+            self._reconcile_rules(available)
+        else:
+            self._delete_rules()
+            self._add_rules(available)
+
         self._replace_file_config_enable()
         logging.info('Successfully restarted.')
 
+    def optimize_order_setup(self, reset=False):
+        """
+        Reorder the active rules by the packets they matched, or go back to
+        the configuration order with reset, replacing the rules that move in
+        a single iptables-restore transaction per family
+        """
+        if not self.backend.orders_rules:
+            logging.warning(f'The rule order is not optimized with the {self.backend.name} backend.')
+            return
+
+        self._take_snapshot()
+        applied = self._applied_management()
+        active = applied._compile_rules(self._config_files('config-active'))
+        current, _ = applied._optimize_rules(active)
+        binaries = {family: binary for binary, family in FAMILIES.items()}
+        counters = {
+            ' '.join([binaries[family], chain, *spec]): (packets, size)
+            for (family, table, chain, spec), packets, size in self.kernel_counters()
+            if table == 'filter'
+        }
+
+        if reset:
+            remove_order()
+            self.order = {}
+        else:
+            self.order = {key: packets for key, (packets, _) in counters.items()}
+            save_order(self.order)
+
+        desired, _ = applied._optimize_rules(active)
+
+        try:
+            state = self.kernel_state()
+            deletes, inserts, unchanged = diff_rules(current, desired, state)
+        except (CommandCalledError, LookupError) as err:
+            logging.warning(f'Unable to place the rules in the loaded chains, the order was not changed.\n{err}')
+            return
+
+        deletes = self._loaded_rules(deletes, state)
+        logging.info(f'Rules to move: {len(inserts)}, unchanged: {unchanged}.')
+
+        if inserts:
+            self._restore_rules(deletes + inserts, 'insert', counters=counters)
+
+        logging.info('Rule order optimized successfully.')
+
+    def validate_setup(self, files=None):
+        """
+        Validate the configuration files before any rule is applied, every
+        problem is reported at once. Returns the compiled rules of each
+        file in compile order, so they are applied without compiling the
+        files again
+        """
+        files = compile_order(files or self._config_files('config-available'))
+        self._validate_files(files)
+        file_rules = self._compile_file_rules(files)
+        self._report_conflicts(file_rules)
+
+        return file_rules
+
+    @timed('validate')
+    def _validate_files(self, files, sections=None):
+        """
+        Raise ValidationError with the problems of the files, sections holds
+        the sections of the files that are not validated again
+        """
+        problems = validate_files(files, sections, self.backend.name)
+
+        if problems:
+            raise ValidationError('\n'.join(map(str, problems)))
+
+        logging.info(f'{len(files)} configuration files validated successfully.')
+
+    @timed('conflicts')
+    def _report_conflicts(self, file_rules):
+        """
+        Warn about the rules of a file that overlap a rule of a file with
+        a higher priority and a different target, the compiled rules of
+        each file are given in compile order
+        """
+        conflicts = find_conflicts(file_rules)
+
+        for kind, rule, file, other_rule, other_file in conflicts[:MAX_REPORTED_CONFLICTS]:
+            logging.warning(
+                f"Rule {' '.join(rule[2:])} of {os.path.basename(file)} {CONFLICT_KINDS[kind]} "
+                f"{' '.join(other_rule[2:])} of {os.path.basename(other_file)}."
+            )
+
+        if len(conflicts) > MAX_REPORTED_CONFLICTS:
+            logging.warning(f'{len(conflicts) - MAX_REPORTED_CONFLICTS} more conflicts were not shown.')
+
+    @timed('snapshot')
+    def _take_snapshot(self, store=True):
+        """
+        Save the loaded rules before changing them, so a failure restores
+        exactly this state. Only the snapshots stored on disk can be listed
+        and restored later
+        """
+        # A snapshot of an earlier change must never be restored
+        self.snapshot = None
+
+        if (outputs := self.backend.snapshot()) is None:
+            return
+
+        self.snapshot = outputs
+
+        if not store:
+            return
+
+        try:
+            name = save_snapshot(outputs)
+        except OSError as err:
+            logging.warning(f'Unable to store the snapshot.\n{err}')
+            return
+
+        logging.info(f'Snapshot {name} taken successfully.')
+
+    def restore_snapshot(self, name=None):
+        """
+        Restore the snapshot taken by this run or the stored snapshot name
+        """
+        outputs = load_snapshot(name) if name else self.snapshot
+        snapshot_backend(outputs, self).restore(outputs)
+        logging.info(f"Snapshot {name or 'of this run'} restored successfully.")
+
+    def snapshot_names(self):
+        return list_snapshots()
+
+    def daemon_setup(self):
+        from .daemon import Daemon
+
+        Daemon(self, debounce=self.debounce).run()
+
     def _set_systemctl(self):
         """
         Reload the systemd manager configuration
@@ -56,13 +259,21 @@ class Management:
 
         logging.info('Directories created successfully.')
 
-    def _replace_file_config_enable(self):
+    def _replace_file_config_enable(self, names=None):
 
         available_path = all_project_path('config-available')
         active_path = all_project_path('config-active')
 
         files = os.listdir(available_path)
 
+        # Files removed from config-available.d are no longer active
+        for file in set(os.listdir(active_path)) - set(files):
+            os.remove(f'{active_path}/{file}')
+            logging.info(f'File {file} disabled successfully.')
+
+        if names is not None:
+            files = [file for file in files if file in names]
+
         for file in files:
             specific = [
                 {
@@ -73,6 +284,22 @@ class Management:
             ]
             self._move_files(specific_file=specific)
 
+        self._save_applied_options()
+        self._save_active_rules()
+
+    def _save_applied_options(self):
+        """
+        Remember the options the active rules were applied with, stop and
+        restart reuse them when they are not passed again
+        """
+        self.applied = {name: getattr(self, name) for name in APPLIED_OPTIONS}
+
+        try:
+            save_options(self.applied)
+        except OSError as err:
+            logging.warning(f'Unable to save the options of the active rules: {err}')
+
+    @timed('move_files')
     def _move_files(self, specific_file=None):
         """
         Moves all files necessary to run the project
@@ -109,13 +336,13 @@ class Management:
                     return
 
         for file in files:
-            input = f'cp -f {file.get("src")} {file.get("dst")}'
-            result = self._run_subprocess(input)
+            try:
+                shutil.copy(file.get('src'), file.get('dst'))
+            except OSError as err:
+                raise CopyFileError(file.get('src'), return_message=str(err)) from err
 
-            if result.returncode == 0:
-                logging.info(file.get('success_message'))
-            else:
-                raise CopyFileError(str(result.stderr))
+            self.metrics.count('spawns_avoided')
+            logging.info(file.get('success_message'))
 
     def _backup_old_rules(self):
         """
@@ -134,166 +361,626 @@ class Management:
 
         self.run_command('export-backup-rules')
 
-    def _add_rules(self):
-        available_path = all_project_path('config-available')
-        files = os.listdir(available_path)
-
-        for file in files:
-            self._set_rules(
-                type_run='insert',
-                file_toml=f'{available_path}/{file}'
-            )
+    def _config_files(self, name):
+        path = all_project_path(name)
+        return compile_order([f'{path}/{file}' for file in os.listdir(path)])
 
+    @timed('add_rules')
+    def _add_rules(self, list_rules):
+        self._set_compiled_rules('insert', list_rules)
         logging.info('Rules added successfully.')
 
+    @timed('delete_rules')
     def _delete_rules(self):
-        active_path = all_project_path('config-active')
-        files = os.listdir(active_path)
+        files = self._config_files('config-active')
 
         if not files:
             logging.info('No rules to delete.')
             return
 
-        for file in files:
-            self._set_rules(
-                type_run='delete',
-                file_toml=f'{active_path}/{file}'
-            )
+        applied = self._applied_management()
+        applied._set_compiled_rules('delete', applied._active_rules())
         logging.info('Rules deleted successfully.')
 
+    def _replace_rules(self, list_rules):
+        """
+        Replace the active rules with the compiled rules
+        """
+        self.backend.replace(list_rules)
+        logging.info('Rules added successfully.')
+
+    def _reconcile_rules(self, available):
+        """
+        Apply only the rules that changed between the active configuration
+        files and the compiled available rules
+        """
+        self._apply_diff(self._applied_management()._active_rules(), available)
+
+    def _applied_management(self):
+        """
+        Return a view of this management with the options the active rules
+        were applied with, to compile and delete them as they were loaded
+        """
+        if all(getattr(self, name) == value for name, value in self.applied.items()):
+            return self
+
+        logging.info(f'Using the options of the active rules: {self.applied}.')
+        management = copy.copy(self)
+        vars(management).update(self.applied)
+        management.backend = type(self.backend)(management)
+
+        return management
+
+    @timed('active_rules')
+    def _active_rules(self):
+        """
+        Return the compiled rules of the active files, loaded from the
+        compiled snapshot for the files that did not change since it was
+        written, so stop does not parse any TOML
+        """
+        return [rule for _, rules in self._active_entries().values() for rule in rules]
+
+    def _active_entries(self):
+        stored = load_compiled(self.layout) if self.use_cache else {}
+        entries = {}
+
+        for file in self._config_files('config-active'):
+            stamp = file_stamp(file)
+
+            if (entry := stored.get(file)) and entry[0] == stamp:
+                entries[file] = entry
+                continue
+
+            entries[file] = (stamp, self._compile_file(file))
+            self.metrics.count('files_read')
+
+        return entries
+
+    def _save_active_rules(self):
+        """
+        Write the compiled snapshot of the active files, after they change,
+        with the first compiled rule of each ipset so stats can find the
+        section of the compacted rules
+        """
+        if not self.use_cache:
+            return
+
+        entries = self._active_entries()
+        sets = {}
+
+        if self.ipset_threshold:
+            _, ipsets = self._optimize_rules([rule for _, rules in entries.values() for rule in rules])
+            sets = {name: ipset['rules'][0] for name, ipset in ipsets.items() if ipset.get('rules')}
+
+        try:
+            save_compiled(self.layout, entries, sets)
+        except OSError as err:
+            logging.warning(f'Unable to save the compiled rules: {err}')
+
+    @timed('reconcile')
+    def _apply_diff(self, active, available):
+        """
+        Apply the operations that turn the active compiled rules into the
+        available ones
+        """
+        self.backend.reconcile(active, available)
+
     def run_command(self, command):
         if cmd := self._get_alias_command_list(command):
 
-            result = self._run_subprocess(cmd.get('cmd'))
-            if result.returncode == 0:
-                logging.info(cmd.get('success_message'))
-                return
-            else:
-                raise CommandCalledError('run', command, result.stderr)
+            for step in cmd.get('cmd'):
+                result = self._run_subprocess(
+                    step.get('argv'),
+                    stdin=step.get('stdin'),
+                    stdout=step.get('stdout')
+                )
+
+                if result.returncode != 0:
+                    raise CommandCalledError('run', command, result.stderr)
+
+            logging.info(cmd.get('success_message'))
+            return
 
         raise CommandNotFound
     
-    def _run_subprocess(self, command):
-        return subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True
-        )
+    def _run_subprocess(self, command, input=None, stdin=None, stdout=None):
+        """
+        Run the command without a shell, stdin and stdout are optional
+        files that replace the shell redirects
+        """
+        argv = split_command(command)
+        self.metrics.count('subprocesses')
+        # No /bin/sh is started in front of the command
+        self.metrics.count('spawns_avoided')
+
+        busy = xtables_lock_busy(argv)
+        start = time.perf_counter()
+
+        with self.metrics.phase('subprocess'):
+            try:
+                if input is not None and not isinstance(input, str):
+                    result = self._stream_subprocess(argv, input)
+                else:
+                    result = self._run_redirected(argv, input, stdin, stdout)
+            except OSError as err:
+                # Keep the result the shell gave for a missing command
+                result = subprocess.CompletedProcess(argv, 127, '', str(err))
+
+        # The command waits for the lock itself, its time bounds the wait
+        if busy:
+            self.metrics.count('xtables_lock_busy')
+            self.metrics.count('xtables_lock_busy_seconds', time.perf_counter() - start)
+
+        if result.returncode != 0:
+            self.metrics.count('failures')
+
+        return result
+
+    def _run_redirected(self, argv, input=None, stdin=None, stdout=None):
+        if stdout:
+            with open(stdout, 'w') as output:
+                result = subprocess.run(
+                    argv,
+                    input=input,
+                    stdout=output,
+                    stderr=subprocess.PIPE,
+                    text=True
+                )
+            result.stdout = ''
+            return result
+
+        if stdin:
+            with open(stdin) as source:
+                return subprocess.run(argv, stdin=source, capture_output=True, text=True)
+
+        return subprocess.run(argv, input=input, capture_output=True, text=True)
+
+    def _stream_subprocess(self, command, lines):
+        """
+        Write the lines to the command input as they are produced. The
+        output goes to temporary files so the command never blocks on a
+        full pipe
+        """
+        with tempfile.TemporaryFile('w+') as stdout, tempfile.TemporaryFile('w+') as stderr:
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
+                text=True
+            )
+
+            try:
+                process.stdin.writelines(lines)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            returncode = process.wait()
+            stdout.seek(0)
+            stderr.seek(0)
+
+            return subprocess.CompletedProcess(command, returncode, stdout.read(), stderr.read())
 
     def _get_alias_command_list(self, command):
         return self.alias_command_list().get(command)
     
     def alias_command_list(self):
-        
-        return {
-            'export-backup-rules': {
-                'cmd': f"iptables-save > {all_project_files('bkp_rules_v4')} && ip6tables-save > {all_project_files('bkp_rules_v6')}",
-                'description': 'Export backup IPv4 and IPv6 rules in iptables format.',
-                'success_message': f"Successful IPv4 and IPv6 backup rules in {all_project_files('bkp_rules_v4')} and {all_project_files('bkp_rules_v6')}."
-            },
-            'import-backup-rules': {
-                'cmd': f"iptables-restore < {all_project_files('bkp_rules_v4')} && ip6tables-restore < {all_project_files('bkp_rules_v6')}",
-                'description': 'Import backup IPv4 and IPv6 rules in iptables format.',
-                'success_message': f"Restored successful IPv4 and IPv6 backup rules in {all_project_files('bkp_rules_v4')} and {all_project_files('bkp_rules_v6')}."
-            },
-            'export-rules': {
-                'cmd': f"iptables-save > {all_project_files('exp_rules_v4')} && ip6tables-save > {all_project_files('exp_rules_v6')}",
-                'description': 'Export IPv4 and IPv6 rules in iptables format.',
-                'success_message': f"Rules IPv4 and IPv6 exported successfully in {all_project_files('exp_rules_v4')} and {all_project_files('exp_rules_v6')}."
-            },
-            'import-rules': {
-                'cmd': f"iptables-restore < {all_project_files('exp_rules_v4')} && ip6tables-restore < {all_project_files('exp_rules_v6')}",
-                'description': 'Import IPv4 and IPv6 rules in iptables format.',
-                'success_message': 'Rules IPv4 and IPv6 imported successfully.'
-            },
-            'export-rules-v4': {
-                'cmd': f"iptables-save > {all_project_files('exp_rules_v4')}",
-                'description': 'Export IPv4 rules in iptables format.',
-                'success_message': f"Rules IPv4 exported successfully in {all_project_files('exp_rules_v4')}."
-            },
-            'import-rules-v4': {
-                'cmd': f"iptables-restore < {all_project_files('exp_rules_v4')}",
-                'description': 'Import IPv4 rules in iptables format.',
-                'success_message': 'Rules IPv4 imported successfully.'
-            },
-            'export-rules-v6': {
-                'cmd': f"ip6tables-save > {all_project_files('exp_rules_v6')}",
-                'description': 'Export IPv6 rules in iptables format.',
-                'success_message': f"Rules v6 exported successfully in {all_project_files('exp_rules_v6')}."
-            },
-            'import-rules-v6': {
-                'cmd': f"ip6tables-restore < {all_project_files('exp_rules_v6')}",
-                'description': 'Import IPv6 rules in iptables format.',
-                'success_message': 'Rules IPv6 imported successfully.'
-            },
-            'systemctl-reload': {
-                'cmd': 'systemctl daemon-reload',
-                'description': 'Reload the systemd manager configuration.',
-                'success_message': 'Systemd manager configuration reloaded successfully.'
-            },
-            'systemctl-enable': {
-                'cmd': 'systemctl enable iptables-tools',
-                'description': 'Enabled the iptables-tools service.',
-                'success_message': 'Service iptables-tools enabled successfully.'
-            },
-        }
+        return alias_commands()
+
+    def _set_compiled_rules(self, type_run, list_rules):
+        list_rules, ipsets = self._optimize_rules(list_rules)
+
+        if type_run == 'insert':
+            self.backend.apply(list_rules, ipsets)
+        else:
+            self.backend.delete(list_rules, ipsets)
+
+    @timed('optimize')
+    def _optimize_rules(self, list_rules):
+        """
+        Reduce the number of compiled rules, returning the rules and the
+        ipsets they depend on
+        """
+        if self.aggregate:
+            list_rules, removed = aggregate_rules(list_rules)
+            logging.info(f'{removed} redundant rules removed.')
+
+        if self.multiport:
+            list_rules = merge_ports(list_rules)
+
+        return self.backend.optimize(list_rules)
+
+    def _create_ipsets(self, ipsets):
+        """
+        Create the ipsets and replace their members in a single ipset
+        restore call
+        """
+        if not ipsets:
+            return
+
+        feeds = {name: ipset for name, ipset in ipsets.items() if 'path' in ipset}
+        static = {name: ipset for name, ipset in ipsets.items() if 'path' not in ipset}
+        payload = render_ipset_payload(static)
+
+        if feeds:
+            payload += render_feed_payload(self._read_feeds(feeds), self._loaded_ipsets())
+
+        input = 'ipset -exist restore'
+        result = self._run_subprocess(input, payload)
 
-    def _set_rules(self, type_run, file_toml):
+        if result.returncode != 0:
+            raise CommandCalledError('run', input, result.stderr)
 
-        config = read_toml_file(file_toml)
+        logging.info(f'{len(ipsets)} ipsets updated successfully.')
 
-        if list_rules := self._format_toml(
-            data=config,
-            type_run=type_run
-        ):
+    @timed('feeds')
+    def _read_feeds(self, feeds):
+        """
+        Read the members of the feed ipsets, each file is read once for
+        both families and in processes since large feeds are CPU bound
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        paths = list(dict.fromkeys(feed['path'] for feed in feeds.values()))
+        results = dict(zip(paths, self._map(read_feed, paths, ProcessPoolExecutor)))
+
+        for path, (_, skipped) in results.items():
+            if skipped:
+                logging.warning(f'{skipped} invalid lines skipped in the feed {path}.')
+
+        for feed in feeds.values():
+            feed['members'] = results[feed['path']][0][feed['version']]
+            self.metrics.count('feed_members', len(feed['members']))
+
+        return feeds
+
+    def _loaded_ipsets(self):
+        """
+        Return the members of the loaded ipsets, so the feeds only load
+        their differences
+        """
+        input = 'ipset save'
+        result = self._run_subprocess(input)
+
+        if result.returncode != 0:
+            logging.warning(f'Unable to read the loaded ipsets.\n{result.stderr}')
+            return {}
+
+        return parse_ipset_save(result.stdout)
+
+    def refresh_feeds_setup(self):
+        """
+        Bring the feed ipsets of the active rules to the current contents of
+        their feed files, without touching the rules
+        """
+        list_rules = self._applied_management()._compile_rules(self._config_files('config-active'))
+        feeds = rule_feeds(list_rules)
+
+        if not feeds:
+            logging.info('No feeds configured.')
+            return
+
+        self._create_ipsets(feeds)
+
+    def _destroy_ipsets(self, names):
+        """
+        Destroy the ipsets no longer referenced by any rule
+        """
+        if not names:
+            return
+
+        input = 'ipset -exist restore'
+        result = self._run_subprocess(input, render_destroy_payload(names))
+
+        if result.returncode != 0:
+            logging.warning(f'Unable to destroy the ipsets.\n{result.stderr}')
+
+    @timed('kernel_state')
+    def kernel_state(self):
+        """
+        Read the rules loaded in the kernel with one iptables-save call
+        per family
+        """
+        outputs = self._map(self._save_family, FAMILIES)
+
+        return KernelState.from_save(dict(zip(FAMILIES.values(), outputs)))
+
+    def kernel_counters(self):
+        """
+        Read the packets and bytes of every loaded rule with one
+        iptables-save -c call per family
+        """
+        outputs = self._map(partial(self._save_family, counters=True), FAMILIES)
+
+        return [
+            counter
+            for family, output in zip(FAMILIES.values(), outputs)
+            for counter in parse_counters(family, output)
+        ]
+
+    def _save_family(self, binary, counters=False):
+        input = save_binary(binary, counters)
+        result = self._run_subprocess(input)
+
+        if result.returncode != 0:
+            raise CommandCalledError('run', input, result.stderr)
+
+        return result.stdout
+
+    def _map(self, function, items, executor=ThreadPoolExecutor):
+        """
+        Call the function for each item and return the results in the same
+        order, concurrently when more than one worker is configured
+        """
+        return list(self._imap(function, items, executor))
+
+    def _imap(self, function, items, executor=ThreadPoolExecutor):
+        """
+        Like _map, but yield each result as soon as it is ready in order,
+        so the caller does not hold the results it already consumed
+        """
+        items = list(items)
+
+        if self.workers <= 1 or len(items) <= 1:
+            yield from map(function, items)
+            return
+
+        with executor(max_workers=min(self.workers, len(items))) as pool:
+            yield from pool.map(function, items)
+
+    def _loaded_rules(self, list_rules, state=None):
+        """
+        Return only the rules loaded in the kernel, so deleting does not
+        fail on rules that are already gone
+        """
+        try:
+            if state is None:
+                state = self.kernel_state()
+        except CommandCalledError as err:
+            logging.warning(f'Unable to read the loaded rules.\n{err}')
+            return list_rules
+
+        loaded = state.loaded_rules(list_rules)
+
+        if skipped := len(list_rules) - len(loaded):
+            logging.info(f'Skipping {skipped} rules not loaded in the kernel.')
+
+        return loaded
+
+    @timed('compile')
+    def _compile_rules(self, files):
+        """
+        Read the configuration files and return all their rules. The rules
+        of each file are added as soon as it is compiled, but the result is
+        a single list: the optimizations, the ordering and the diff need
+        the rules of every file at once
+        """
+        list_rules = [rule for rules in self._compile_files(files) for rule in rules]
+
+        self.metrics.count('files_read', len(files))
+        self.metrics.count('rules_compiled', len(list_rules))
+
+        return list_rules
+
+    @timed('compile')
+    def _compile_file_rules(self, files):
+        """
+        Return each file with its rules, in the order of files
+        """
+        file_rules = list(zip(files, self._compile_files(files)))
+
+        self.metrics.count('files_read', len(files))
+        self.metrics.count('rules_compiled', sum(len(rules) for _, rules in file_rules))
+
+        return file_rules
+
+    def _compile_files(self, files):
+        """
+        Yield the rules of each configuration file, in the order of files
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Parsing is CPU bound, so the files are compiled in processes
+        return self._imap(
+            partial(compile_file, layout=self.layout, use_cache=self.use_cache),
+            files,
+            ProcessPoolExecutor
+        )
+
+    def _compile_file(self, file_toml):
+        """
+        Return the rules of a configuration file, reusing the compiled
+        rules from the cache when the file did not change
+        """
+        if not self.use_cache:
+            return self._format_toml(
+                data=read_toml_file(file_toml),
+                type_run='insert'
+            )
+
+        key = cache_key(file_toml, self.layout)
+
+        if (rules := load_cache(key)) is not None:
+            return [tuple(rule) for rule in rules]
+
+        rules = self._format_toml(
+            data=read_toml_file(file_toml),
+            type_run='insert'
+        )
+
+        try:
+            save_cache(key, rules)
+        except OSError as err:
+            logging.warning(f'Unable to cache the rules of {file_toml}: {err}')
+
+        return rules
+
+    def _apply_rules(self, list_rules, type_run):
+        """
+        Apply the rules with the selected mode, 'batch' commits all rules
+        of a family at once and 'rule' runs one command per rule
+        """
+        if self.apply_mode == 'rule':
             self._run_rules(list_rules, type_run)
+            return
+
+        self._restore_rules(list_rules, type_run)
 
     def _format_toml(self, data, type_run):
         """
-        format configuration file
+        Return the rules of a configuration file as a list, the form they
+        are cached in and sent back by the compile processes
         """
-        list_rules = []
-        
-        for config in data.values():
-            for _, values in config.items():
+        return list(self._iter_toml(data, type_run))
+
+    def _iter_toml(self, data, type_run):
+        """
+        Yield the rules of a configuration file one section at a time
+        """
+        for service, config in data.items():
+            # Top level keys like the file priority are not services
+            if not isinstance(config, dict):
+                continue
+
+            for section, values in config.items():
                 self._validate_mandatory_parameters(values)
                 protocol = values.get('protocol')
                 chain = values.get('chain')
                 port = values.get('port')                               
 
-                if rules := self._check_rules(
+                rules = self._check_rules(
                     type_run = type_run,
                     chain = chain,
                     protocol = protocol,
                     port = port,
                     info = values
-                ):
-                    list_rules.extend(rules)                    
+                )
+
+                if self.layout == 'chains':
+                    if not (rules := list(rules)):
+                        continue
+
+                    rules = service_chain_rules(
+                        rules,
+                        name=service_chain_name(service, section),
+                        chain=chain,
+                        matches=[
+                            (
+                                self._generate_rule_case('protocol', protocol),
+                                self._generate_rule_case('port', ports)
+                            )
+                            for ports in chunk_ports(parse_ports(port))
+                        ]
+                    )
 
-        return list_rules        
+                yield from rules
 
+    @timed('run_rules')
     def _run_rules(self, list_commands, type_run):
         """
-        set rules in iptables
+        set rules in iptables, IPv4 and IPv6 have independent locks so each
+        family runs its commands in order on its own
         """
+        families = {}
+
+        for command in list_commands:
+            families.setdefault(command[0], []).append(command)
+
+        self._map(
+            partial(self._run_family_rules, type_run=type_run),
+            families.values()
+        )
+
+    def _run_family_rules(self, list_commands, type_run):
+        """
+        Apply the rules of a family one transaction at a time through a
+        single iptables-restore process, which is started again after each
+        failed rule
+        """
+        input = restore_binary(list_commands[0][0])
+        pending = list_commands
+
+        while pending:
+            result = self._run_subprocess(input, iter_rule_transactions(pending))
+
+            if result.returncode == 0:
+                self.metrics.count('spawns_avoided', len(pending) - 1)
+                return
+
+            index = failed_transaction(result.stderr)
+
+            if type_run == 'insert':
+                failed = ' '.join(pending[index]) if index is not None else input
+                raise CommandCalledError('run', failed, result.stderr)
+
+            if index is None:
+                # Unknown failed rule, delete the remaining ones one by one
+                self._delete_argv_rules(pending)
+                return
+
+            self.metrics.count('spawns_avoided', index)
+            pending = pending[index + 1:]
+
+    def _delete_argv_rules(self, list_commands):
+        # The rules may already be gone, so the failures are ignored
         for command in list_commands:
-            input = ' '.join(command)
-            result = self._run_subprocess(input)
+            self._run_subprocess(rule_argv(command))
 
-            if result.returncode != 0 and type_run == 'insert':
-                raise CommandCalledError('run', input, result.stderr)      
+    @timed('restore_rules')
+    def _restore_rules(self, list_rules, type_run, counters=None):
+        """
+        set rules in iptables with a single iptables-restore call per family,
+        with counters the rules keep their packets and bytes
+        """
+        self._map(
+            partial(self._restore_family, list_rules=list_rules, type_run=type_run, counters=counters),
+            dict.fromkeys(rule[0] for rule in list_rules)
+        )
+
+    def _restore_family(self, binary, list_rules, type_run, counters=None):
+        input = restore_binary(binary)
+        prefix = None
+
+        if counters:
+            input = f'{input} --counters'
+            prefix = partial(_counter_prefix, counters=counters)
+
+        result = self._run_subprocess(input, iter_restore_payload(list_rules, binary, counters=prefix))
+
+        if result.returncode == 0:
+            return
+
+        if type_run == 'insert':
+            raise CommandCalledError('run', input, result.stderr)
+
+        # A missing rule aborts the whole delete transaction, so fall
+        # back to deleting one rule at a time ignoring the failures
+        logging.warning(f"Batch delete failed in {binary}, deleting rule by rule")
+        self._run_family_rules(
+            [rule for rule in list_rules if rule[0] == binary],
+            type_run
+        )
 
     def _check_rules(self, type_run, chain, protocol, port, info):
         """
         Checks if the accept and drop rules exist in the configuration
-        file default.toml
+        file default.toml and yields their rules
         """
-        list_rules = []
         targets = ['drop', 'accept']
         versions = ['ipv4', 'ipv6']
 
+        # Fragments shared by every rule of the section are built once
+        operation = self._generate_rule_case(type_run, 1)
+        protocol_fragment = self._generate_rule_case('protocol', protocol)
+        port_fragments = [
+            self._generate_rule_case('port', ports)
+            for ports in chunk_ports(parse_ports(port))
+        ]
+
         for target in targets:
+            target_fragment = self._generate_rule_case('target', target)
+
             for version in versions:
                 if rules := self._validate_optional_parameters(
                     version=version,
@@ -301,42 +988,41 @@ class Management:
                     key=target,
                     chain=chain
                 ):
+                    head = (self._generate_rule_case(version, 1), operation, chain)
+
                     for rule in rules:
-                        list_rules.append(
-                            self._format_rules(
-                                version = version,
-                                type_run = type_run,
-                                chain = chain,
-                                protocol = protocol,
-                                port = port,
+                        for port_fragment in port_fragments:
+                            yield self._format_rules(
+                                head = head,
                                 info = rule,
-                                target = target
+                                tail = (protocol_fragment, port_fragment),
+                                target = target_fragment
                             )
-                        )
 
-        return list_rules
+    def _format_rules(self, head, info, tail, target):
+        """
+        Return the rule as a tuple, the head, tail and target fragments
+        are shared by all rules of the section
+        """
+        rule = [*head]
 
-    def _format_rules(self, version, type_run, chain, protocol, port, info, target):
-        input = [
-            self._generate_rule_case(
-                version,
-                1
-            ),
-            self._generate_rule_case(type_run, 1),
-            chain,
-            self._generate_rule_case('src', info.get('src')),
-            self._generate_rule_case('dst', info.get('dst')),
-            self._generate_rule_case('protocol', protocol),
-            self._generate_rule_case('port', port),
-            self._generate_rule_case(
-                'comment',
-                info.get('comment')
-            ),
-            self._generate_rule_case('target', target)
-        ]
-        [input.remove(None) for _ in range(input.count(None))]
+        if src := info.get('src'):
+            rule.append(f'-s {src}')
+
+        if dst := info.get('dst'):
+            rule.append(f'-d {dst}')
+
+        rule.extend(tail)
+
+        if ipset := info.get('set'):
+            rule.append(f"-m set --match-set {ipset} {info.get('direction')}")
+
+        if comment := info.get('comment'):
+            rule.append(f'-m comment --comment "{comment}"')
 
-        return input
+        rule.append(target)
+
+        return tuple(rule)
 
     def _validate_mandatory_parameters(self, data):
         """
@@ -363,27 +1049,55 @@ class Management:
             logging.warning(f"Key {version}.{key} not found in chain {chain}")
             return
 
-        if not data.get(version).get(key).get('mapping'):
+        rules = data.get(version).get(key)
+        mapping = rules.get('mapping') or []
+
+        # A feed is matched by a single rule with its ipset
+        if feed := rules.get('feed'):
+            mapping = [*mapping, feed_mapping(feed, RULE_OPTIONS[version](1))]
+
+        if not mapping:
             logging.warning(f"Key {version}.{key}.mapping not found in chain {chain}")
             return
         
-        return data.get(version).get(key).get('mapping')
+        return mapping
 
     def _generate_rule_case(self, key, value):
         if not value:
             return
-        
-        options = {
-            'ipv4': 'iptables',
-            'ipv6': 'ip6tables',
-            'src': f'-s {value}',
-            'dst': f'-d {value}',
-            'port': f'--dport {value}',
-            'protocol': f'-p {value} -m {value}',
-            'comment': f'-m comment --comment "{value}"',
-            'insert': '-I',
-            'delete': '-D',
-            'target': '-j ACCEPT' if value == 'accept' else '-j DROP'
-        }
 
-        return options.get(key)
+        if option := RULE_OPTIONS.get(key):
+            return option(value)
+
+@cache
+def _compiler(layout, use_cache):
+    return Management(layout=layout, use_cache=use_cache)
+
+def merged_rules(file_rules):
+    """
+    Return the rules of all files, the files are given in compile order
+    """
+    return [rule for _, rules in file_rules for rule in rules]
+
+def compile_file(file, layout='flat', use_cache=True):
+    """
+    Return the rules of a configuration file. The compile processes only
+    receive the file and the options, not the management and its state
+    """
+    return _compiler(layout, use_cache)._compile_file(file)
+
+def _counter_prefix(rule, counters):
+    """
+    Return the [packets:bytes] prefix of a rule inserted or appended with
+    iptables-restore --counters
+    """
+    if rule[1] not in ('-I', '-A'):
+        return ''
+
+    # Rules inserted at a position carry the index before the spec
+    spec = rule[4:] if rule[1] == '-I' and len(rule) > 3 and rule[3].isdigit() else rule[3:]
+
+    if counter := counters.get(order_key((rule[0], rule[1], rule[2], *spec))):
+        return f'[{counter[0]}:{counter[1]}] '
+
+    return ''
@@ -0,0 +1,165 @@
+import ipaddress
+import shlex
+from collections import Counter
+
+
+FAMILIES = {
+    'iptables': 'ipv4',
+    'ip6tables': 'ipv6',
+}
+
+ADDRESS_OPTIONS = {'-s', '--source', '-d', '--destination'}
+
+def save_binary(binary, counters=False):
+    """
+    Return the iptables-save command of the family binary, with counters
+    each rule is printed with its packets and bytes
+    """
+    return f'{binary}-save -c' if counters else f'{binary}-save'
+
+def normalize_spec(spec):
+    """
+    Return the tokens of a rule spec in the same form iptables-save prints
+    them, so rules from the configuration and from the kernel compare equal
+    """
+    tokens = split_spec(spec) if isinstance(spec, str) else list(spec)
+
+    for index, token in enumerate(tokens[:-1]):
+        if token in ADDRESS_OPTIONS:
+            try:
+                network = ipaddress.ip_network(tokens[index + 1], strict=False)
+            except ValueError:
+                continue
+            tokens[index + 1] = network.with_prefixlen
+
+    return tuple(tokens)
+
+def split_spec(spec):
+    """
+    Split a rule spec into tokens, shlex is only needed for quoted values
+    """
+    if '"' in spec or "'" in spec or '\\' in spec:
+        return shlex.split(spec)
+
+    return spec.split()
+
+def parse_save(family, output):
+    """
+    Parse the output of iptables-save into (family, table, chain, spec)
+    keys, chains are listed with an empty spec
+    """
+    for key, _ in _parse_lines(family, output):
+        yield key
+
+def parse_counters(family, output):
+    """
+    Parse the output of iptables-save -c into the key, packets and bytes
+    of each rule
+    """
+    for key, counters in _parse_lines(family, output):
+        if key[3] is not None and counters:
+            packets, _, size = counters.strip('[]').partition(':')
+            yield key, int(packets), int(size)
+
+def _parse_lines(family, output):
+    table = None
+
+    for line in output.splitlines():
+        line = line.strip()
+        counters = None
+
+        if line.startswith('*'):
+            table = line[1:]
+            continue
+
+        if line.startswith(':'):
+            yield (family, table, line[1:].split(' ', 1)[0], None), None
+            continue
+
+        # Counters are printed before the rule with iptables-save -c
+        if line.startswith('['):
+            counters, _, line = line.partition(' ')
+
+        if not line.startswith('-A '):
+            continue
+
+        _, chain, spec = line.split(' ', 2)
+        yield (family, table, chain, normalize_spec(spec)), counters
+
+class KernelState:
+    """
+    Rules loaded in the kernel, indexed by family, table, chain and rule spec
+    """
+
+    def __init__(self, keys=()):
+        keys = list(keys)
+        self.rules = Counter(keys)
+        self.chains = {}
+
+        # The rules of each chain in the order the kernel evaluates them
+        for family, table, chain, spec in keys:
+            if spec is not None:
+                self.chains.setdefault((family, table, chain), []).append(spec)
+
+    @classmethod
+    def from_save(cls, outputs):
+        """
+        Build the state from the iptables-save output of each family
+        """
+        return cls(
+            key
+            for family, output in outputs.items()
+            for key in parse_save(family, output)
+        )
+
+    def __contains__(self, key):
+        return self.rules[key] > 0
+
+    def __len__(self):
+        return sum(
+            count for key, count in self.rules.items()
+            if key[3] is not None
+        )
+
+    def rule_key(self, rule, table='filter'):
+        """
+        Return the index key of a rule formatted by Management._format_rules
+        """
+        return (
+            FAMILIES.get(rule[0]),
+            table,
+            rule[2],
+            normalize_spec(' '.join(rule[3:]))
+        )
+
+    def chain_rules(self, binary, chain, table='filter'):
+        """
+        Return the specs of the rules loaded in a chain, in evaluation order
+        """
+        return list(self.chains.get((FAMILIES.get(binary), table, chain), []))
+
+    def has_rule(self, rule, table='filter'):
+        return self.rule_key(rule, table) in self
+
+    def loaded_rules(self, list_rules, table='filter'):
+        """
+        Return only the rules loaded in the kernel, each loaded copy
+        matches a single rule of the list
+        """
+        available = Counter(self.rules)
+        loaded = []
+
+        for rule in list_rules:
+            # Creating, flushing or deleting a chain depends only on the chain
+            if rule[1] in ('-N', '-F', '-X'):
+                if (FAMILIES.get(rule[0]), table, rule[2], None) in self:
+                    loaded.append(rule)
+                continue
+
+            key = self.rule_key(rule, table)
+
+            if available[key] > 0:
+                available[key] -= 1
+                loaded.append(rule)
+
+        return loaded
@@ -0,0 +1,124 @@
+import os
+import re
+from .chains import is_service_chain
+from .ordering import NetworkIndex, any_network, rule_covers, rule_match, rules_overlap
+
+
+DEFAULT_PRIORITY = 50
+PRIORITY_PREFIX = re.compile(r'^(\d+)[-_.]')
+PRIORITY_KEY = re.compile(r'^\s*priority\s*=\s*(-?\d+)\s*(#.*)?$')
+TERMINAL_TARGETS = {'ACCEPT', 'DROP', 'REJECT'}
+
+def file_priority(file):
+    """
+    Return the priority of a configuration file, the top level priority
+    key or the number the file name starts with. Files with a lower
+    priority are evaluated first
+    """
+    with open(file) as f:
+        for line in f:
+            if line.lstrip().startswith('['):
+                break
+
+            if match := PRIORITY_KEY.match(line):
+                return int(match.group(1))
+
+    if match := PRIORITY_PREFIX.match(os.path.basename(file)):
+        return int(match.group(1))
+
+    return DEFAULT_PRIORITY
+
+def evaluation_order(files):
+    """
+    Sort the files by priority and name, the order the kernel evaluates
+    their rules
+    """
+    return sorted(files, key=lambda file: (file_priority(file), os.path.basename(file)))
+
+def compile_order(files):
+    """
+    Return the files in the order they are compiled, since the rules are
+    inserted with -I the files evaluated first are compiled last
+    """
+    return evaluation_order(files)[::-1]
+
+def find_conflicts(file_rules):
+    """
+    Return the rules that overlap an earlier rule of another file with a
+    different target, as (kind, rule, file, other rule, other file) where
+    kind is 'shadowed' when the earlier rule matches every packet of the
+    rule and 'conflict' otherwise. file_rules are the compiled rules of
+    each file in compile order
+    """
+    conflicts = []
+
+    for rules in _evaluation(file_rules).values():
+        # Rules without a source match any address
+        entries = [
+            (match['src'] or any_network(rule), index)
+            for index, (_, rule, match) in enumerate(rules)
+        ]
+        index = NetworkIndex(entries)
+
+        for position, (file, rule, match) in enumerate(rules):
+            def earlier(candidates):
+                for other in candidates:
+                    other_file, _, other_match = rules[other]
+
+                    if (
+                        other < position and other_file != file
+                        and other_match['target'] != match['target']
+                        and rules_overlap(other_match, match)
+                    ):
+                        yield other
+
+            network = entries[position][0]
+            supernets = list(earlier(index.supernets(network)))
+            kind = 'shadowed'
+            other = next((item for item in supernets if rule_covers(rules[item][2], match)), None)
+
+            if other is None:
+                kind = 'conflict'
+                other = supernets[0] if supernets else next(earlier(index.subnets(network)), None)
+
+            if other is not None:
+                other_file, other_rule, _ = rules[other]
+                conflicts.append((kind, rule, file, other_rule, other_file))
+
+    # The rules of a service chain are evaluated once for each jump
+    return list(dict.fromkeys(conflicts))
+
+def _evaluation(file_rules):
+    """
+    Return the terminal rules of each base chain in the order the kernel
+    evaluates them, the rules of a service chain take the place of the
+    rule that jumps to it
+    """
+    chains = {}
+
+    for file, rules in file_rules:
+        for rule in rules:
+            if rule[1] in ('-I', '-A'):
+                chains.setdefault((rule[0], rule[2]), []).append((file, rule))
+
+    def evaluate(key):
+        for file, rule in _evaluated(chains.get(key, [])):
+            match = rule_match(rule)
+            target = match['target'] or ''
+
+            if is_service_chain(target):
+                yield from evaluate((rule[0], target))
+            elif target in TERMINAL_TARGETS:
+                yield file, rule, match
+
+    return {
+        key: list(evaluate(key))
+        for key in chains
+        if not is_service_chain(key[1])
+    }
+
+def _evaluated(rules):
+    inserted = [item for item in rules if item[1][1] == '-I']
+    appended = [item for item in rules if item[1][1] == '-A']
+
+    return [*inserted[::-1], *appended]
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+XTABLES_LOCK = os.environ.get('XTABLES_LOCKFILE', '/run/xtables.lock')
+XTABLES_BINARIES = ('iptables', 'ip6tables')
+PROC_LOCKS = '/proc/locks'
+
+class Metrics:
+    """
+    Time spent in each phase and counters of a run, safe to update from
+    the threads that apply each family
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    # The lock is not pickled when Management is sent to the compile
+    # processes, their metrics are counted by the parent
+    def __getstate__(self):
+        return {**self.__dict__, 'lock': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, lock=threading.Lock())
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                phase = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                phase['calls'] += 1
+                phase['seconds'] += elapsed
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self, **fields):
+        """
+        Return the metrics of the run as a dict ready to be dumped as JSON
+        """
+        with self.lock:
+            return {
+                **fields,
+                'seconds': round(time.perf_counter() - self.start, 6),
+                'phases': {
+                    name: {'calls': phase['calls'], 'seconds': round(phase['seconds'], 6)}
+                    for name, phase in self.phases.items()
+                },
+                'counters': {
+                    name: round(value, 6) if isinstance(value, float) else value
+                    for name, value in self.counters.items()
+                },
+            }
+
+    def dumps(self, **fields):
+        return json.dumps(self.summary(**fields), sort_keys=True)
+
+def timed(name):
+    """
+    Decorator that times the Management method as the phase name
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.phase(name):
+                return function(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def xtables_lock_busy(argv):
+    """
+    Return whether another process holds the xtables lock the command is
+    about to take. The lock is looked up in /proc/locks, so the probe
+    never takes it and never waits
+    """
+    if not argv or argv[0].removesuffix('-restore') not in XTABLES_BINARIES:
+        return False
+
+    try:
+        stat = os.stat(XTABLES_LOCK)
+        with open(PROC_LOCKS) as f:
+            locks = f.read()
+    except OSError:
+        return False
+
+    key = f'{os.major(stat.st_dev):02x}:{os.minor(stat.st_dev):02x}:{stat.st_ino}'
+
+    # Waiting processes are listed with -> before the lock type
+    return any(
+        fields[1] == 'FLOCK' and fields[5] == key
+        for fields in map(str.split, locks.splitlines())
+        if len(fields) > 5
+    )
@@ -0,0 +1,150 @@
+import ipaddress
+
+
+MULTIPORT_LIMIT = 15
+
+def parse_ports(value):
+    """
+    Return the (first, last) ranges of a port, a list of ports or a range
+    written as '8000:8010' or '8000-8010'
+    """
+    values = value if isinstance(value, list) else [value]
+    ranges = []
+
+    for item in values:
+        first, _, last = str(item).replace('-', ':').partition(':')
+        ranges.append((int(first), int(last or first)))
+
+    return ranges
+
+def port_slots(ranges):
+    """
+    Return how many multiport slots the ranges use, a range uses two
+    """
+    return sum(1 if first == last else 2 for first, last in ranges)
+
+def chunk_ports(ranges):
+    """
+    Split the ranges in groups that fit in a single multiport match
+    """
+    chunks = [[]]
+
+    for port in ranges:
+        if port_slots([*chunks[-1], port]) > MULTIPORT_LIMIT:
+            chunks.append([])
+        chunks[-1].append(port)
+
+    return chunks
+
+def format_ports(ranges):
+    ports = [
+        str(first) if first == last else f'{first}:{last}'
+        for first, last in ranges
+    ]
+
+    if len(ports) == 1:
+        return f'--dport {ports[0]}'
+
+    return f"-m multiport --dports {','.join(ports)}"
+
+def merge_ports(list_rules):
+    """
+    Merge rules that share family, chain, source, destination, protocol and
+    target into multiport rules. The merged rule takes the place of its
+    last rule, and a group is closed once a rule with a different target
+    overlaps it, so the first match of every packet is preserved
+    """
+    merged = []
+    groups = {}
+
+    for rule in list_rules:
+        fields = _parse_rule(rule)
+        chain_groups = groups.setdefault((rule[0], rule[2]), {})
+
+        if fields is None:
+            chain_groups.clear()
+            merged.append((rule, None))
+            continue
+
+        for key, index in list(chain_groups.items()):
+            if key[-1] != fields['-j'] and _overlaps(merged[index][1], fields):
+                del chain_groups[key]
+
+        key = (fields['-s'], fields['-d'], fields['-p'], fields['-j'])
+        index = chain_groups.get(key)
+
+        if index is not None:
+            group = merged[index][1]
+            ports = [port for port in fields['ports'] if port not in group['ports']]
+
+            if port_slots(group['ports'] + ports) <= MULTIPORT_LIMIT:
+                group['ports'].extend(ports)
+                merged.append(merged[index])
+                merged[index] = None
+                chain_groups[key] = len(merged) - 1
+                continue
+
+        chain_groups[key] = len(merged)
+        merged.append((rule, fields))
+
+    return [
+        _format_rule(rule, fields) if fields else rule
+        for rule, fields in filter(None, merged)
+    ]
+
+def _parse_rule(rule):
+    """
+    Return the fields of a rule formatted by Management._format_rules, or
+    None for rules with options this pass does not understand
+    """
+    fields = dict.fromkeys(['-s', '-d', '-p', 'ports', '-m comment', '-j'])
+
+    for fragment in rule[3:]:
+        option, _, value = fragment.partition(' ')
+
+        if option == '--dport':
+            fields['ports'] = parse_ports(value)
+        elif fragment.startswith('-m multiport --dports '):
+            fields['ports'] = parse_ports(fragment.rsplit(' ', 1)[1].split(','))
+        elif fragment.startswith('-m comment '):
+            fields['-m comment'] = fragment
+        elif option in fields:
+            fields[option] = fragment
+        else:
+            return
+
+    if not fields['ports'] or not fields['-p']:
+        return
+
+    return fields
+
+def _format_rule(rule, fields):
+    return (
+        *rule[:3],
+        *[fields[option] for option in ['-s', '-d', '-p'] if fields[option]],
+        format_ports(fields['ports']),
+        *[fields[option] for option in ['-m comment', '-j'] if fields[option]]
+    )
+
+def _network(fragment):
+    if fragment:
+        return ipaddress.ip_network(fragment.split(' ', 1)[1], strict=False)
+
+def _overlaps(first, second):
+    """
+    Check if a packet can match both rules
+    """
+    if first['-p'] != second['-p']:
+        return False
+
+    for option in ['-s', '-d']:
+        networks = [_network(first[option]), _network(second[option])]
+
+        if None not in networks and not networks[0].overlaps(networks[1]):
+            return False
+
+    return any(
+        start <= other_end and other_start <= end
+        for start, end in first['ports']
+        for other_start, other_end in second['ports']
+    )
@@ -0,0 +1,167 @@
+import ipaddress
+import shlex
+from .kernel import FAMILIES
+from .multiport import parse_ports
+
+
+TABLE = 'iptables_tools'
+
+HOOKS = {
+    'PREROUTING': 'prerouting',
+    'INPUT': 'input',
+    'FORWARD': 'forward',
+    'OUTPUT': 'output',
+    'POSTROUTING': 'postrouting',
+}
+
+VERDICTS = {
+    'ACCEPT': 'accept',
+    'DROP': 'drop',
+}
+
+ADDRESS_MATCH = {
+    'ipv4': 'ip',
+    'ipv6': 'ip6',
+}
+
+def render_delete_script(table=TABLE):
+    """
+    Render an nft script that removes the table, even if it does not exist
+    """
+    return f'table inet {table} {{}}\ndelete table inet {table}\n'
+
+def render_nft_script(list_rules, table=TABLE):
+    """
+    Render the compiled rules as an nft script that replaces the inet table
+    in a single transaction. IPv4 and IPv6 rules that differ only in the
+    family share a rule, and consecutive rules that differ only in the
+    source or destination share an anonymous set
+    """
+    chains = {}
+
+    for rule in list_rules:
+        if rule[1] == '-N':
+            chains.setdefault(rule[2], [])
+
+    # Rules inserted later with -I are evaluated first
+    for rule in reversed([rule for rule in list_rules if rule[1] != '-N']):
+        fields = _parse_rule(rule)
+        statements = chains.setdefault(rule[2], [])
+
+        if statements and (merged := _merge(statements[-1], fields)):
+            statements[-1] = merged
+        else:
+            statements.append(fields)
+
+    lines = [*render_delete_script(table).splitlines(), f'table inet {table} {{']
+
+    # Regular chains are declared before the base chains that jump to them
+    for chain in sorted(chains, key=lambda chain: chain in HOOKS):
+        lines.append(f'\tchain {chain} {{')
+
+        if hook := HOOKS.get(chain):
+            lines.append(f'\t\ttype filter hook {hook} priority filter; policy accept;')
+
+        lines.extend(f'\t\t{_statement(fields)}' for fields in chains[chain])
+        lines.append('\t}')
+
+    return '\n'.join([*lines, '}', ''])
+
+def _parse_rule(rule):
+    fields = {
+        'family': FAMILIES[rule[0]],
+        'saddr': None,
+        'daddr': None,
+        'protocol': None,
+        'ports': None,
+        'comment': None,
+        'verdict': None,
+    }
+
+    for fragment in rule[3:]:
+        option, _, value = fragment.partition(' ')
+
+        if option == '-s':
+            fields['saddr'] = [ipaddress.ip_network(value, strict=False)]
+        elif option == '-d':
+            fields['daddr'] = [ipaddress.ip_network(value, strict=False)]
+        elif option == '-p':
+            fields['protocol'] = value.split(' ')[0]
+        elif option == '--dport':
+            fields['ports'] = tuple(parse_ports(value))
+        elif fragment.startswith('-m multiport --dports '):
+            fields['ports'] = tuple(parse_ports(fragment.rsplit(' ', 1)[1].split(',')))
+        elif fragment.startswith('-m comment --comment '):
+            fields['comment'] = shlex.split(fragment)[-1]
+        elif option == '-j':
+            fields['verdict'] = VERDICTS.get(value, f'jump {value}')
+        else:
+            raise ValueError(f"Option '{fragment}' is not supported by the nftables backend")
+
+    return fields
+
+def _merge(previous, fields):
+    """
+    Return a single statement for two consecutive statements when they
+    differ only in the family or in the addresses of one direction
+    """
+    same = [
+        key for key in ['family', 'saddr', 'daddr', 'protocol', 'ports', 'verdict']
+        if previous[key] == fields[key]
+    ]
+
+    if len(same) == 6:
+        return previous
+
+    if len(same) != 5:
+        return
+
+    differ = next((key for key in ['family', 'saddr', 'daddr'] if key not in same), None)
+
+    # Rules with other ports, protocol or verdict stay apart
+    if differ is None:
+        return
+
+    if differ == 'family':
+        if previous['saddr'] or previous['daddr']:
+            return
+        return {**previous, 'family': None}
+
+    if not previous[differ] or not fields[differ] or previous['family'] != fields['family']:
+        return
+
+    return {**previous, differ: previous[differ] + fields[differ]}
+
+def _elements(values):
+    if len(values) == 1:
+        return values[0]
+
+    return f"{{ {', '.join(values)} }}"
+
+def _statement(fields):
+    parts = []
+    addresses = fields['saddr'] or fields['daddr']
+
+    if fields['family'] and not addresses:
+        parts.append(f"meta nfproto {fields['family']}")
+
+    for key in ['saddr', 'daddr']:
+        if fields[key]:
+            networks = [str(network) for network in ipaddress.collapse_addresses(fields[key])]
+            parts.append(f"{ADDRESS_MATCH[fields['family']]} {key} {_elements(networks)}")
+
+    if fields['protocol'] and fields['ports']:
+        ports = [
+            str(first) if first == last else f'{first}-{last}'
+            for first, last in fields['ports']
+        ]
+        parts.append(f"{fields['protocol']} dport {_elements(ports)}")
+    elif fields['protocol']:
+        parts.append(f"meta l4proto {fields['protocol']}")
+
+    parts.extend(['counter', fields['verdict']])
+
+    if fields['comment']:
+        parts.append(f'comment "{fields["comment"]}"')
+
+    return ' '.join(parts)
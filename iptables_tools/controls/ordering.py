@@ -0,0 +1,299 @@
+import heapq
+import ipaddress
+import json
+import os
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from .kernel import normalize_spec, split_spec
+from .utils import all_project_path
+
+
+ORDER_FILE = 'order.json'
+PROTOCOL_OPTIONS = {'-p', '--protocol'}
+PORT_OPTIONS = {'--dport', '--destination-port', '--dports', '--destination-ports'}
+
+def order_path():
+    return f"{all_project_path('base')}/{ORDER_FILE}"
+
+def order_key(rule):
+    """
+    Return the key of a compiled rule in the saved order, the spec is
+    normalized so it matches the rules read from iptables-save
+    """
+    return ' '.join([rule[0], rule[2], *(
+        token
+        for fragment in rule[3:]
+        for token in _fragment_tokens(fragment)
+    )])
+
+# Fragments are shared by many rules, so they are parsed only once
+@lru_cache(maxsize=65536)
+def _fragment_tokens(fragment):
+    return normalize_spec(fragment)
+
+def load_order():
+    """
+    Return the packets of each rule saved by optimize-order, empty when
+    the order was never optimized
+    """
+    try:
+        with open(order_path()) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_order(hits):
+    path = order_path()
+    temporary = f'{path}.tmp'
+
+    with open(temporary, 'w') as f:
+        json.dump(hits, f)
+
+    os.replace(temporary, path)
+
+def remove_order():
+    try:
+        os.remove(order_path())
+    except FileNotFoundError:
+        pass
+
+def order_rules(list_rules, hits):
+    """
+    Reorder the rules of each chain so the rules with more hits are
+    evaluated first. Two rules keep their relative order when a packet can
+    match both and their targets differ, so every packet still reaches the
+    same verdict. Chain commands keep their place
+    """
+    groups = {}
+
+    # Rules inserted with -I are evaluated in the reverse order
+    for index, rule in enumerate(list_rules):
+        if rule[1] in ('-I', '-A'):
+            groups.setdefault((rule[0], rule[1], rule[2]), []).append(index)
+
+    ordered = list(list_rules)
+
+    for (_, operation, _), slots in groups.items():
+        evaluation = slots[::-1] if operation == '-I' else slots
+        rules = _order_group([list_rules[index] for index in evaluation], hits)
+
+        for index, rule in zip(evaluation, rules):
+            ordered[index] = rule
+
+    return ordered
+
+def _order_group(rules, hits):
+    """
+    Topological sort of the rules in evaluation order, picking the rule
+    with more hits among the rules whose conflicting predecessors were
+    already placed
+    """
+    counts = [hits.get(order_key(rule), 0) for rule in rules]
+
+    # Without hits the order would not change
+    if not any(counts):
+        return rules
+
+    matches = [rule_match(rule) for rule in rules]
+    successors = [[] for _ in rules]
+    pending = [0] * len(rules)
+
+    # The rules are indexed by their source for each protocol and ports,
+    # rules without a source match any address
+    networks = [match['src'] or any_network(rule) for rule, match in zip(rules, matches)]
+    buckets = {}
+
+    for position, match in enumerate(matches):
+        key = (match['protocol'], tuple(match['ports'] or ()))
+        buckets.setdefault(key, []).append((networks[position], position))
+
+    indexes = [
+        ({'protocol': protocol, 'ports': list(ports) or None, 'src': None, 'dst': None}, NetworkIndex(entries))
+        for (protocol, ports), entries in buckets.items()
+    ]
+
+    # Only earlier rules with overlapping matches and different targets
+    # can conflict
+    for second, match in enumerate(matches):
+        network = networks[second]
+
+        for bucket, index in indexes:
+            if not rules_overlap(bucket, match):
+                continue
+
+            for first in [*index.supernets(network), *index.subnets(network)]:
+                if (
+                    first < second and matches[first]['target'] != match['target']
+                    and rules_overlap(matches[first], match)
+                ):
+                    successors[first].append(second)
+                    pending[second] += 1
+
+    ready = [(-counts[index], index) for index in range(len(rules)) if not pending[index]]
+    heapq.heapify(ready)
+    ordered = []
+
+    while ready:
+        _, index = heapq.heappop(ready)
+        ordered.append(rules[index])
+
+        for successor in successors[index]:
+            pending[successor] -= 1
+            if not pending[successor]:
+                heapq.heappush(ready, (-counts[successor], successor))
+
+    return ordered
+
+class NetworkIndex:
+    """
+    Index of networks by address range. Networks are either nested or
+    disjoint, so the overlapping networks are the supernets, found by
+    masking the address with each indexed prefix length, and the subnets,
+    found by a range search over the sorted network addresses
+    """
+
+    def __init__(self, entries):
+        self.networks = {}
+        self.prefixes = set()
+        self.starts = []
+
+        for network, item in entries:
+            key = (int(network.network_address), network.prefixlen)
+            self.networks.setdefault(key, []).append(item)
+            self.prefixes.add(network.prefixlen)
+            self.starts.append((*key, item))
+
+        self.starts.sort()
+        self.keys = [start[:2] for start in self.starts]
+        self.prefixes = sorted(self.prefixes)
+
+    def supernets(self, network):
+        """
+        Yield the items of the network and of its supernets
+        """
+        address = int(network.network_address)
+        bits = network.max_prefixlen
+
+        for prefix in self.prefixes:
+            if prefix > network.prefixlen:
+                break
+
+            mask = ((1 << bits) - 1) ^ ((1 << (bits - prefix)) - 1)
+            yield from self.networks.get((address & mask, prefix), [])
+
+    def subnets(self, network):
+        """
+        Yield the items of the networks inside the network
+        """
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        start = bisect_left(self.keys, (first, network.prefixlen + 1))
+        end = bisect_right(self.keys, (last, network.max_prefixlen + 1))
+
+        for _, prefix, item in self.starts[start:end]:
+            if prefix > network.prefixlen:
+                yield item
+
+def any_network(rule):
+    return ipaddress.ip_network('::/0' if rule[0] == 'ip6tables' else '0.0.0.0/0')
+
+def rule_match(rule):
+    """
+    Return the target and the parts of the match that can prove two rules
+    disjoint, None stands for any value
+    """
+    match = {'target': None, 'src': None, 'dst': None, 'protocol': None, 'ports': None, 'set': None}
+
+    for fragment in rule[3:]:
+        match.update(_fragment_match(fragment))
+
+    return match
+
+@lru_cache(maxsize=65536)
+def _fragment_match(fragment):
+    # The addresses are parsed below, normalizing them would parse twice
+    tokens = split_spec(fragment)
+    match = {}
+
+    for previous, option, value in zip(('', *tokens), tokens, tokens[1:]):
+        # A negated match can not prove two rules disjoint
+        if previous == '!':
+            continue
+
+        if option == '-j':
+            match['target'] = value
+        elif option in ('-s', '--source'):
+            match['src'] = _network(value)
+        elif option in ('-d', '--destination'):
+            match['dst'] = _network(value)
+        elif option in PROTOCOL_OPTIONS:
+            match['protocol'] = value
+        elif option in PORT_OPTIONS:
+            match['ports'] = _ports(value)
+        elif option == '--match-set':
+            match['set'] = value
+
+    return match
+
+def rules_overlap(first, second):
+    """
+    Return whether a packet can match both rules, unknown matches overlap
+    """
+    if None not in (first['protocol'], second['protocol']) and first['protocol'] != second['protocol']:
+        return False
+
+    for key in ['src', 'dst']:
+        if None not in (first[key], second[key]) and not first[key].overlaps(second[key]):
+            return False
+
+    if None not in (first['ports'], second['ports']) and not any(
+        start <= other_end and other_start <= end
+        for start, end in first['ports']
+        for other_start, other_end in second['ports']
+    ):
+        return False
+
+    return True
+
+def rule_covers(first, second):
+    """
+    Return whether every packet matched by the second rule is also matched
+    by the first one
+    """
+    if first['protocol'] not in (None, second['protocol']):
+        return False
+
+    # The members of an ipset are unknown here
+    if first['set'] not in (None, second['set']):
+        return False
+
+    for key in ['src', 'dst']:
+        if first[key] is not None and (second[key] is None or not second[key].subnet_of(first[key])):
+            return False
+
+    if first['ports'] is not None and (second['ports'] is None or not all(
+        any(start <= other_start and other_end <= end for start, end in first['ports'])
+        for other_start, other_end in second['ports']
+    )):
+        return False
+
+    return True
+
+def _network(value):
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
+
+def _ports(value):
+    ranges = []
+
+    for item in value.split(','):
+        first, _, last = item.partition(':')
+
+        if not (first.isdigit() and (last or first).isdigit()):
+            return None
+
+        ranges.append((int(first), int(last or first)))
+
+    return ranges
@@ -0,0 +1,165 @@
+import json
+import subprocess
+from .commands import join_command
+from .iptables import Management, merged_rules
+from .kernel import save_binary, FAMILIES
+from .reconcile import loaded_rules
+
+
+# Rough apply costs in seconds, measured on the legacy backend: every
+# command pays the process start and the xtables lock, every restore
+# line pays parsing and the table rewrite
+COMMAND_COST = 0.005
+LINE_COST = 0.00002
+RULE_OPERATIONS = {'-I', '-A'}
+CHAIN_OPERATIONS = {'-N', '-F', '-X'}
+
+class PlanManagement(Management):
+    """
+    Management that records the commands and their payloads instead of
+    running them. With live the loaded rules are read from the kernel, or
+    from saved when it holds the iptables-save output of each binary,
+    otherwise the active configuration files are assumed to be loaded
+    """
+
+    def __init__(self, *args, live=False, saved=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.live = live
+        self.saved = saved
+        self.commands = []
+        self.compiled = None
+
+    def _run_subprocess(self, command, input=None, stdin=None, stdout=None):
+        command = join_command(command)
+
+        if self.live and command in map(save_binary, FAMILIES):
+            if self.saved is not None:
+                output = self.saved.get(command.removesuffix('-save'), '')
+                return subprocess.CompletedProcess(command, 0, stdout=output, stderr='')
+
+            return super()._run_subprocess(command)
+
+        if input is not None and not isinstance(input, str):
+            input = ''.join(input)
+
+        # Redirects are shown the way a shell would run them
+        if stdin:
+            command = f'{command} < {stdin}'
+        if stdout:
+            command = f'{command} > {stdout}'
+
+        self.commands.append((command, input))
+        return subprocess.CompletedProcess(command, 0, stdout='', stderr='')
+
+    def kernel_state(self):
+        # Without live the chains hold only the active rules
+        if self.live:
+            return super().kernel_state()
+
+    def _loaded_rules(self, list_rules, state=None):
+        if self.live:
+            return super()._loaded_rules(list_rules, state)
+
+        return list_rules
+
+    def plan(self, operation):
+        """
+        Record the commands of the start or restart operation and return
+        the change set with its counts and estimated cost
+        """
+        active, available = self._compiled_rules()
+        self.commands = []
+
+        if operation == 'start':
+            self._replace_rules(available)
+        elif self.restart_mode == 'reconcile':
+            self._apply_diff(active, available)
+        else:
+            self._delete_rules()
+            self._set_compiled_rules('insert', available)
+
+        active = self._applied_management()._optimize_rules(active)[0]
+        available = self._optimize_rules(available)[0]
+
+        # With live the rules are compared with the ones in the kernel
+        if self.live:
+            active = loaded_rules(active, available, self.kernel_state())
+
+        current = _count_rules(active)
+        desired = _count_rules(available)
+        added = desired if self.backend.replaces_table else self._count_operations(RULE_OPERATIONS)
+        unchanged = desired - added
+
+        return {
+            'operation': operation,
+            'backend': self.backend.name,
+            'apply_mode': self.apply_mode,
+            'restart_mode': self.restart_mode,
+            'live': self.live,
+            'rules': {
+                'added': added,
+                'removed': current - unchanged,
+                'unchanged': unchanged,
+            },
+            'subprocess_calls': len(self.commands),
+            'estimated_seconds': round(self._estimate(), 3),
+            'commands': [
+                {'command': command, 'input': input}
+                for command, input in self.commands
+            ],
+        }
+
+    def _compiled_rules(self):
+        """
+        Validate and compile the active and available files once, every
+        plan of this management reuses them
+        """
+        if self.compiled is None:
+            available = merged_rules(self.validate_setup())
+            self.compiled = (
+                self._applied_management()._compile_rules(self._config_files('config-active')),
+                available
+            )
+
+        return self.compiled
+
+    def _count_operations(self, operations):
+        count = 0
+
+        for command, input in self.commands:
+            if 'tables' not in command:
+                continue
+
+            lines = input.splitlines() if input else [command.split(' ', 1)[1]]
+            count += sum(line.split(' ', 1)[0] in operations for line in lines)
+
+        return count
+
+    def _estimate(self):
+        return sum(
+            COMMAND_COST + LINE_COST * len(input.splitlines() if input else [])
+            for _, input in self.commands
+        )
+
+def _count_rules(list_rules):
+    return sum(rule[1] not in CHAIN_OPERATIONS for rule in list_rules)
+
+def print_plan(operation, live=False, output_json=False, **options):
+    plan = PlanManagement(live=live, **options).plan(operation)
+
+    if output_json:
+        print(json.dumps(plan, indent=2))
+        return
+
+    for item in plan['commands']:
+        print(f"$ {item['command']}")
+        if item['input']:
+            print(item['input'], end='' if item['input'].endswith('\n') else '\n')
+
+    rules = plan['rules']
+    print(
+        f"\nRules to add: {rules['added']}, to remove: {rules['removed']}, "
+        f"unchanged: {rules['unchanged']}.\n"
+        f"Subprocess calls: {plan['subprocess_calls']}, "
+        f"estimated apply time: {plan['estimated_seconds']}s."
+    )
@@ -0,0 +1,292 @@
+import asyncio
+import importlib
+import json
+import logging
+import subprocess
+import time
+from functools import partial
+from .commands import join_command, split_command
+from .exceptions import PushError
+from .kernel import FAMILIES, save_binary
+from .metrics import Metrics
+from .plan import PlanManagement
+
+
+# Reads of the local kernel recorded by the plan, the targets are never
+# compared with this machine
+SKIPPED_COMMANDS = {'ipset save'}
+
+class DryRunTransport:
+    """
+    Record the commands of every target instead of running them, the
+    targets have no rules loaded. Tests a rollout without touching any
+    machine
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    async def run(self, target, argv, input=None):
+        self.commands.setdefault(target, []).append((argv, input))
+        logging.info(f'{target}: {join_command(argv)}' + (f'\n{input}' if input else ''))
+
+        return subprocess.CompletedProcess(argv, 0, '', '')
+
+class SSHTransport:
+    """
+    Run the commands on the target through ssh, without prompts
+    """
+    options = ['-o', 'BatchMode=yes']
+
+    def argv(self, target, argv):
+        return ['ssh', *self.options, target, '--', join_command(argv)]
+
+    async def run(self, target, argv, input=None):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self.argv(target, argv),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except OSError as err:
+            return subprocess.CompletedProcess(argv, 127, '', str(err))
+
+        try:
+            stdout, stderr = await process.communicate(input.encode() if input else None)
+        except asyncio.CancelledError:
+            # A target that timed out must not keep running the command
+            process.kill()
+            await process.wait()
+            raise
+
+        return subprocess.CompletedProcess(argv, process.returncode, stdout.decode(), stderr.decode())
+
+DEFAULT_TRANSPORT = 'ssh'
+
+TRANSPORTS = {
+    'dry-run': DryRunTransport,
+    'ssh': SSHTransport,
+}
+
+def load_transport(name):
+    """
+    Return the transport registered with the name, or the class of a
+    'package.module:Class' path
+    """
+    if transport := TRANSPORTS.get(name):
+        return transport()
+
+    module, _, attribute = name.partition(':')
+
+    return getattr(importlib.import_module(module), attribute)()
+
+def render_steps(management, operation, saved):
+    """
+    Return the commands of the operation with their payloads for a target,
+    diffed against the rules saved from it. The configuration is compiled
+    once by the management and reused for every target
+    """
+    management.saved = saved
+    plan = management.plan(operation)
+
+    return [
+        {'argv': split_command(item['command']), 'input': item['input']}
+        for item in plan['commands']
+        if join_command(split_command(item['command'])) not in SKIPPED_COMMANDS
+    ]
+
+def waves(targets, canary=1, batch=0):
+    """
+    Split the targets in the canary wave and waves of batch targets, the
+    remaining targets form a single wave without batch
+    """
+    targets = list(targets)
+    result = [targets[:canary]] if canary else []
+    remaining = targets[canary:]
+    size = batch or len(remaining)
+
+    result.extend(remaining[start:start + size] for start in range(0, len(remaining), size))
+
+    return [wave for wave in result if wave]
+
+class Rollout:
+    """
+    Apply the steps on the targets wave by wave, at most concurrency
+    targets at a time. The steps of each target are rendered from the
+    rules saved from it. The rollout stops when a canary fails or when
+    more than max_failures targets fail, the targets not started are
+    skipped
+    """
+
+    def __init__(self, transport, render, concurrency=10, canary=1, batch=0,
+                 max_failures=0, timeout=None):
+        self.transport = transport
+        self.render = render
+        self.concurrency = concurrency
+        self.canary = canary
+        self.batch = batch
+        self.max_failures = max_failures
+        self.timeout = timeout
+        self.failures = 0
+        self.aborted = False
+        self.metrics = Metrics()
+
+    def __call__(self, targets):
+        return asyncio.run(self.run(targets))
+
+    async def run(self, targets):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = []
+
+        async def bounded(target):
+            async with semaphore:
+                return await self._target(target)
+
+        for number, wave in enumerate(waves(targets, self.canary, self.batch), 1):
+            if self.aborted:
+                results.extend(_result(target, 'skipped') for target in wave)
+                continue
+
+            with self.metrics.phase('wave'):
+                wave_results = await asyncio.gather(*map(bounded, wave))
+
+            results.extend(wave_results)
+            applied = sum(result['status'] == 'ok' for result in wave_results)
+            logging.info(f'Wave {number}: {applied} of {len(wave)} targets applied.')
+
+            if number == 1 and self.canary and applied < len(wave):
+                logging.warning('The canary failed, stopping the rollout.')
+                self.aborted = True
+
+        return results
+
+    async def _target(self, target):
+        if self.aborted:
+            return _result(target, 'skipped')
+
+        start = time.perf_counter()
+        saved = await self._save(target)
+
+        try:
+            steps = self.render(saved)
+        except Exception as err:
+            return self._finish(target, _result(target, 'failed', f'unable to render the rules: {err}'), start)
+
+        try:
+            result = await asyncio.wait_for(self._apply(target, steps), self.timeout)
+        except asyncio.TimeoutError:
+            result = _result(target, 'failed', f'timed out after {self.timeout}s')
+
+        if result['status'] != 'ok':
+            await self._restore(target, saved)
+
+        return self._finish(target, result, start)
+
+    def _finish(self, target, result, start):
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        self.metrics.count(f"targets_{result['status']}")
+
+        if result['status'] != 'ok':
+            self.failures += 1
+            logging.warning(f"{target}: {result['error']}")
+
+            if self.failures > self.max_failures:
+                self.aborted = True
+
+        return result
+
+    async def _apply(self, target, steps):
+        for step in steps:
+            result = await self.transport.run(target, step['argv'], step['input'])
+            self.metrics.count('subprocesses')
+
+            if result.returncode != 0:
+                error = f"{join_command(step['argv'])}: {result.stderr.strip()}"
+                return _result(target, 'failed', error)
+
+        return _result(target, 'ok')
+
+    async def _save(self, target):
+        """
+        Return the rules of each family loaded on the target before the
+        rollout, the families without them are not restored
+        """
+        saved = {}
+
+        for binary in FAMILIES:
+            result = await self.transport.run(target, split_command(save_binary(binary)))
+
+            if result.returncode == 0:
+                saved[binary] = result.stdout
+
+        return saved
+
+    async def _restore(self, target, saved):
+        for binary, rules in saved.items():
+            try:
+                result = await asyncio.wait_for(
+                    self.transport.run(target, [f'{binary}-restore'], rules),
+                    self.timeout
+                )
+            except asyncio.TimeoutError:
+                result = None
+
+            if result is None or result.returncode != 0:
+                logging.warning(f'{target}: unable to restore the {binary} rules.')
+
+def _result(target, status, error=None):
+    return {'target': target, 'status': status, 'error': error, 'seconds': 0.0}
+
+def read_targets(targets, targets_file=None):
+    """
+    Return the targets of the command line and of the file, one per line
+    with # comments
+    """
+    targets = list(targets)
+
+    if targets_file:
+        with open(targets_file) as f:
+            for line in f:
+                if line := line.split('#', 1)[0].strip():
+                    targets.append(line)
+
+    return list(dict.fromkeys(targets))
+
+def push(targets, operation='restart', transport=None, concurrency=10, canary=1,
+         batch=0, max_failures=0, timeout=None, output_json=False, **options):
+    """
+    Compile the rules once and apply on each target the changes from the
+    rules loaded on it, raising PushError when the rollout stops before
+    every target was applied
+    """
+    management = PlanManagement(live=True, **options)
+    # Validation errors stop the push before any target is touched
+    management._compiled_rules()
+
+    rollout = Rollout(
+        load_transport(transport or DEFAULT_TRANSPORT),
+        partial(render_steps, management, operation),
+        concurrency=concurrency,
+        canary=canary,
+        batch=batch,
+        max_failures=max_failures,
+        timeout=timeout
+    )
+
+    logging.info(f'Pushing the {operation} to {len(targets)} targets.')
+    results = rollout(targets)
+    logging.info(rollout.metrics.dumps(
+        method='push',
+        status='aborted' if rollout.aborted else 'ok'
+    ))
+
+    if output_json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['target']:<30} {result['status']:<8} {result['seconds']:>8}s {result['error'] or ''}")
+
+    if rollout.aborted:
+        failed = [result['target'] for result in results if result['status'] == 'failed']
+        raise PushError(f"{len(failed)} targets failed: {', '.join(failed)}")
@@ -0,0 +1,202 @@
+from bisect import bisect_left
+from .chains import is_service_chain, split_service_chains
+from .kernel import normalize_spec
+
+
+def rule_key(rule):
+    """
+    Return the identity of a rule regardless of the operation
+    """
+    return (rule[0], rule[2], ' '.join(rule[3:]))
+
+def chain_order(list_rules):
+    """
+    Group the rules by family and chain in the order they are evaluated
+    by the kernel, since the rules inserted later with -I end up first
+    """
+    chains = {}
+    occurrences = {}
+
+    for rule in reversed(list_rules):
+        key = rule_key(rule)
+        occurrences[key] = occurrences.get(key, -1) + 1
+        chains.setdefault(key[:2], []).append((key, occurrences[key]))
+
+    return chains
+
+def diff_rules(active, available, state=None):
+    """
+    Compare the active and available rules and return the delete and
+    insert commands needed to go from one to the other, along with the
+    number of rules left untouched. With a state the rules loaded in its
+    chains, which may hold rules of other tools, are compared instead of
+    the active rules and give the insert positions. Without a state the
+    chains are assumed to hold only the active rules. Raises LookupError
+    when a rule the positions depend on is not loaded
+    """
+    if state is not None:
+        active = loaded_rules(active, available, state)
+
+    active, current_chains = split_service_chains(active)
+    available, desired_chains = split_service_chains(available)
+    current = chain_order(active)
+    desired = chain_order(available)
+    deletes, inserts = [], []
+    unchanged = 0
+
+    for chain in dict.fromkeys([*current, *desired]):
+        current_rules = current.get(chain, [])
+        desired_rules = desired.get(chain, [])
+        position = {rule: index for index, rule in enumerate(desired_rules)}
+
+        # Rules present in both sides stay in place as long as their
+        # relative order does not change
+        matched = [rule for rule in current_rules if rule in position]
+        stable = {
+            matched[index]
+            for index in _increasing_subsequence([position[rule] for rule in matched])
+        }
+
+        removed = [rule for rule in current_rules if rule not in stable]
+        deletes.extend(_format_command(rule, '-D') for rule in removed)
+
+        if state is None:
+            loaded = [normalize_spec(key[2]) for key, _ in current_rules]
+        else:
+            loaded = state.chain_rules(*chain)
+
+        for index, position in _insert_positions(desired_rules, stable, removed, loaded):
+            inserts.append(_format_command(desired_rules[index], '-I', position))
+
+        unchanged += len(stable)
+
+    # Service chains are replaced as a whole, they are created or flushed
+    # and filled before the jumps are inserted and removed after the jumps
+    # are deleted
+    refills = []
+
+    for (binary, name), rules in desired_chains.items():
+        if (binary, name) not in current_chains:
+            refills.extend([(binary, '-N', name), *rules])
+        elif current_chains[(binary, name)] != rules:
+            refills.extend([(binary, '-F', name), *rules])
+        else:
+            unchanged += len(rules)
+
+    for binary, name in current_chains.keys() - desired_chains.keys():
+        deletes.extend([(binary, '-F', name), (binary, '-X', name)])
+
+    return deletes, refills + inserts, unchanged
+
+def loaded_rules(active, available, state):
+    """
+    Return the active and available rules loaded in the kernel, in compile
+    order. The rules of the base chains follow the order of the kernel, so
+    rules missing from it are inserted again and rules already loaded are
+    not inserted twice
+    """
+    known = {}
+    current = []
+
+    for rule in [*available, *active]:
+        if rule[1] == '-N' or is_service_chain(rule[2]):
+            continue
+
+        known.setdefault((rule[0], rule[2], normalize_spec(' '.join(rule[3:]))), rule)
+
+    # Service chains are compared as a whole with the active rules
+    current.extend(
+        rule for rule in state.loaded_rules(active)
+        if rule[1] == '-N' or is_service_chain(rule[2])
+    )
+
+    for binary, chain in dict.fromkeys(key[:2] for key in known):
+        loaded = [
+            known[(binary, chain, spec)]
+            for spec in state.chain_rules(binary, chain)
+            if (binary, chain, spec) in known
+        ]
+        current.extend(reversed(loaded))
+
+    return current
+
+def _insert_positions(desired_rules, stable, removed, loaded):
+    """
+    Yield the index of each desired rule to insert and its position in the
+    loaded chain after the deletes. Each rule goes right after the desired
+    rule before it, the first one right before the first kept rule, so the
+    rules of other tools keep their place
+    """
+    chain = list(loaded)
+
+    # iptables -D removes the first rule that matches the spec
+    for (_, _, spec), _ in removed:
+        spec = normalize_spec(spec)
+        if spec in chain:
+            chain.remove(spec)
+
+    specs = [normalize_spec(key[2]) for key, _ in desired_rules]
+    first = next((index for index, rule in enumerate(desired_rules) if rule in stable), None)
+
+    for index, rule in enumerate(desired_rules):
+        if rule in stable:
+            continue
+
+        if index:
+            # Every desired rule before this one is loaded by now
+            position = _loaded_index(chain, specs[index - 1], desired_rules[index - 1][1]) + 1
+        elif first is not None:
+            position = _loaded_index(chain, specs[first], 0)
+        else:
+            position = 0
+
+        chain.insert(position, specs[index])
+        yield index, position + 1
+
+def _loaded_index(chain, spec, occurrence):
+    """
+    Return the index of the given occurrence of a spec in the chain
+    """
+    index = -1
+
+    for _ in range(occurrence + 1):
+        try:
+            index = chain.index(spec, index + 1)
+        except ValueError:
+            raise LookupError(f"Rule '{' '.join(spec)}' is not loaded, unable to place the rules next to it") from None
+
+    return index
+
+def _format_command(rule, operation, index=None):
+    (binary, chain, spec), _ = rule
+    position = (str(index),) if index else ()
+
+    return (binary, operation, chain, *position, spec)
+
+def _increasing_subsequence(values):
+    """
+    Return the indexes of the longest increasing subsequence of values
+    """
+    tails, tails_index = [], []
+    previous = [None] * len(values)
+
+    for index, value in enumerate(values):
+        position = bisect_left(tails, value)
+
+        if position == len(tails):
+            tails.append(value)
+            tails_index.append(index)
+        else:
+            tails[position] = value
+            tails_index[position] = index
+
+        previous[index] = tails_index[position - 1] if position else None
+
+    result = set()
+    index = tails_index[-1] if tails_index else None
+
+    while index is not None:
+        result.add(index)
+        index = previous[index]
+
+    return result
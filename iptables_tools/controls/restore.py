@@ -0,0 +1,55 @@
+import re
+
+
+def restore_binary(binary):
+    """
+    Return the iptables-restore command of the family binary
+    """
+    return f'{binary}-restore --noflush'
+
+def iter_restore_payload(list_rules, binary, table='filter', counters=None):
+    """
+    Yield the lines of the iptables-restore payload of a family, so the
+    payload can be streamed to the command without being built in memory.
+    counters returns the [packets:bytes] prefix of a rule for --counters
+    """
+    yield f'*{table}\n'
+
+    # Declaring a chain creates it or flushes it when it already exists
+    for rule in list_rules:
+        if rule[0] == binary and rule[1] == '-N':
+            yield f':{rule[2]} - [0:0]\n'
+
+    for rule in list_rules:
+        if rule[0] == binary and rule[1] != '-N':
+            prefix = counters(rule) if counters else ''
+            yield prefix + ' '.join(rule[1:]) + '\n'
+
+    yield 'COMMIT\n'
+
+def render_restore_payload(list_rules, table='filter'):
+    """
+    Group the rules by family and render one iptables-restore payload
+    for each family
+    """
+    return {
+        binary: ''.join(iter_restore_payload(list_rules, binary, table))
+        for binary in dict.fromkeys(rule[0] for rule in list_rules)
+    }
+
+def iter_rule_transactions(list_rules, table='filter'):
+    """
+    Yield one transaction for each rule, so a single iptables-restore
+    process applies the rules one at a time and stops at the first failure
+    """
+    for rule in list_rules:
+        yield f'*{table}\n{" ".join(rule[1:])}\nCOMMIT\n'
+
+def failed_transaction(stderr, lines=3):
+    """
+    Return the index of the transaction iptables-restore reported as
+    failed, None when the output has no line number. The legacy command
+    reports "line N failed" and the nft one "Error occurred at line: N"
+    """
+    if match := re.search(r'line:? (\d+)', stderr or ''):
+        return (int(match.group(1)) - 1) // lines
@@ -0,0 +1,59 @@
+import os
+from datetime import datetime
+from .utils import all_project_path
+
+
+MAX_SNAPSHOTS = 10
+
+def snapshot_path():
+    return f"{all_project_path('backup')}/snapshots"
+
+def save_snapshot(outputs):
+    """
+    Store the iptables-save output of each family as a new snapshot and
+    keep only the most recent ones. Returns the snapshot name
+    """
+    path = snapshot_path()
+    name = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(path, exist_ok=True)
+
+    for binary, output in outputs.items():
+        with open(f'{path}/{name}.{binary}', 'w') as f:
+            f.write(output)
+
+    for old in list_snapshots()[MAX_SNAPSHOTS:]:
+        for file in os.listdir(path):
+            if file.startswith(f'{old}.'):
+                os.remove(f'{path}/{file}')
+
+    return name
+
+def list_snapshots():
+    """
+    Return the snapshot names, most recent first
+    """
+    if not os.path.isdir(snapshot_path()):
+        return []
+
+    return sorted(
+        {file.split('.', 1)[0] for file in os.listdir(snapshot_path())},
+        reverse=True
+    )
+
+def load_snapshot(name):
+    """
+    Return the iptables-save output of each family stored in the snapshot
+    """
+    path = snapshot_path()
+    outputs = {}
+
+    for file in os.listdir(path):
+        snapshot, _, binary = file.partition('.')
+        if snapshot == name:
+            with open(f'{path}/{file}') as f:
+                outputs[binary] = f.read()
+
+    if not outputs:
+        raise FileNotFoundError(f'Snapshot {name} not found in {path}')
+
+    return outputs
@@ -0,0 +1,220 @@
+import json
+import os
+import tempfile
+from .compiled import load_compiled_sets
+from .kernel import FAMILIES, KernelState
+from .utils import read_toml_file
+
+
+COMMENT_OPTION = '-m comment --comment '
+METRICS = {
+    'packets': 'Packets matched by the rule.',
+    'bytes': 'Bytes matched by the rule.',
+}
+
+def rule_origins(management, files):
+    """
+    Index the origin of the compiled rules by their kernel key, with the
+    comment as a fallback for the rules merged by the optimizations. The
+    rules compacted into an ipset take the origin of their first rule
+    """
+    state = KernelState()
+    origins = {}
+
+    for file in files:
+        for service, config in read_toml_file(file).items():
+            if not isinstance(config, dict):
+                continue
+
+            for section, values in config.items():
+                data = {service: {section: values}}
+
+                for rule in management._iter_toml(data, 'insert'):
+                    if rule[1] in ('-N', '-F', '-X'):
+                        continue
+
+                    origin = {
+                        'file': os.path.basename(file),
+                        'service': service,
+                        'section': section,
+                        'mapping': _mapping(rule),
+                    }
+                    origins.setdefault(state.rule_key(rule), origin)
+
+                    if comment := _comment(rule):
+                        key = (FAMILIES.get(rule[0]), rule[2], comment, rule[-1])
+                        origins.setdefault(key, origin)
+
+    # The set name is the comment of the compacted rule
+    for name, rule in load_compiled_sets(management.layout).items():
+        family = FAMILIES.get(rule[0])
+        origin = origins.get(state.rule_key(rule)) or origins.get(
+            (family, rule[2], _comment(rule), rule[-1])
+        )
+
+        if origin:
+            origins.setdefault((family, rule[2], name, rule[-1]), {**origin, 'mapping': name})
+
+    return origins
+
+def collect_stats(management, files):
+    """
+    Return the counters of the rules loaded from the configuration files,
+    read in a single iptables-save -c call per family
+    """
+    origins = rule_origins(management, files)
+    records = []
+
+    for key, packets, size in management.kernel_counters():
+        family, _, chain, spec = key
+        origin = origins.get(key) or origins.get(
+            (family, chain, _spec_comment(spec), _target(spec))
+        )
+
+        # Rules that only jump to a service chain would count twice
+        if origin is None or origin['mapping'] is None:
+            continue
+
+        records.append({
+            **origin,
+            'family': family,
+            'chain': chain,
+            'packets': packets,
+            'bytes': size,
+        })
+
+    return records
+
+def service_totals(records):
+    """
+    Sum the counters of the rules of each service
+    """
+    totals = {}
+
+    for record in records:
+        total = totals.setdefault(record['service'], {'rules': 0, 'packets': 0, 'bytes': 0})
+        total['rules'] += 1
+        total['packets'] += record['packets']
+        total['bytes'] += record['bytes']
+
+    return totals
+
+def render_prometheus(records):
+    """
+    Render the counters in the Prometheus text exposition format
+    """
+    lines = []
+    series = {}
+
+    # Rules split by the optimizations share the labels of their mapping
+    for record in records:
+        labels = _labels(record)
+        counters = series.setdefault(labels, dict.fromkeys(METRICS, 0))
+        for metric in METRICS:
+            counters[metric] += record[metric]
+
+    for metric, description in METRICS.items():
+        name = f'iptables_tools_rule_{metric}_total'
+        lines.extend([f'# HELP {name} {description}', f'# TYPE {name} counter'])
+        lines.extend(
+            f'{name}{{{labels}}} {counters[metric]}'
+            for labels, counters in series.items()
+        )
+
+    for metric, description in METRICS.items():
+        name = f'iptables_tools_service_{metric}_total'
+        lines.extend([
+            f'# HELP {name} {description.replace("the rule", "the rules of the service")}',
+            f'# TYPE {name} counter'
+        ])
+        lines.extend(
+            f'{name}{{service="{_escape(service)}"}} {total[metric]}'
+            for service, total in service_totals(records).items()
+        )
+
+    return '\n'.join([*lines, ''])
+
+def write_textfile(path, content):
+    """
+    Replace the file atomically, so the textfile collector never reads a
+    partial export
+    """
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+
+    with os.fdopen(descriptor, 'w') as f:
+        f.write(content)
+
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+def print_stats(management, files, output_format='table', output=None):
+    records = collect_stats(management, files)
+
+    if output_format == 'prometheus':
+        content = render_prometheus(records)
+    elif output_format == 'json':
+        content = json.dumps(
+            {'services': service_totals(records), 'rules': records},
+            indent=2
+        ) + '\n'
+    else:
+        content = _render_table(records)
+
+    if output:
+        write_textfile(output, content)
+        return
+
+    print(content, end='')
+
+def _render_table(records):
+    lines = [f"{'SERVICE':<20} {'RULES':>8} {'PACKETS':>14} {'BYTES':>16}"]
+
+    for service, total in sorted(service_totals(records).items()):
+        lines.append(
+            f"{service:<20} {total['rules']:>8} {total['packets']:>14} {total['bytes']:>16}"
+        )
+
+    lines.extend(['', f"{'PACKETS':>14} {'FAMILY':<6} {'SECTION':<30} MAPPING"])
+
+    for record in sorted(records, key=lambda record: -record['packets']):
+        section = f"{record['file']}:{record['service']}.{record['section']}"
+        lines.append(
+            f"{record['packets']:>14} {record['family']:<6} {section:<30} {record['mapping']}"
+        )
+
+    return '\n'.join([*lines, ''])
+
+def _comment(rule):
+    for fragment in rule[3:]:
+        if fragment.startswith(COMMENT_OPTION):
+            return fragment[len(COMMENT_OPTION):].strip('"')
+
+def _spec_comment(spec):
+    if '--comment' in spec[:-1]:
+        return spec[spec.index('--comment') + 1]
+
+def _target(spec):
+    return f'-j {spec[-1]}' if len(spec) > 1 and spec[-2] == '-j' else None
+
+def _mapping(rule):
+    """
+    Return the comment, source or destination that identifies the mapping
+    of a rule, None for the rules that jump to a service chain
+    """
+    if rule[-1] not in ('-j ACCEPT', '-j DROP'):
+        return None
+
+    if comment := _comment(rule):
+        return comment
+
+    addresses = [fragment for fragment in rule[3:] if fragment[:3] in ('-s ', '-d ')]
+    return ' '.join(addresses) or 'any'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(record):
+    return ','.join(
+        f'{label}="{_escape(record[label])}"'
+        for label in ['family', 'file', 'service', 'section', 'chain', 'mapping']
+    )
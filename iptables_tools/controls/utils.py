@@ -1,12 +1,48 @@
-import toml
+import os
+from functools import cache
 from pathlib import Path
 
 
+# Parsers with a loads function and the exception raised on invalid
+# files, tried in this order when no parser is selected
+TOML_PARSERS = {
+    'tomllib': 'TOMLDecodeError',
+    'tomli': 'TOMLDecodeError',
+    'rtoml': 'TomlParsingError',
+    'toml': 'TomlDecodeError',
+}
+
 def read_toml_file(file):
     """
     Read files in toml format
-    """    
-    return toml.load(file)
+    """
+    loads, _ = toml_parser()
+
+    with open(file) as f:
+        return loads(f.read())
+
+@cache
+def toml_parser(name=None):
+    """
+    Return the loads function and the decode error of the TOML parser
+    selected by IPTABLES_TOOLS_TOML_PARSER, by default the first one
+    installed. tomllib is in the standard library since Python 3.11
+    """
+    import importlib
+
+    name = name or os.environ.get('IPTABLES_TOOLS_TOML_PARSER')
+
+    for parser in [name] if name else TOML_PARSERS:
+        try:
+            module = importlib.import_module(parser)
+        except ImportError:
+            if name:
+                raise
+            continue
+
+        return module.loads, getattr(module, TOML_PARSERS.get(parser, 'TOMLDecodeError'))
+
+    raise ImportError('No TOML parser installed, install toml or use Python 3.11+')
 
 def relative_path(path):
     """
@@ -14,6 +50,18 @@ def relative_path(path):
     """
     return Path(__file__).parent.parent / path
 
+def tool_version():
+    """
+    Return the installed version of the project
+    """
+    # importlib.metadata is slow to import and only needed by the cache
+    from importlib.metadata import version, PackageNotFoundError
+
+    try:
+        return version('iptables-tools')
+    except PackageNotFoundError:
+        return '0.0.0'
+
 def config_path():
     return  "/opt/iptables_tools"
 
@@ -29,26 +77,40 @@ def all_project_path(name=None):
     """
     Return all path in the project
     """
+    dirs = _project_paths()
+
+    if name:
+        return dirs.get(name)
+
+    return dirs
+
+@cache
+def _project_paths():
     install_path = "/opt/iptables_tools"
 
-    dirs = {
+    return {
         'base': install_path,
         'export': f"{install_path}/export",
         'config-active': f"{install_path}/config-active.d",
         'config-available': f"{install_path}/config-available.d",
         'backup': f"{install_path}/backup",
+        'cache': f"{install_path}/cache",
     }
 
-    if name:
-        return dirs.get(name)
-
-    return dirs
-
 def all_project_files(name=None):
     """
     Return all files in the project
     """
-    files = {
+    files = _project_files()
+
+    if name:
+        return files.get(name)
+
+    return files
+
+@cache
+def _project_files():
+    return {
         'src_service': relative_path('systemd/iptables-tools.service'),
         'dst_service': '/etc/systemd/system/iptables-tools.service',
         'src_default': relative_path('templates/default.toml'),
@@ -58,10 +120,4 @@ def all_project_files(name=None):
         'bkp_rules_v6': f'{all_project_path("backup")}/rules.v6',
         'exp_rules_v4': f'{all_project_path("export")}/rules.v4',
         'exp_rules_v6': f'{all_project_path("export")}/rules.v6',
-    }
-
-    if name:
-        return files.get(name)
-
-    return files
-    
\ No newline at end of file
+    }
\ No newline at end of file
@@ -0,0 +1,234 @@
+import ipaddress
+import re
+from .chains import service_chain_name
+from .feeds import DIRECTIONS
+from .utils import toml_parser
+
+
+PROTOCOLS = {'tcp', 'udp', 'udplite', 'sctp', 'dccp'}
+VERSIONS = {'ipv4': 4, 'ipv6': 6}
+TARGETS = ['accept', 'drop']
+MAPPING_KEYS = {'src', 'dst', 'comment'}
+FEED_KEYS = {'file', 'direction'}
+
+# Feeds are loaded in ipsets, matched with -m set
+SET_BACKENDS = {'iptables'}
+
+class Problem:
+    """
+    A problem found in a configuration file
+    """
+    __slots__ = ('file', 'section', 'line', 'message')
+
+    def __init__(self, file, section, line, message):
+        self.file = file
+        self.section = section
+        self.line = line
+        self.message = message
+
+    def __str__(self):
+        location = f'{self.file}:{self.line}' if self.line else self.file
+        section = f' [{self.section}]' if self.section else ''
+        return f'{location}{section}: {self.message}'
+
+def validate_files(files, sections=None, backend='iptables'):
+    """
+    Validate the configuration files and return all the problems found,
+    including sections defined in more than one file. sections maps the
+    sections of files validated before to their file, the sections of the
+    files are added to it
+    """
+    loads, decode_error = toml_parser()
+    problems = []
+    sections = {} if sections is None else sections
+
+    for file in files:
+        with open(file) as f:
+            text = f.read()
+
+        try:
+            data = loads(text)
+        except decode_error as err:
+            problems.append(Problem(file, None, *_decode_error(err)))
+            continue
+
+        problems.extend(validate_config(file, text, data, backend))
+
+        for service, config in data.items():
+            if not isinstance(config, dict):
+                continue
+
+            for section in config:
+                name = service_chain_name(service, section)
+                if name in sections:
+                    problems.append(Problem(
+                        file,
+                        f'{service}.{section}',
+                        _line(text, f'{service}.{section}'),
+                        f'section also defined in {sections[name]}'
+                    ))
+                sections.setdefault(name, file)
+
+    return problems
+
+def validate_config(file, text, data, backend='iptables'):
+    """
+    Validate a parsed configuration file for the backend, the text is used
+    to locate the line of each problem
+    """
+    problems = []
+
+    def problem(section, message, value=None):
+        line = _line(text, section, value) if section else None
+        problems.append(Problem(file, section, line, message))
+
+    for service, config in data.items():
+        if service == 'priority':
+            if type(config) is not int:
+                problem(None, "'priority' must be an integer")
+            continue
+
+        if not isinstance(config, dict):
+            problem(service, 'service must be a table')
+            continue
+
+        for section, values in config.items():
+            name = f'{service}.{section}'
+
+            if not isinstance(values, dict):
+                problem(name, 'section must be a table')
+                continue
+
+            for key in ['protocol', 'chain', 'port']:
+                if not values.get(key):
+                    problem(name, f"'{key}' is mandatory")
+
+            if (protocol := values.get('protocol')) and protocol not in PROTOCOLS:
+                problem(name, f"unknown protocol '{protocol}', expected one of {sorted(PROTOCOLS)}", 'protocol')
+
+            if (chain := values.get('chain')) and not isinstance(chain, str):
+                problem(name, "'chain' must be a string", 'chain')
+
+            if port := values.get('port'):
+                for message in _port_problems(port):
+                    problem(name, message, 'port')
+
+            for version, family in VERSIONS.items():
+                for target in TARGETS:
+                    rules = values.get(version, {})
+                    rules = rules.get(target, {}) if isinstance(rules, dict) else None
+                    section_name = f'{name}.{version}.{target}'
+
+                    if isinstance(rules, dict) and (feed := rules.get('feed')) is not None:
+                        if backend not in SET_BACKENDS:
+                            problem(section_name, f"'feed' is not supported by the {backend} backend", 'feed')
+
+                        for message in _feed_problems(feed):
+                            problem(section_name, message, 'feed')
+
+                    mapping = rules.get('mapping') if isinstance(rules, dict) else None
+                    if mapping is None:
+                        continue
+
+                    if not isinstance(mapping, list):
+                        problem(section_name, "'mapping' must be a list")
+                        continue
+
+                    for rule in mapping:
+                        for message, value in _mapping_problems(rule, family):
+                            problem(section_name, message, value)
+
+    return problems
+
+def _port_problems(port):
+    ports = port if isinstance(port, list) else [port]
+
+    for item in ports:
+        first, _, last = str(item).replace('-', ':').partition(':')
+
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            yield f"invalid port '{item}'"
+            continue
+
+        if not 1 <= first <= last <= 65535:
+            yield f"port '{item}' out of range 1-65535"
+
+def _feed_problems(feed):
+    if isinstance(feed, str):
+        feed = {'file': feed}
+
+    if not isinstance(feed, dict):
+        yield "'feed' must be a file or a table"
+        return
+
+    if unknown := set(feed) - FEED_KEYS:
+        yield f'unknown keys {sorted(unknown)} in feed'
+
+    if not isinstance(feed.get('file'), str) or not feed.get('file'):
+        yield "'feed.file' is mandatory"
+
+    if feed.get('direction', 'src') not in DIRECTIONS:
+        yield f"invalid feed direction '{feed.get('direction')}', expected one of {sorted(DIRECTIONS)}"
+
+def _mapping_problems(rule, family):
+    if not isinstance(rule, dict):
+        yield 'mapping entries must be tables', None
+        return
+
+    if unknown := set(rule) - MAPPING_KEYS:
+        yield f'unknown keys {sorted(unknown)} in mapping', None
+
+    for key in ['src', 'dst']:
+        if (value := rule.get(key)) is None:
+            continue
+
+        try:
+            network = ipaddress.ip_network(value, strict=False)
+        except (TypeError, ValueError):
+            yield f"invalid {key} '{value}'", value
+            continue
+
+        if network.version != family:
+            yield f"{key} '{value}' is not an IPv{family} network", value
+
+    if '"' in str(rule.get('comment', '')):
+        yield 'comment must not contain double quotes', rule.get('comment')
+
+def _decode_error(err):
+    """
+    Return the line and the message of a TOML decode error, each parser
+    reports the line in its own way
+    """
+    message = getattr(err, 'msg', None) or str(err)
+
+    if (line := getattr(err, 'lineno', None)) is None:
+        if match := re.search(r'line (\d+)', str(err)):
+            line = int(match.group(1))
+
+    return line, re.sub(r'\s*\(at line \d+, column \d+\)$', '', message)
+
+def _line(text, section, value=None):
+    """
+    Return the line of the closest section header, or of the first line
+    with the value after it
+    """
+    lines = text.splitlines()
+    parts = section.split('.')
+    start = None
+
+    while parts and start is None:
+        header = re.compile(rf'^\s*\[\s*{re.escape(".".join(parts))}\s*\]')
+        start = next((index for index, line in enumerate(lines) if header.match(line)), None)
+        parts.pop()
+
+    if start is None:
+        return
+
+    if value is not None:
+        for index in range(start, len(lines)):
+            if str(value) in lines[index]:
+                return index + 1
+
+    return start + 1
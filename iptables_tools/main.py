@@ -0,0 +1,69 @@
+import logging
+from iptables_tools.controls.exceptions import CommandNotFound, CommandPermissionError, RunCommandError, ValidationError
+from iptables_tools.controls.iptables import Management
+
+
+class Main(Management):
+
+    def __call__(self, method_name, command):
+        status = 'failed'
+
+        try:
+            method = getattr(self, method_name)
+            result = method(command)
+            status = 'ok'
+            return result
+        except ValidationError:
+            raise
+        except PermissionError as err:
+            self.roolback()
+            raise CommandPermissionError(method_name, command, err) from None
+        except RunCommandError:
+            self.roolback()
+            raise RunCommandError(method_name, command) from None
+        except CommandNotFound:
+            self.roolback()
+            raise CommandNotFound(method_name, command) from None
+        except Exception:
+            self.roolback()
+            raise
+        finally:
+            logging.info(self.metrics.dumps(method=method_name, status=status))
+    
+    def install(self, command):
+        self.install_setup()
+
+    def start(self, command):
+        self.start_setup()
+    
+    def stop(self, command):
+        self.stop_setup()
+
+    def restart(self, command):
+        self.restart_setup()
+
+    def daemon(self, command):
+        self.daemon_setup()
+
+    def optimize_order(self, command):
+        self.optimize_order_setup(reset=command)
+
+    def refresh_feeds(self, command):
+        self.refresh_feeds_setup()
+
+    def run(self, command):
+        if not command:
+            raise RunCommandError
+
+        self.run_command(command) 
+
+    def snapshots(self, command):
+        for name in self.snapshot_names():
+            print(name)
+
+    def roolback(self, command=None):
+        if self.snapshot or command:
+            self.restore_snapshot(command)
+            return
+
+        self.run_command('import-backup-rules')
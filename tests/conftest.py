@@ -0,0 +1,67 @@
+import os
+import pytest
+from iptables_tools.controls import utils
+
+
+def rule(*fragments, chain='INPUT', binary='iptables', operation='-I'):
+    """
+    Return a compiled rule with the fragments of its spec
+    """
+    return (binary, operation, chain, *fragments)
+
+def mapping_rule(source=None, port='--dport 22', target='-j ACCEPT', comment=None,
+                 destination=None, binary='iptables'):
+    """
+    Return a rule of a mapping, with the fragments in the order of
+    Management._format_rules
+    """
+    fragments = [f'-s {source}'] if source else []
+
+    if destination:
+        fragments.append(f'-d {destination}')
+
+    fragments.extend(['-p tcp -m tcp', port])
+
+    if comment:
+        fragments.append(f'-m comment --comment "{comment}"')
+
+    return rule(*fragments, target, binary=binary)
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """
+    Point the project directories to a temporary directory
+    """
+    paths = {
+        'base': str(tmp_path),
+        **{name: str(tmp_path / name) for name in ['export', 'backup', 'cache']},
+        'config-active': str(tmp_path / 'config-active.d'),
+        'config-available': str(tmp_path / 'config-available.d'),
+    }
+
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+
+    monkeypatch.setattr(utils, '_project_paths', lambda: paths)
+
+    return paths
+
+def write_config(path, name, sources, port=22):
+    """
+    Write a configuration file accepting the sources on the port
+    """
+    service = name.split('.')[0]
+    mapping = ', '.join(f"{{src='{source}'}}" for source in sources)
+
+    with open(f'{path}/{name}', 'w') as f:
+        f.write('\n'.join([
+            f'[{service}.input]',
+            'protocol = "tcp"',
+            'chain = "INPUT"',
+            f'port = {port}',
+            f'[{service}.input.ipv4.accept]',
+            f'mapping = [{mapping}]',
+            '',
+        ]))
+
+    return f'{path}/{name}'
@@ -0,0 +1,61 @@
+from iptables_tools.controls.aggregate import aggregate_rules
+from .conftest import mapping_rule as rule
+
+
+def test_adjacent_networks_are_collapsed():
+    list_rules = [rule('10.0.0.0/25', comment='a'), rule('10.0.0.128/25', comment='b')]
+
+    assert aggregate_rules(list_rules) == ([rule('10.0.0.0/24', comment='a')], 1)
+
+def test_contained_network_is_collapsed():
+    list_rules = [rule('10.0.0.0/24'), rule('10.0.0.5/32')]
+
+    assert aggregate_rules(list_rules) == ([rule('10.0.0.0/24')], 1)
+
+def test_different_targets_are_not_collapsed():
+    list_rules = [rule('10.0.0.0/25'), rule('10.0.0.128/25', target='-j DROP')]
+
+    assert aggregate_rules(list_rules) == (list_rules, 0)
+
+def test_rule_shadowed_by_a_rule_evaluated_before_is_dropped():
+    # The last rule is inserted last, so it is evaluated first
+    list_rules = [rule('10.0.0.5/32', target='-j DROP'), rule('10.0.0.0/24')]
+
+    assert aggregate_rules(list_rules) == ([rule('10.0.0.0/24')], 1)
+
+def test_rule_evaluated_before_a_broader_rule_is_kept():
+    list_rules = [rule('10.0.0.0/24'), rule('10.0.0.5/32', target='-j DROP')]
+
+    assert aggregate_rules(list_rules) == (list_rules, 0)
+
+def test_non_terminal_target_does_not_shadow():
+    list_rules = [rule('10.0.0.5/32'), rule('10.0.0.0/24', target='-j LOG')]
+
+    assert aggregate_rules(list_rules) == (list_rules, 0)
+
+def test_other_port_is_not_shadowed():
+    list_rules = [rule('10.0.0.5/32', port='--dport 80'), rule('10.0.0.0/24')]
+
+    assert aggregate_rules(list_rules) == (list_rules, 0)
+
+def test_unknown_options_are_kept():
+    list_rules = [
+        ('iptables', '-I', 'INPUT', '-s 10.0.0.0/25', '-m state --state NEW', '-j ACCEPT'),
+        ('iptables', '-I', 'INPUT', '-s 10.0.0.128/25', '-m state --state NEW', '-j ACCEPT'),
+    ]
+
+    assert aggregate_rules(list_rules) == (list_rules, 0)
+
+def test_ipv6_networks_are_collapsed():
+    list_rules = [rule('2001:db8::/33', binary='ip6tables'), rule('2001:db8:8000::/33', binary='ip6tables')]
+
+    assert aggregate_rules(list_rules) == ([rule('2001:db8::/32', binary='ip6tables')], 1)
+
+def test_rule_shadowed_in_both_directions_is_dropped():
+    list_rules = [
+        rule('10.0.0.5/32', destination='192.0.2.1/32', target='-j DROP'),
+        rule('10.0.0.0/24', destination='192.0.2.1/32', target='-j DROP', port='--dport 80'),
+        rule('10.0.0.0/24', destination='192.0.2.0/24'),
+    ]
+
+    assert aggregate_rules(list_rules) == (list_rules[1:], 1)
@@ -0,0 +1,74 @@
+import os
+import pytest
+from iptables_tools.controls import cache
+from iptables_tools.controls.cache import cache_key, load_cache, save_cache
+from iptables_tools.controls.iptables import Management
+from .conftest import write_config
+
+
+@pytest.fixture
+def config(project):
+    return write_config(project['config-available'], 'ssh.toml', ['10.0.0.1'])
+
+def test_key_depends_on_the_content_options_and_version(config, monkeypatch):
+    key = cache_key(config, 'flat')
+
+    assert cache_key(config, 'flat') == key
+    assert cache_key(config, 'chains') != key
+
+    monkeypatch.setattr(cache, 'tool_version', lambda: '99.0.0')
+    assert cache_key(config, 'flat') != key
+
+    monkeypatch.undo()
+    write_config(os.path.dirname(config), 'ssh.toml', ['10.0.0.2'])
+    assert cache_key(config, 'flat') != key
+
+def test_rules_round_trip(project):
+    save_cache('key', [['iptables', '-I', 'INPUT', '-j ACCEPT']])
+
+    assert load_cache('key') == [['iptables', '-I', 'INPUT', '-j ACCEPT']]
+    assert load_cache('missing') is None
+
+def test_corrupted_entry_is_a_miss(project):
+    with open(f"{project['cache']}/key.json", 'w') as f:
+        f.write('{')
+
+    assert load_cache('key') is None
+
+def test_hit_when_the_entry_cannot_be_touched(project, monkeypatch):
+    save_cache('key', [])
+
+    def utime(*args):
+        raise PermissionError
+
+    monkeypatch.setattr(os, 'utime', utime)
+
+    assert load_cache('key') == []
+
+def test_least_recently_used_entries_are_evicted(project, monkeypatch):
+    monkeypatch.setattr(cache, 'MAX_ENTRIES', 2)
+
+    for index, key in enumerate(['a', 'b', 'c']):
+        save_cache(key, [])
+        os.utime(f"{project['cache']}/{key}.json", (index, index))
+
+    save_cache('d', [])
+
+    assert sorted(os.listdir(project['cache'])) == ['c.json', 'd.json']
+
+def test_unchanged_file_is_not_parsed_again(config, monkeypatch):
+    from iptables_tools.controls import iptables
+
+    reads = []
+    read_toml_file = iptables.read_toml_file
+    monkeypatch.setattr(iptables, 'read_toml_file', lambda file: reads.append(file) or read_toml_file(file))
+    management = Management()
+
+    rules = management._compile_file(config)
+    assert management._compile_file(config) == rules
+    assert len(reads) == 1
+
+    write_config(os.path.dirname(config), 'ssh.toml', ['10.0.0.2'])
+
+    assert management._compile_file(config) != rules
+    assert len(reads) == 2
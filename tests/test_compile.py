@@ -0,0 +1,42 @@
+import subprocess
+import pytest
+from iptables_tools.controls.iptables import Management
+from .conftest import write_config
+
+
+@pytest.fixture
+def compiled(project, monkeypatch):
+    """
+    Record the files compiled from their TOML
+    """
+    write_config(project['config-available'], 'a.toml', ['10.0.0.1'])
+    write_config(project['config-available'], 'b.toml', ['10.0.0.2'], port=80)
+
+    files = []
+    compile_file = Management._compile_file
+
+    def record(self, file):
+        files.append(file)
+        return compile_file(self, file)
+
+    monkeypatch.setattr(Management, '_compile_file', record)
+    monkeypatch.setattr(
+        Management, '_run_subprocess',
+        lambda self, *args, **kwargs: subprocess.CompletedProcess(args, 0, '', '')
+    )
+
+    return files
+
+@pytest.mark.parametrize('restart_mode', ['reconcile', 'rebuild'])
+def test_each_file_is_compiled_once(compiled, restart_mode):
+    management = Management(use_cache=False, restart_mode=restart_mode)
+    management.start_setup()
+
+    assert len(compiled) == 2
+
+    compiled.clear()
+    management.restart_setup()
+
+    # The active files are compiled for the delete side, the available
+    # files once for the conflict check and the apply
+    assert len(compiled) == 4
@@ -0,0 +1,60 @@
+import os
+from iptables_tools.controls import compiled
+from iptables_tools.controls.compiled import file_stamp, load_compiled, load_compiled_sets, save_compiled
+from iptables_tools.controls.iptables import Management
+from .conftest import write_config
+
+
+RULES = [['iptables', '-I', 'INPUT', '-s 10.0.0.1', '-j ACCEPT']]
+
+def compiled_management(monkeypatch):
+    management = Management()
+    compiled_files = []
+    compile_file = management._compile_file
+    monkeypatch.setattr(management, '_compile_file', lambda file: compiled_files.append(file) or compile_file(file))
+
+    return management, compiled_files
+
+def test_snapshot_round_trip(project):
+    save_compiled('flat', {'ssh.toml': ((1, 2), RULES)}, {'set': RULES[0]})
+
+    assert load_compiled('flat') == {'ssh.toml': ((1, 2), RULES)}
+    assert load_compiled_sets('flat') == {'set': RULES[0]}
+
+def test_snapshot_of_another_layout_is_ignored(project):
+    save_compiled('flat', {'ssh.toml': ((1, 2), RULES)})
+
+    assert load_compiled('chains') == {}
+
+def test_snapshot_of_another_version_is_ignored(project, monkeypatch):
+    save_compiled('flat', {'ssh.toml': ((1, 2), RULES)})
+    monkeypatch.setattr(compiled, 'tool_version', lambda: '99.0.0')
+
+    assert load_compiled('flat') == {}
+
+def test_corrupted_snapshot_is_ignored(project):
+    with open(compiled.compiled_path(), 'wb') as f:
+        f.write(b'\x00')
+
+    assert load_compiled('flat') == {}
+
+def test_unchanged_active_files_are_not_compiled(project, monkeypatch):
+    write_config(project['config-active'], 'ssh.toml', ['10.0.0.1'])
+    Management()._save_active_rules()
+    management, compiled_files = compiled_management(monkeypatch)
+
+    assert management._active_rules()
+    assert compiled_files == []
+
+def test_changed_active_file_is_compiled_again(project, monkeypatch):
+    config = write_config(project['config-active'], 'ssh.toml', ['10.0.0.1'])
+    write_config(project['config-active'], 'web.toml', ['10.0.0.2'], port=80)
+    Management()._save_active_rules()
+
+    write_config(project['config-active'], 'ssh.toml', ['10.0.0.3'])
+    stamp = file_stamp(config)
+    os.utime(config, ns=(stamp[1] + 1, stamp[1] + 1))
+    management, compiled_files = compiled_management(monkeypatch)
+
+    assert any('-s 10.0.0.3' in rule for rule in management._active_rules())
+    assert compiled_files == [config]
@@ -0,0 +1,75 @@
+import os
+import subprocess
+import pytest
+from iptables_tools.controls.daemon import Daemon
+from iptables_tools.controls.iptables import Management
+from .conftest import write_config
+
+
+@pytest.fixture
+def daemon(project, monkeypatch):
+    available = project['config-available']
+    write_config(available, 'a.toml', ['10.0.0.1'])
+    write_config(available, 'b.toml', ['10.0.0.2'])
+
+    management = Management(use_cache=False)
+    diffs = []
+    monkeypatch.setattr(management, '_run_subprocess', lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, '', ''))
+    monkeypatch.setattr(management, '_apply_diff', lambda active, available: diffs.append((active, available)))
+
+    daemon = Daemon(management)
+    daemon.start()
+    daemon.diffs = diffs
+
+    return daemon
+
+def sources(list_rules):
+    return sorted(fragment for rule in list_rules for fragment in rule[3:] if fragment.startswith('-s '))
+
+def test_deleted_file_rules_are_removed(daemon, project):
+    os.remove(f"{project['config-available']}/b.toml")
+
+    daemon.reload({'b.toml'})
+    [(active, available)] = daemon.diffs
+
+    assert sources(active) == ['-s 10.0.0.1', '-s 10.0.0.2']
+    assert sources(available) == ['-s 10.0.0.1']
+    assert sources(daemon.ruleset()) == ['-s 10.0.0.1']
+
+def test_edited_file_rules_are_replaced(daemon, project):
+    write_config(project['config-available'], 'b.toml', ['10.0.0.3'])
+
+    daemon.reload({'b.toml'})
+    [(active, available)] = daemon.diffs
+
+    assert sources(active) == ['-s 10.0.0.1', '-s 10.0.0.2']
+    assert sources(available) == ['-s 10.0.0.1', '-s 10.0.0.3']
+
+def test_added_file_rules_are_inserted(daemon, project):
+    write_config(project['config-available'], 'c.toml', ['10.0.0.4'])
+
+    daemon.reload({'c.toml'})
+    [(active, available)] = daemon.diffs
+
+    assert sources(active) == ['-s 10.0.0.1', '-s 10.0.0.2']
+    assert sources(available) == ['-s 10.0.0.1', '-s 10.0.0.2', '-s 10.0.0.4']
+    assert os.path.isfile(f"{project['config-active']}/c.toml")
+
+def test_rules_are_kept_when_the_file_is_invalid(daemon, project):
+    with open(f"{project['config-available']}/b.toml", 'w') as f:
+        f.write('[b.input]\nchain = "INPUT"\n')
+
+    daemon.reload({'b.toml'})
+
+    assert daemon.diffs == []
+    assert sources(daemon.ruleset()) == ['-s 10.0.0.1', '-s 10.0.0.2']
+
+def test_reloads_do_not_store_snapshots(daemon, project):
+    stored = daemon.management.snapshot_names()
+
+    for source in ['10.0.0.3', '10.0.0.4']:
+        write_config(project['config-available'], 'b.toml', [source])
+        daemon.reload({'b.toml'})
+
+    assert daemon.management.snapshot is not None
+    assert daemon.management.snapshot_names() == stored
@@ -0,0 +1,94 @@
+from iptables_tools.controls.feeds import (
+    MIN_MAXELEM, feed_mapping, maxelem, parse_ipset_save, read_feed, render_feed_payload, rule_feeds
+)
+
+
+def test_read_feed_collapses_the_networks(tmp_path):
+    path = tmp_path / 'feed.csv'
+    path.write_text('\n'.join([
+        'network,score',
+        '# comment',
+        '10.0.0.0/25,1',
+        '"10.0.0.128/25",2',
+        '10.0.0.7 # already covered',
+        '192.0.2.1',
+        '2001:db8::/33',
+        '2001:db8:8000::/33',
+        '0.0.0.0/0',
+        'not an address',
+        '',
+    ]))
+
+    networks, skipped = read_feed(str(path))
+
+    assert networks == {4: ['10.0.0.0/24', '192.0.2.1/32'], 6: ['2001:db8::/32']}
+    assert skipped == 3
+
+def test_unaligned_range_is_split_in_networks(tmp_path):
+    path = tmp_path / 'feed.txt'
+    path.write_text('10.0.0.1\n10.0.0.2\n10.0.0.3 ignored column\n')
+
+    assert read_feed(str(path))[0][4] == ['10.0.0.1/32', '10.0.0.2/31']
+
+def test_rule_feeds_reads_the_sets_of_the_rules():
+    mapping = feed_mapping('feeds/bad.txt', 'iptables')
+    rule = (
+        'iptables', '-I', 'INPUT',
+        f"-m set --match-set {mapping['set']} {mapping['direction']}",
+        f"-m comment --comment \"{mapping['comment']}\"",
+        '-j DROP'
+    )
+
+    assert rule_feeds([rule]) == {mapping['set']: {
+        'name': mapping['set'],
+        'family': 'inet',
+        'version': 4,
+        'path': mapping['comment'].split(' ', 1)[1],
+    }}
+
+def test_feed_names_depend_on_the_family():
+    assert feed_mapping('bad.txt', 'iptables')['set'] != feed_mapping('bad.txt', 'ip6tables')['set']
+    assert feed_mapping({'file': 'bad.txt', 'direction': 'dst'}, 'iptables')['direction'] == 'dst'
+
+def test_parse_ipset_save():
+    output = '\n'.join([
+        'create bad hash:net family inet hashsize 1024 maxelem 65536',
+        'add bad 10.0.0.1',
+        'add bad 10.0.1.0/24',
+        'add other 10.0.0.1',
+    ])
+
+    assert parse_ipset_save(output) == {'bad': {'maxelem': 65536, 'members': {'10.0.0.1/32', '10.0.1.0/24'}}}
+
+def test_maxelem_has_room_to_grow():
+    assert maxelem(10) == MIN_MAXELEM
+    assert maxelem(100000) == 262144
+
+def feed(members):
+    return {'bad': {'name': 'bad', 'family': 'inet', 'members': members}}
+
+def test_new_set_is_created():
+    assert render_feed_payload(feed(['10.0.0.0/24']), {}).splitlines() == [
+        f'create bad hash:net family inet maxelem {MIN_MAXELEM}',
+        'add bad 10.0.0.0/24',
+    ]
+
+def test_loaded_set_receives_the_differences():
+    loaded = {'bad': {'maxelem': MIN_MAXELEM, 'members': {'10.0.0.0/24', '10.0.1.0/24'}}}
+
+    assert render_feed_payload(feed(['10.0.0.0/24', '10.0.2.0/24']), loaded).splitlines() == [
+        'del bad 10.0.1.0/24',
+        'add bad 10.0.2.0/24',
+    ]
+
+def test_small_set_is_swapped():
+    loaded = {'bad': {'maxelem': 1, 'members': {'10.0.0.0/24'}}}
+
+    assert render_feed_payload(feed(['10.0.0.0/24', '10.0.1.0/24']), loaded).splitlines() == [
+        f'create bad_t hash:net family inet maxelem {MIN_MAXELEM}',
+        'flush bad_t',
+        'add bad_t 10.0.0.0/24',
+        'add bad_t 10.0.1.0/24',
+        'swap bad_t bad',
+        'destroy bad_t',
+    ]
@@ -0,0 +1,61 @@
+from iptables_tools.controls.ipset import compact_rules, render_ipset_payload
+from .conftest import mapping_rule as rule
+
+
+def test_below_threshold_is_unchanged():
+    list_rules = [rule('10.0.0.1'), rule('10.0.0.2')]
+
+    assert compact_rules(list_rules, 3) == (list_rules, {})
+
+def test_run_is_compacted():
+    list_rules = [rule(f'10.0.0.{index}', comment=f'host {index}') for index in range(3)]
+
+    compacted, ipsets = compact_rules(list_rules, 3)
+
+    [ipset] = ipsets.values()
+    assert compacted == [(
+        'iptables', '-I', 'INPUT', '-p tcp -m tcp', '--dport 22',
+        f"-m set --match-set {ipset['name']} src", f'-m comment --comment "{ipset["name"]}"',
+        '-j ACCEPT'
+    )]
+    assert ipset['family'] == 'inet'
+    assert ipset['members'] == [(f'10.0.0.{index}', f'"host {index}"') for index in range(3)]
+
+def test_runs_with_the_same_key_get_their_own_set():
+    list_rules = [
+        *[rule(f'10.0.0.{index}') for index in range(3)],
+        rule('192.0.2.1', target='-j DROP'),
+        *[rule(f'10.0.1.{index}') for index in range(3)],
+    ]
+
+    compacted, ipsets = compact_rules(list_rules, 3)
+
+    assert len(compacted) == 3
+    assert len(ipsets) == 2
+    first, second = ipsets.values()
+    assert [member for member, _ in first['members']] == ['10.0.0.0', '10.0.0.1', '10.0.0.2']
+    assert [member for member, _ in second['members']] == ['10.0.1.0', '10.0.1.1', '10.0.1.2']
+
+def test_set_names_are_stable():
+    list_rules = [rule(f'10.0.0.{index}') for index in range(3)]
+
+    assert compact_rules(list_rules, 3)[1].keys() == compact_rules(list(list_rules), 3)[1].keys()
+
+def test_zero_length_prefix_is_not_compacted():
+    list_rules = [rule('0.0.0.0/0', port=f'--dport {port}') for port in range(3)]
+
+    assert compact_rules(list_rules, 2) == (list_rules, {})
+
+def test_payload_swaps_the_members():
+    _, ipsets = compact_rules([rule(f'10.0.0.{index}') for index in range(2)], 2)
+    [name] = ipsets
+
+    assert render_ipset_payload(ipsets).splitlines() == [
+        f'create {name} hash:net family inet comment',
+        f'create {name}_t hash:net family inet comment',
+        f'flush {name}_t',
+        f'add {name}_t 10.0.0.0',
+        f'add {name}_t 10.0.0.1',
+        f'swap {name}_t {name}',
+        f'destroy {name}_t',
+    ]
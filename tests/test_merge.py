@@ -0,0 +1,64 @@
+from iptables_tools.controls.merge import compile_order, evaluation_order, file_priority, find_conflicts
+from .conftest import rule
+
+
+def write(path, text=''):
+    path.write_text(text)
+    return str(path)
+
+def test_file_priority(tmp_path):
+    assert file_priority(write(tmp_path / 'web.toml')) == 50
+    assert file_priority(write(tmp_path / '10-ssh.toml')) == 10
+    assert file_priority(write(tmp_path / '10-db.toml', 'priority = 90\n[db.input]\n')) == 90
+
+def test_priority_key_after_a_section_is_ignored(tmp_path):
+    assert file_priority(write(tmp_path / 'web.toml', '[web.input]\npriority = 1\n')) == 50
+
+def test_files_evaluated_first_are_compiled_last(tmp_path):
+    files = [write(tmp_path / name) for name in ['web.toml', '10-ssh.toml', '90-deny.toml']]
+
+    assert evaluation_order(files) == [files[1], files[0], files[2]]
+    assert compile_order(files) == [files[2], files[0], files[1]]
+
+def test_shadowed_rule_of_another_file():
+    drop = rule('-p tcp -m tcp --dport 22 -j DROP')
+    accept = rule('-s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT')
+
+    # deny.toml is compiled last, so its rules are evaluated first
+    conflicts = find_conflicts([('ssh.toml', [accept]), ('deny.toml', [drop])])
+
+    assert conflicts == [('shadowed', accept, 'ssh.toml', drop, 'deny.toml')]
+
+def test_partial_overlap_is_a_conflict():
+    accept = rule('-s 10.0.0.0/24 -p tcp -m tcp --dport 22 -j ACCEPT')
+    drop = rule('-s 10.0.0.1/32 -p tcp -j DROP')
+
+    conflicts = find_conflicts([('ssh.toml', [accept]), ('deny.toml', [drop])])
+
+    assert conflicts == [('conflict', accept, 'ssh.toml', drop, 'deny.toml')]
+
+def test_rules_of_the_same_file_or_target_do_not_conflict():
+    drop = rule('-p tcp -m tcp --dport 22 -j DROP')
+    accept = rule('-s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT')
+
+    assert find_conflicts([('ssh.toml', [accept, drop])]) == []
+    assert find_conflicts([('ssh.toml', [accept]), ('other.toml', [accept])]) == []
+
+def test_disjoint_rules_do_not_conflict():
+    drop = rule('-p tcp -m tcp --dport 80 -j DROP')
+    accept = rule('-s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT')
+
+    assert find_conflicts([('ssh.toml', [accept]), ('web.toml', [drop])]) == []
+
+def test_rules_of_a_service_chain_are_evaluated_at_the_jump():
+    chain = 'IPT_TOOLS_ssh_input'
+    accept = rule('-s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT', chain=chain)
+    jump = rule(f'-p tcp -m tcp --dport 22 -j {chain}')
+    drop = rule('-p tcp -m tcp --dport 22 -j DROP')
+
+    conflicts = find_conflicts([
+        ('ssh.toml', [('iptables', '-N', chain), accept, jump]),
+        ('deny.toml', [drop]),
+    ])
+
+    assert conflicts == [('shadowed', accept, 'ssh.toml', drop, 'deny.toml')]
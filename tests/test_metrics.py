@@ -0,0 +1,48 @@
+import fcntl
+import os
+import pytest
+from iptables_tools.controls import metrics
+from iptables_tools.controls.metrics import Metrics, xtables_lock_busy
+
+
+@pytest.fixture
+def lock(tmp_path, monkeypatch):
+    path = tmp_path / 'xtables.lock'
+    path.touch()
+    monkeypatch.setattr(metrics, 'XTABLES_LOCK', str(path))
+
+    descriptor = os.open(path, os.O_RDONLY)
+    yield descriptor
+    os.close(descriptor)
+
+@pytest.mark.skipif(not os.path.exists(metrics.PROC_LOCKS), reason='requires /proc/locks')
+def test_held_lock_is_busy(lock):
+    assert not xtables_lock_busy(['iptables-restore', '--noflush'])
+
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    assert xtables_lock_busy(['iptables-restore', '--noflush'])
+    assert xtables_lock_busy(['ip6tables', '-D', 'INPUT', '1'])
+
+def test_other_commands_are_not_probed(lock):
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    assert not xtables_lock_busy(['ipset', 'restore'])
+    assert not xtables_lock_busy([])
+
+def test_missing_lock_is_not_busy(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, 'XTABLES_LOCK', str(tmp_path / 'missing'))
+
+    assert not xtables_lock_busy(['iptables', '-L'])
+
+def test_summary_counts_the_phases():
+    run = Metrics()
+
+    with run.phase('compile'):
+        run.count('files_read', 2)
+
+    summary = run.summary(method='start')
+
+    assert summary['method'] == 'start'
+    assert summary['counters'] == {'files_read': 2}
+    assert summary['phases']['compile']['calls'] == 1
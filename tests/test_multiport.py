@@ -0,0 +1,52 @@
+from iptables_tools.controls.multiport import (
+    MULTIPORT_LIMIT, chunk_ports, format_ports, merge_ports, parse_ports, port_slots
+)
+from .conftest import mapping_rule as rule
+
+
+SOURCE = '10.0.0.1'
+
+def test_parse_ports():
+    assert parse_ports(['80', 443, '8000:8010', '9000-9001']) == [
+        (80, 80), (443, 443), (8000, 8010), (9000, 9001)
+    ]
+    assert parse_ports('22') == [(22, 22)]
+
+def test_ranges_use_two_slots():
+    assert port_slots([(80, 80), (8000, 8010)]) == 3
+
+def test_chunks_fit_in_a_multiport_match():
+    chunks = chunk_ports([(port, port) for port in range(20)])
+
+    assert [len(chunk) for chunk in chunks] == [MULTIPORT_LIMIT, 5]
+    assert format_ports(chunks[1]) == '-m multiport --dports 15,16,17,18,19'
+    assert format_ports([(22, 22)]) == '--dport 22'
+
+def test_rules_with_the_same_match_are_merged():
+    list_rules = [rule(SOURCE, '--dport 80'), rule(SOURCE, '--dport 443')]
+
+    assert merge_ports(list_rules) == [rule(SOURCE, '-m multiport --dports 80,443')]
+
+def test_merged_rule_takes_the_place_of_its_last_rule():
+    other = rule('10.0.0.2')
+    list_rules = [rule(SOURCE, '--dport 80'), other, rule(SOURCE, '--dport 443')]
+
+    assert merge_ports(list_rules) == [other, rule(SOURCE, '-m multiport --dports 80,443')]
+
+def test_overlapping_rule_with_other_target_closes_the_group():
+    list_rules = [rule(SOURCE, '--dport 80'), rule(port='--dport 80', target='-j DROP'), rule(SOURCE, '--dport 443')]
+
+    assert merge_ports(list_rules) == list_rules
+
+def test_group_is_split_at_the_multiport_limit():
+    list_rules = [rule(SOURCE, f'--dport {port}') for port in range(1, MULTIPORT_LIMIT + 2)]
+
+    merged = merge_ports(list_rules)
+
+    assert len(merged) == 2
+    assert merged[1] == rule(SOURCE, f'--dport {MULTIPORT_LIMIT + 1}')
+
+def test_other_target_is_not_merged():
+    list_rules = [rule(SOURCE, '--dport 80'), rule(SOURCE, '--dport 443', target='-j DROP')]
+
+    assert merge_ports(list_rules) == list_rules
@@ -0,0 +1,71 @@
+import pytest
+from iptables_tools.controls.nftables import render_delete_script, render_nft_script
+from .conftest import mapping_rule, rule
+
+
+def statements(list_rules):
+    """
+    Return the statements of the rules in the INPUT chain
+    """
+    lines = render_nft_script(list_rules).splitlines()
+    start = lines.index('\tchain INPUT {') + 2
+
+    return [line.strip() for line in lines[start:lines.index('\t}', start)]]
+
+def test_script_replaces_the_table():
+    script = render_nft_script([mapping_rule('10.0.0.1')])
+
+    assert script.startswith(render_delete_script())
+    assert '\t\ttype filter hook input priority filter; policy accept;' in script.splitlines()
+
+def test_rules_are_in_evaluation_order():
+    list_rules = [mapping_rule(port='--dport 22', target='-j DROP'), mapping_rule('10.0.0.1')]
+
+    assert statements(list_rules) == [
+        'ip saddr 10.0.0.1/32 tcp dport 22 counter accept',
+        'meta nfproto ipv4 tcp dport 22 counter drop',
+    ]
+
+def test_consecutive_sources_share_a_set():
+    list_rules = [mapping_rule('10.0.0.1', comment='a'), mapping_rule('10.0.0.2', comment='b')]
+
+    assert statements(list_rules) == ['ip saddr { 10.0.0.1/32, 10.0.0.2/32 } tcp dport 22 counter accept comment "b"']
+
+def test_families_share_a_rule():
+    list_rules = [mapping_rule(target='-j DROP', binary=binary) for binary in ['iptables', 'ip6tables']]
+
+    assert statements(list_rules) == ['tcp dport 22 counter drop']
+
+def test_rules_on_other_ports_are_not_merged():
+    list_rules = [mapping_rule('10.0.0.1', port='--dport 80'), mapping_rule('10.0.0.1', port='--dport 443')]
+
+    assert statements(list_rules) == [
+        'ip saddr 10.0.0.1/32 tcp dport 443 counter accept',
+        'ip saddr 10.0.0.1/32 tcp dport 80 counter accept',
+    ]
+
+def test_rules_with_other_verdicts_are_not_merged():
+    list_rules = [mapping_rule('10.0.0.1', target='-j DROP'), mapping_rule('10.0.0.1')]
+
+    assert len(statements(list_rules)) == 2
+
+def test_multiport_and_ranges():
+    list_rules = [mapping_rule(port='-m multiport --dports 80,8000:8010')]
+
+    assert statements(list_rules) == ['meta nfproto ipv4 tcp dport { 80, 8000-8010 } counter accept']
+
+def test_service_chains_are_declared_first():
+    chain = 'IPT_TOOLS_ssh_input'
+    list_rules = [
+        rule(chain=chain, operation='-N'),
+        rule('-s 10.0.0.1', '-j ACCEPT', chain=chain),
+        rule('-p tcp -m tcp', '--dport 22', f'-j {chain}'),
+    ]
+    lines = render_nft_script(list_rules).splitlines()
+
+    assert lines.index(f'\tchain {chain} {{') < lines.index('\tchain INPUT {')
+    assert statements(list_rules) == [f'meta nfproto ipv4 tcp dport 22 counter jump {chain}']
+
+def test_unsupported_option():
+    with pytest.raises(ValueError, match='not supported by the nftables backend'):
+        render_nft_script([rule('-m state --state NEW', '-j ACCEPT')])
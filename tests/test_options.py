@@ -0,0 +1,44 @@
+import json
+import subprocess
+import pytest
+from iptables_tools.controls.compiled import options_path
+from iptables_tools.controls.iptables import Management
+from .conftest import write_config
+
+
+def management(monkeypatch, **options):
+    management = Management(use_cache=False, **options)
+    monkeypatch.setattr(management, '_run_subprocess', lambda *args, **kwargs: subprocess.CompletedProcess(args, 0, '', ''))
+    return management
+
+@pytest.fixture
+def started(project, monkeypatch):
+    write_config(project['config-available'], 'ssh.toml', ['10.0.0.1', '10.0.0.2'])
+    management(monkeypatch, layout='chains', multiport=True, ipset_threshold=2).start_setup()
+
+def test_start_saves_the_options(started):
+    with open(options_path()) as f:
+        assert json.load(f) == {'layout': 'chains', 'aggregate': False, 'multiport': True, 'ipset_threshold': 2}
+
+def test_options_default_to_the_saved_ones(started, monkeypatch):
+    options = management(monkeypatch)
+
+    assert (options.layout, options.aggregate, options.multiport, options.ipset_threshold) == ('chains', False, True, 2)
+
+def test_passed_options_win(started, monkeypatch):
+    options = management(monkeypatch, layout='flat', multiport=False, ipset_threshold=0)
+
+    assert (options.layout, options.multiport, options.ipset_threshold) == ('flat', False, 0)
+
+def test_active_rules_use_the_saved_options(started, monkeypatch):
+    applied = management(monkeypatch, layout='flat', ipset_threshold=0)._applied_management()
+    list_rules, ipsets = applied._optimize_rules(applied._active_rules())
+
+    assert any(rule[1] == '-N' for rule in list_rules)
+    assert len(ipsets) == 1
+
+def test_without_saved_options_the_defaults_are_used(project, monkeypatch):
+    options = management(monkeypatch)
+
+    assert options._applied_management() is options
+    assert (options.layout, options.aggregate, options.multiport, options.ipset_threshold) == ('flat', False, False, 0)
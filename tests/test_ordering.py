@@ -0,0 +1,61 @@
+from iptables_tools.controls.ordering import order_key, order_rules, rule_covers, rule_match, rules_overlap
+from .conftest import rule
+
+
+A = '-s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT'
+B = '-s 10.0.0.2/32 -p tcp -m tcp --dport 22 -j ACCEPT'
+DROP = '-p tcp -m tcp --dport 22 -j DROP'
+
+def test_without_hits_the_order_is_kept():
+    list_rules = [rule(A), rule(B)]
+
+    assert order_rules(list_rules, {}) == list_rules
+
+def test_rule_with_more_hits_is_evaluated_first():
+    # Rules inserted with -I are evaluated from the last one
+    list_rules = [rule(A), rule(B)]
+
+    assert order_rules(list_rules, {order_key(rule(A)): 10}) == [rule(B), rule(A)]
+
+def test_appended_rules_are_evaluated_from_the_first():
+    list_rules = [rule(A, operation='-A'), rule(B, operation='-A')]
+
+    assert order_rules(list_rules, {order_key(rule(B, operation='-A')): 10}) == [rule(B, operation='-A'), rule(A, operation='-A')]
+
+def test_overlapping_rules_with_other_targets_keep_their_order():
+    list_rules = [rule(DROP), rule(A)]
+
+    assert order_rules(list_rules, {order_key(rule(DROP)): 100}) == list_rules
+
+def test_chain_commands_keep_their_place():
+    chain = ('iptables', '-N', 'IPT_TOOLS_x')
+    list_rules = [chain, rule(A), rule(B)]
+
+    assert order_rules(list_rules, {order_key(rule(A)): 10})[0] == chain
+
+def test_order_key_is_normalized():
+    assert order_key(rule(A)) == order_key(('iptables', '-I', 'INPUT', '-s 10.0.0.1', '-p tcp -m tcp --dport 22', '-j ACCEPT'))
+
+def test_rule_match():
+    match = rule_match(rule(A))
+
+    assert str(match.pop('src')) == '10.0.0.1/32'
+    assert match == {'target': 'ACCEPT', 'dst': None, 'protocol': 'tcp', 'ports': [(22, 22)], 'set': None}
+
+def test_overlap_and_cover():
+    assert not rules_overlap(rule_match(rule(A)), rule_match(rule(B)))
+    assert rules_overlap(rule_match(rule(DROP)), rule_match(rule(A)))
+    assert rule_covers(rule_match(rule(DROP)), rule_match(rule(A)))
+    assert not rule_covers(rule_match(rule(A)), rule_match(rule(DROP)))
+
+def test_rules_on_other_ports_can_move():
+    other = '-p tcp -m tcp --dport 80 -j DROP'
+    list_rules = [rule(other), rule(A)]
+
+    assert order_rules(list_rules, {order_key(rule(other)): 100}) == [rule(A), rule(other)]
+
+def test_rule_without_source_stays_before_the_rules_it_overlaps():
+    accept = '-s 10.0.0.0/24 -p tcp -m tcp --dport 22 -j ACCEPT'
+    list_rules = [rule(A), rule(accept), rule(DROP)]
+
+    assert order_rules(list_rules, {order_key(rule(A)): 100}) == [rule(accept), rule(A), rule(DROP)]
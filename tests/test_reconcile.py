@@ -0,0 +1,149 @@
+from iptables_tools.controls.kernel import KernelState
+from iptables_tools.controls.reconcile import diff_rules
+from .conftest import rule
+
+
+def loaded(*specs, chains=()):
+    lines = ['*filter', ':INPUT ACCEPT [0:0]', *(f':{chain} - [0:0]' for chain in chains)]
+    lines.extend(spec if spec.startswith('-A ') else f'-A INPUT {spec}' for spec in specs)
+    return KernelState.from_save({'ipv4': '\n'.join([*lines, 'COMMIT', ''])})
+
+def apply(state, deletes, inserts):
+    """
+    Return the INPUT chain after running the commands like iptables does
+    """
+    chain = [' '.join(spec) for spec in state.chain_rules('iptables', 'INPUT')]
+
+    for _, _, _, spec in deletes:
+        chain.remove(spec)
+
+    for _, _, _, position, spec in inserts:
+        chain.insert(int(position) - 1, spec)
+
+    return chain
+
+# Rules are inserted with -I, so the last compiled rule is evaluated first
+A = '-s 10.0.0.1/32 -j ACCEPT'
+B = '-s 10.0.0.2/32 -j ACCEPT'
+C = '-s 10.0.0.3/32 -j ACCEPT'
+DROP = '-j DROP'
+FAIL2BAN = '-p tcp -m multiport --dports 22 -j f2b-sshd'
+
+def test_unchanged_rules():
+    active = [rule(DROP), rule(A)]
+
+    deletes, inserts, unchanged = diff_rules(active, active, loaded(A, DROP))
+
+    assert (deletes, inserts, unchanged) == ([], [], 2)
+
+def test_insert_below_unmanaged_rule_on_top():
+    state = loaded(FAIL2BAN, A, DROP)
+
+    deletes, inserts, unchanged = diff_rules(
+        [rule(DROP), rule(A)],
+        [rule(DROP), rule(B), rule(A)],
+        state
+    )
+
+    assert deletes == []
+    assert unchanged == 2
+    assert apply(state, deletes, inserts) == [FAIL2BAN, A, B, DROP]
+
+def test_first_rule_stays_below_unmanaged_rule():
+    state = loaded(FAIL2BAN, A, DROP)
+
+    deletes, inserts, _ = diff_rules(
+        [rule(DROP), rule(A)],
+        [rule(DROP), rule(A), rule(C)],
+        state
+    )
+
+    assert apply(state, deletes, inserts) == [FAIL2BAN, C, A, DROP]
+
+def test_replace_between_unmanaged_rules():
+    state = loaded(FAIL2BAN, A, '-s 192.0.2.1/32 -j DROP', B, DROP)
+
+    deletes, inserts, _ = diff_rules(
+        [rule(DROP), rule(B), rule(A)],
+        [rule(DROP), rule(C), rule(A)],
+        state
+    )
+
+    assert deletes == [('iptables', '-D', 'INPUT', B)]
+    assert apply(state, deletes, inserts) == [FAIL2BAN, A, C, '-s 192.0.2.1/32 -j DROP', DROP]
+
+def test_move_rule():
+    state = loaded(FAIL2BAN, A, B, C)
+
+    deletes, inserts, unchanged = diff_rules(
+        [rule(C), rule(B), rule(A)],
+        [rule(B), rule(A), rule(C)],
+        state
+    )
+
+    assert unchanged == 2
+    assert apply(state, deletes, inserts) == [FAIL2BAN, C, A, B]
+
+def test_duplicate_rules():
+    state = loaded(A, B, A)
+
+    deletes, inserts, _ = diff_rules(
+        [rule(A), rule(B), rule(A)],
+        [rule(A), rule(C), rule(B), rule(A)],
+        state
+    )
+
+    assert apply(state, deletes, inserts) == [A, B, C, A]
+
+def test_active_rule_missing_from_the_kernel_is_inserted():
+    state = loaded(FAIL2BAN, DROP)
+
+    deletes, inserts, unchanged = diff_rules(
+        [rule(DROP), rule(A)],
+        [rule(DROP), rule(B), rule(A)],
+        state
+    )
+
+    assert deletes == []
+    assert unchanged == 1
+    assert apply(state, deletes, inserts) == [FAIL2BAN, A, B, DROP]
+
+def test_without_state_active_rules_are_loaded():
+    _, inserts, _ = diff_rules(
+        [rule(DROP), rule(A)],
+        [rule(DROP), rule(B), rule(A)]
+    )
+
+    assert inserts == [('iptables', '-I', 'INPUT', '2', B)]
+
+def test_service_chains_are_refilled():
+    chain = 'IPT_TOOLS_ssh_allow'
+    active = [('iptables', '-N', chain), ('iptables', '-I', chain, A), rule(f'-j {chain}')]
+    available = [('iptables', '-N', chain), ('iptables', '-I', chain, B), rule(f'-j {chain}')]
+
+    state = loaded(f'-A {chain} {A}', f'-j {chain}', chains=[chain])
+
+    deletes, inserts, unchanged = diff_rules(active, available, state)
+
+    assert deletes == []
+    assert inserts == [('iptables', '-F', chain), ('iptables', '-I', chain, B)]
+    assert unchanged == 1
+
+def test_loaded_rule_is_not_inserted_twice():
+    state = loaded(FAIL2BAN, B, A, DROP)
+
+    deletes, inserts, unchanged = diff_rules(
+        [rule(DROP), rule(A)],
+        [rule(DROP), rule(A), rule(B)],
+        state
+    )
+
+    assert (deletes, inserts, unchanged) == ([], [], 3)
+
+def test_kernel_order_is_compared():
+    state = loaded(DROP, A)
+
+    deletes, inserts, _ = diff_rules([rule(DROP), rule(A)], [rule(DROP), rule(A)], state)
+
+    assert len(deletes) == 1
+    assert apply(state, deletes, inserts) == [A, DROP]
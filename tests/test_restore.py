@@ -0,0 +1,18 @@
+from iptables_tools.controls.restore import failed_transaction
+
+
+def test_legacy_failed_line():
+    assert failed_transaction('iptables-restore: line 5 failed\n') == 1
+
+def test_nft_failed_line():
+    stderr = (
+        'iptables-restore v1.8.7 (nf_tables): unknown option "--dportt"\n'
+        'Error occurred at line: 8\n'
+        "Try `iptables-restore -h' or 'iptables-restore --help' for more information.\n"
+    )
+
+    assert failed_transaction(stderr) == 2
+
+def test_output_without_line():
+    assert failed_transaction('iptables-restore: unable to initialize table\n') is None
+    assert failed_transaction(None) is None